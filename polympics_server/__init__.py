@@ -7,6 +7,7 @@ from .routes import server as application    # noqa:F401
 
 LOGS = (
     ('peewee', config.DB_LOG_LEVEL),
+    ('polympics_server', logging.INFO),
 )
 for log, level in LOGS:
     logger = logging.getLogger(log)
@@ -1,27 +1,22 @@
 """Command line interface for managing the server."""
 from __future__ import annotations
 
-import importlib
-import os
+import asyncio
 import sys
-from datetime import datetime
-
-from playhouse.migrate import PostgresqlMigrator
+from datetime import datetime, timedelta
+from typing import Optional
 
+from . import (
+    benchmarks, config, fake_discord, profiles, query_plans, requests
+)
 from .cli_parser import Argument, CommandGroup, command, parse
-from .config import BASE_PATH
-from .models import Account, App, Session, db
-
-
-PERMISSIONS = [
-    'manage_permissions', 'manage_account_teams', 'manage_account_details',
-    'manage_teams', 'authenticate_users', 'manage_own_team', 'manage_awards'
-]
-MIGRATIONS = [
-    file_name[:-3] for file_name in
-    os.listdir(BASE_PATH / 'polympics_server' / 'migrations')
-    if file_name.endswith('.py')
-]
+from .models import (
+    Account, App, ArchivedAccount, ArchivedTeam, Migration, Permissions,
+    Season, Session, Setting
+)
+from .models.migrations import MIGRATIONS
+from .models.permissions import ACCOUNT_PERMISSIONS, APP_PERMISSIONS
+from .shared import state
 
 
 def error(description: str):
@@ -69,10 +64,10 @@ def permission_list(raw: str) -> int:
     value = 0
     for raw_permission in raw.lower().replace('-', '_').split(','):
         try:
-            value |= 1 << PERMISSIONS.index(raw_permission)
-        except ValueError:
+            value |= Permissions[raw_permission.upper()]
+        except KeyError:
             error(f'Unknown permission "{raw_permission}".')
-    return value
+    return int(value)
 
 
 def app_converter(raw: str) -> App:
@@ -101,6 +96,22 @@ def account_converter(raw: str) -> App:
     return account
 
 
+def timedelta_converter(raw: str) -> timedelta:
+    """Parse a length of time, such as "1y" or "26w"."""
+    try:
+        return config.parse_timedelta(raw)
+    except (KeyError, ValueError):
+        error(f'Invalid length of time "{raw}".')
+
+
+def datetime_converter(raw: str) -> datetime:
+    """Parse an ISO 8601 date and time, such as "2021-06-01T12:00"."""
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        error(f'Invalid date and time "{raw}".')
+
+
 AppArgument = Argument(
     'app', type=app_converter, help='The name or ID of the app.'
 )
@@ -108,16 +119,16 @@ AppArgument = Argument(
 
 def show_app(app: App):
     """Display an app on stdout."""
-    permissions = []
-    for n, permission in enumerate(PERMISSIONS):
-        if app.permissions & (1 << n):
-            permissions.append(permission)
-    permissions = ','.join(permissions)
+    permissions = ','.join(
+        permission.name.lower() for permission in Permissions
+        if app.permissions & permission
+    )
     print(
         f'{app.id}: {app.name}\n\n'
         f'Username: A{app.id}\n'
         f'Password: {app.token}\n'
-        f'Permissions: {permissions}'
+        f'Permissions: {permissions}\n'
+        f'Rate limit: {app.requests_per_minute} requests per minute'
     )
 
 
@@ -133,18 +144,23 @@ class Apps(CommandGroup):
         Argument(
             '-a', '--all-permissions', action='store_true',
             help='Grant all permissions to the new app.'
+        ),
+        Argument(
+            '-l', '--rate-limit', type=int,
+            help='Requests per minute allowed for the new app.'
         )
     )
     def create(
-            name: str, grant_permissions: int, all_permissions: bool):
+            name: str, grant_permissions: int, all_permissions: bool,
+            rate_limit: int):
         """Create an app."""
         if all_permissions:
-            permissions = (1 << len(PERMISSIONS)) - 1
-            # An app cannot have the manage_own_team permission.
-            permissions &= ~(1 << PERMISSIONS.index('manage_own_team'))
+            permissions = APP_PERMISSIONS
         else:
             permissions = grant_permissions
-        app = App.create(name=name, permissions=permissions)
+        app = App.create(
+            name=name, permissions=permissions, rate_limit=rate_limit or None
+        )
         show_app(app)
 
     @command(
@@ -161,16 +177,22 @@ class Apps(CommandGroup):
             '-r', '--revoke-permissions', type=permission_list, default=0,
             help='Permissions to revoke from the app.'
         ),
-        Argument('-n', '--name', help='A new name for the app.')
+        Argument('-n', '--name', help='A new name for the app.'),
+        Argument(
+            '-l', '--rate-limit', type=int,
+            help='Requests per minute allowed for the app (0 for default).'
+        )
     )
     def edit(
             app: App, grant_permissions: int, revoke_permissions: int,
-            name: str, reset_token: bool):
+            name: str, reset_token: bool, rate_limit: int):
         """Edit an app."""
         app.permissions |= grant_permissions
         app.permissions &= ~revoke_permissions
         if name:
             app.name = name
+        if rate_limit is not None:
+            app.rate_limit = rate_limit or None
         if reset_token:
             app.reset_token()
         app.save()
@@ -198,10 +220,11 @@ class Sessions(CommandGroup):
 
     @command()
     def prune():
-        """Delete all expired sessions."""
-        q = Session.delete().where(Session.expires_at < datetime.now())
-        count = q.execute()
+        """Delete expired sessions, and sessions past the per-account cap."""
+        count = Session.prune_expired()
         print(f'Deleted {count} expired sessions.')
+        count = Session.evict_excess()
+        print(f'Deleted {count} sessions over the per-account limit.')
 
 
 class Migrations(CommandGroup):
@@ -209,17 +232,14 @@ class Migrations(CommandGroup):
 
     @command(Argument(
         'migrations', type=migration_converter, nargs='*',
-        help='The migrations to apply.'
+        help='The migrations to apply (default: all not yet applied).'
     ))
     def apply(migrations: list[str]):
         """Apply specified migrations."""
-        migrator = PostgresqlMigrator(db)
+        migrations = migrations or Migration.pending()
         for migration in migrations:
             print('Applying migration', migration, end='... ')
-            module = importlib.import_module(
-                '.migrations.' + migration, 'polympics_server'
-            )
-            module.apply(migrator)
+            Migration.apply(migration)
             print('Done')
         print('All migrations successful.')
 
@@ -227,11 +247,13 @@ class Migrations(CommandGroup):
     def list_migrations():
         """List available migrations."""
         print('You can specify a migration by name or ID:\n')
+        pending = Migration.pending()
         for migration in MIGRATIONS:
             raw_number, *name_parts = migration.split('_')
             name = '-'.join(name_parts)
             number = raw_number.lstrip('0')
-            print(f'{number:>3}: {name}')
+            status = ' (not applied)' if migration in pending else ''
+            print(f'{number:>3}: {name}{status}')
 
 
 class Users(CommandGroup):
@@ -242,17 +264,257 @@ class Users(CommandGroup):
     ))
     def superuser(account: Account):
         """Grant an account every permission."""
-        account.manage_permissions = True
-        account.manage_account_teams = True
-        account.manage_account_details = True
-        account.manage_teams = True
-        account.manage_own_team = True
-        account.manage_awards = True
-        account.save()
+        account.update_fields({
+            Account.permissions: Account.permissions.bin_or(
+                ACCOUNT_PERMISSIONS
+            )
+        })
         print(
             f'Made account {account.id} ({account.name}#'
             f'{account.discriminator}) a superuser.'
         )
 
+    @command(
+        Argument(
+            '-b', '--batch-size', type=int,
+            help='The number of accounts to sync per batch (default: the '
+            'profile_sync_batch_size setting).'
+        ),
+        Argument(
+            '-a', '--all', action='store_true', dest='sync_all',
+            help='Sync every account, instead of one batch.'
+        )
+    )
+    def sync(batch_size: Optional[int], sync_all: bool):
+        """Update account names and avatars from Discord."""
+        if not config.DISCORD_BOT_TOKEN:
+            error('No Discord bot token configured.')
+
+        async def run() -> tuple[int, int]:
+            try:
+                return await profiles.sync_profiles(
+                    batch_size, None if sync_all else 1
+                )
+            finally:
+                if requests.session:
+                    await requests.session.close()
+
+        result = asyncio.run(run())
+        if not result:
+            error('The sync is already running in another process.')
+        checked, updated = result
+        print(f'Checked {checked} accounts, {updated} had changed.')
+
+
+class Archive(CommandGroup):
+    """Commands for archiving inactive accounts and teams."""
+
+    @command(
+        Argument(
+            'inactive_for', type=timedelta_converter, nargs='?',
+            help='How long accounts and teams must have been inactive, '
+            'such as "1y".'
+        ),
+        Argument(
+            '-s', '--seasons', type=int,
+            help='Instead, how many of the latest seasons (including the '
+            'current one) accounts and teams must have been inactive for.'
+        ),
+        Argument(
+            '-b', '--batch-size', type=int, default=1000,
+            help='The number of rows to move per transaction.'
+        )
+    )
+    def run(
+            inactive_for: Optional[timedelta], seasons: Optional[int],
+            batch_size: int):
+        """Move inactive accounts, then empty teams, to the archive."""
+        if (inactive_for is None) == (seasons is None):
+            error('Give either a length of time or a number of seasons.')
+        if seasons:
+            season = Season.select().where(
+                Season.starts_at <= datetime.now()
+            ).order_by(Season.starts_at.desc()).offset(seasons - 1).first()
+            if not season:
+                error(f'There have not been {seasons} seasons yet.')
+            cutoff = season.starts_at
+        else:
+            cutoff = datetime.now() - inactive_for
+        count = ArchivedAccount.archive_inactive(cutoff, batch_size)
+        print(f'Archived {count} accounts.')
+        count = ArchivedTeam.archive_inactive(cutoff, batch_size)
+        print(f'Archived {count} teams.')
+
+    @command(Argument('account', type=int, help='The ID of the account.'))
+    def restore(account: int):
+        """Move an archived account back, with its awards."""
+        if not ArchivedAccount.restore(account):
+            error(f'Account {account} is not archived.')
+        print(f'Restored account {account}.')
+
+
+class Seasons(CommandGroup):
+    """Commands for managing seasons."""
+
+    @command(
+        Argument('name', help='The name of the new season.'),
+        Argument(
+            '-a', '--at', type=datetime_converter,
+            help='When the season starts (default: now).'
+        )
+    )
+    def start(name: str, at: Optional[datetime]):
+        """Start a new season, now or later."""
+        if Season.get_or_none(Season.name == name):
+            error(f'There is already a season called "{name}".')
+        season = Season.create(name=name, starts_at=at or datetime.now())
+        state.publish('seasons')
+        print(
+            f'Created season {season.id}. New teams and awards will be in '
+            f'it from {season.starts_at:%Y-%m-%d %H:%M}.'
+        )
+
+    @command(name='list')
+    def list_seasons():
+        """List every season."""
+        for season in Season.select().order_by(Season.starts_at):
+            print(
+                f'{season.id:>3}: {season.name} '
+                f'(from {season.starts_at:%Y-%m-%d %H:%M})'
+            )
+
+
+class Config(CommandGroup):
+    """Commands for changing settings while the server is running."""
+
+    @command()
+    def show():
+        """List the settings overridden in the database."""
+        overrides = Setting.get_overrides()
+        if not overrides:
+            print('No settings are overridden.')
+        for name, value in sorted(overrides.items()):
+            print(f'{name} = {value}')
+
+    @command(
+        Argument('name', help='The name of the setting, as in config.json.'),
+        Argument('value', help='The new value of the setting.'),
+        name='set'
+    )
+    def set_setting(name: str, value: str):
+        """Override a setting on every server, without a restart."""
+        try:
+            Setting.override(name, value)
+        except config.ConfigError as e:
+            error(e)
+        state.publish('settings', name)
+        print(
+            f'Set {name}. Servers will use it within '
+            f'{config.SETTINGS_RELOAD_INTERVAL.total_seconds():g}s, or '
+            'straight away with the database shared state backend.'
+        )
+
+    @command(
+        Argument('name', help='The name of the setting.'), name='unset'
+    )
+    def unset_setting(name: str):
+        """Stop overriding a setting, going back to the config file."""
+        if not Setting.delete_by_id(name):
+            error(f'{name} is not overridden.')
+        state.publish('settings', name)
+        print(f'Unset {name}.')
+
+
+class Dev(CommandGroup):
+    """Commands for local development."""
+
+    @command(
+        Argument(
+            '--host', default='127.0.0.1', help='The host to listen on.'
+        ),
+        Argument(
+            '-p', '--port', type=int, default=8766,
+            help='The port to listen on.'
+        )
+    )
+    def discord(host: str, port: int):
+        """Run a fake Discord API, CDN and callback receiver."""
+        print(
+            f'Set discord_api_url and discord_cdn_url to '
+            f'http://{host}:{port}, and log in with tokens like user-1234.'
+        )
+        fake_discord.run(host, port)
+
+
+class Plans(CommandGroup):
+    """Commands for checking the query plans of API endpoints."""
+
+    @command(
+        Argument(
+            '-t', '--teams', type=int, default=500,
+            help='The number of teams to create.'
+        ),
+        Argument(
+            '-a', '--accounts', type=int, default=50_000,
+            help='The number of accounts to create.'
+        ),
+        Argument(
+            '-w', '--awards', type=int, default=2_000,
+            help='The number of awards to create (each given to 5 accounts).'
+        )
+    )
+    def seed(teams: int, accounts: int, awards: int):
+        """Fill the database with random data (for development only)."""
+        query_plans.seed(teams, accounts, awards)
+        print(
+            f'Created {teams} teams, {accounts} accounts and {awards} '
+            'awards.'
+        )
+
+    @command(
+        Argument(
+            '-r', '--min-rows', type=int, default=10_000,
+            help='Tables with at least this many rows may not be scanned.'
+        ),
+        Argument(
+            '-c', '--max-cost', type=float, default=5_000,
+            help='The highest estimated cost allowed for a query.'
+        ),
+        Argument(
+            '-u', '--update', action='store_true',
+            help='Replace the baseline plans with the current plans.'
+        )
+    )
+    def check(min_rows: int, max_cost: float, update: bool):
+        """Check endpoint query plans against rules and the baseline."""
+        problems, changed = query_plans.check(min_rows, max_cost, update)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        for endpoint in changed:
+            verb = 'Updated' if update else 'Changed from baseline:'
+            print(verb, endpoint, file=sys.stderr)
+        if problems or (changed and not update):
+            sys.exit(1)
+        print('All query plans OK.')
+
+
+class Bench(CommandGroup):
+    """Commands for timing hot code paths."""
+
+    @command(
+        Argument(
+            '-n', '--number', type=int, default=10_000,
+            help='How many times to run each case per timing.'
+        ),
+        Argument(
+            '-r', '--repeat', type=int, default=5,
+            help='How many timings to take of each case (the best is shown).'
+        )
+    )
+    def auth(number: int, repeat: int):
+        """Time authentication and permission checks."""
+        for result in benchmarks.run(number, repeat):
+            print(result)
+
 
 parse()
@@ -0,0 +1,64 @@
+"""Reject requests when the server is overloaded, instead of queuing them.
+
+Two signals are used: the number of requests being handled at once, and
+how late the event loop is running scheduled callbacks. Since database
+queries block the event loop, the loop lag is how long a new request
+would wait before being started.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from typing import Optional
+
+from . import config
+
+
+class LoadMonitor:
+    """Track the load on this server process."""
+
+    # How often to measure the event loop lag, in seconds.
+    interval = 0.1
+
+    def __init__(self):
+        """Set up the monitor, to be started once the event loop is."""
+        self.in_flight = 0
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start measuring the event loop lag."""
+        if not self._task:
+            self._task = asyncio.get_running_loop().create_task(
+                self._measure_lag()
+            )
+
+    def stop(self):
+        """Stop measuring the event loop lag."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure_lag(self):
+        """Measure how late sleeps finish, forever."""
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(
+                0.0, time.monotonic() - started_at - self.interval
+            )
+
+    def retry_after(self) -> Optional[int]:
+        """Get how many seconds to ask a client to wait, if overloaded.
+
+        Returns None if a new request can be accepted.
+        """
+        if self.in_flight >= config.MAX_IN_FLIGHT_REQUESTS:
+            return 1
+        if self.lag > config.MAX_LOOP_LAG.total_seconds():
+            return max(1, math.ceil(self.lag))
+        return None
+
+
+monitor = LoadMonitor()
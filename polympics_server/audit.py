@@ -0,0 +1,90 @@
+"""Record changes made through the API in the audit log.
+
+Recording an entry only adds it to a buffer in memory, so it doesn't
+slow down requests. The buffer is written in batches by a background
+task every AUDIT_FLUSH_INTERVAL, as soon as a full batch is waiting,
+and when the server shuts down. If the database can't be written to,
+entries are kept to be tried again, up to AUDIT_MAX_BUFFER of them.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime
+from typing import Any
+
+import peewee
+
+from . import config
+from .models import AuditEntry, Scope
+from .tasks import runner
+
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """A buffer of audit log entries waiting to be written."""
+
+    def __init__(self):
+        """Set up the empty buffer."""
+        self.buffer: list[dict[str, Any]] = []
+        # Entries are added in the event loop, and written in a thread.
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_queued = False
+
+    def record(
+            self, scope: Scope, action: str, target: str,
+            diff: dict[str, Any]):
+        """Add an entry to be written, for a change made by a scope.
+
+        The target is the type and ID of what was changed, such as
+        ``team:12``, and the diff should be JSON serialisable.
+        """
+        entry = {
+            'created_at': datetime.now(),
+            'actor_app_id': scope.app.id if scope.app else None,
+            'actor_account_id': scope.account.id if scope.account else None,
+            'action': action,
+            'target': target,
+            'diff': diff
+        }
+        with self.lock:
+            self.buffer.append(entry)
+            self._trim()
+            flush_now = (
+                len(self.buffer) >= config.AUDIT_BATCH_SIZE
+                and not self.flush_queued
+            )
+            self.flush_queued |= flush_now
+        if flush_now:
+            runner.submit_nowait(self.flush, blocking=True)
+
+    def _trim(self):
+        """Drop the oldest entries past the limit, with the lock held."""
+        excess = len(self.buffer) - config.AUDIT_MAX_BUFFER
+        if excess > 0:
+            del self.buffer[:excess]
+            logger.error('Audit log buffer full, dropped %d entries.', excess)
+
+    def flush(self):
+        """Write the buffered entries, in batches."""
+        with self.flush_lock:
+            with self.lock:
+                entries, self.buffer = self.buffer, []
+                self.flush_queued = False
+            batch_size = config.AUDIT_BATCH_SIZE
+            for start in range(0, len(entries), batch_size):
+                try:
+                    AuditEntry.write_many(entries[start:start + batch_size])
+                except peewee.PeeweeException:
+                    logger.exception('Could not write audit log entries.')
+                    with self.lock:
+                        # Keep the order, so the oldest are dropped first.
+                        self.buffer[:0] = entries[start:]
+                        self._trim()
+                    return
+
+
+audit_log = AuditLog()
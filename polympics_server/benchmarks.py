@@ -0,0 +1,94 @@
+"""Time authentication and permission checks.
+
+Each case is run ``number`` times in a loop, ``repeat`` times over, and
+the fastest loop is reported, since slower ones were slowed down by
+something else. The apps, accounts and sessions used are created in a
+transaction which is rolled back afterwards.
+"""
+from __future__ import annotations
+
+import dataclasses
+import timeit
+from typing import Callable, Iterator
+
+from fastapi.security import HTTPBasicCredentials
+
+from . import config
+from .models import (
+    Account, App, Permissions, Session, SignedSession, Team, db
+)
+from .models.permissions import ALL_PERMISSIONS
+from .routes.utils import get_scope
+
+
+@dataclasses.dataclass
+class Result:
+    """The time taken by one benchmark case."""
+
+    name: str
+    # The fastest time for one call, in seconds.
+    seconds: float
+
+    def __str__(self) -> str:
+        """Show the time per call in microseconds."""
+        return f'{self.name:<32} {self.seconds * 1e6:10.2f}us'
+
+
+def check_permissions(get_scope: Callable[[], object]) -> Callable[[], None]:
+    """Make a case which gets a scope and runs typical checks on it."""
+    def run():
+        scope = get_scope()
+        scope.manage_awards
+        scope.manage_teams
+        scope.manage_permissions
+
+    return run
+
+
+def cases(app: App, session: Session, team: Team) -> Iterator[
+        tuple[str, Callable[[], None]]]:
+    """Get the name and function for each benchmark case."""
+    app_data = app.as_dict(with_token=True)
+    session_data = session.as_dict()
+    yield 'app scope + checks', check_permissions(lambda: app.scope)
+    yield 'session scope + checks', check_permissions(lambda: session.scope)
+    scope = session.scope
+    yield 'can_alter_permissions', lambda: scope.can_alter_permissions(
+        team, int(Permissions.MANAGE_OWN_TEAM)
+    )
+    yield 'get_scope (app) + checks', check_permissions(
+        lambda: get_scope(HTTPBasicCredentials(
+            username=app_data['username'], password=app_data['password']
+        ))
+    )
+    yield 'get_scope (session) + checks', check_permissions(
+        lambda: get_scope(HTTPBasicCredentials(
+            username=session_data['username'],
+            password=session_data['password']
+        ))
+    )
+    if config.SESSION_SIGNING_KEY:
+        signed = SignedSession.create(session.account).as_dict()
+        yield 'get_scope (signed) + checks', check_permissions(
+            lambda: get_scope(HTTPBasicCredentials(
+                username=signed['username'], password=signed['password']
+            ))
+        )
+
+
+def run(number: int, repeat: int) -> Iterator[Result]:
+    """Run each benchmark case, yielding its result when done."""
+    with db.atomic() as transaction:
+        team = Team.create(name='Benchmark team')
+        account = Account.create(
+            id=10 ** 17 - 1, name='Benchmark', discriminator='0000',
+            team=team, permissions=int(
+                Permissions.MANAGE_OWN_TEAM | Permissions.MANAGE_AWARDS
+            )
+        )
+        app = App.create(name='Benchmark', permissions=ALL_PERMISSIONS)
+        session = Session.create(account=account)
+        for name, case in cases(app, session, team):
+            times = timeit.repeat(case, number=number, repeat=repeat)
+            yield Result(name, min(times) / number)
+        transaction.rollback()
@@ -1,26 +1,49 @@
-"""Read JSON config for the bot."""
+"""Read config for the server.
+
+Settings come from config.json, or environment variables if there is no
+config file. They may be overridden with the ``config set`` command, which
+stores the new value in the database. Each worker process reloads the
+overrides every SETTINGS_RELOAD_INTERVAL, or on SIGHUP, which also rereads
+the config file. Settings which are only used when the server starts (such
+as the database connection) can't be overridden, and need a restart.
+
+Settings are read as upper case module attributes, such as
+``config.SIGNUPS_OPEN``, which always give the current value. They should
+not be imported by name, since the imported value would never change.
+"""
+from __future__ import annotations
+
+import dataclasses
 import json
 import logging
 import os
 import pathlib
 import re
+import urllib.parse
 from datetime import timedelta
+from typing import Any, Callable, Optional
 
 
 BASE_PATH = pathlib.Path(__file__).parent.parent
 
-try:
-    with open(str(BASE_PATH / 'config.json')) as f:
-        config = json.load(f)
-except FileNotFoundError:
-    config = {key.lower(): value for key, value in os.environ.items()}
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    """A setting is missing or has an invalid value."""
+
 
+def read_config_file() -> dict[str, Any]:
+    """Read config.json, or environment variables if there isn't one."""
+    try:
+        with open(str(BASE_PATH / 'config.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {key.lower(): value for key, value in os.environ.items()}
 
-def get_log_level(field: str, default: int) -> int:
-    """Parse a logging level field from the config file."""
-    raw = config.get(field)
-    if not raw:
-        return default
+
+def parse_log_level(raw: str) -> int:
+    """Parse a logging level, such as "info"."""
     return {
         'critical': logging.CRITICAL,
         'error': logging.ERROR,
@@ -32,11 +55,8 @@ def get_log_level(field: str, default: int) -> int:
     }[raw.lower()]
 
 
-def get_timedelta(field: str, default: timedelta) -> timedelta:
-    """Parse a timedelta in config."""
-    raw = config.get(field)
-    if not raw:
-        return default
+def parse_timedelta(raw: str) -> timedelta:
+    """Parse a timedelta such as "1h 30m" or "500ms"."""
     periods = {
         's': 1,
         'm': 60,
@@ -48,55 +68,316 @@ def get_timedelta(field: str, default: timedelta) -> timedelta:
     }
     seconds = 0
     for part in raw.split():
+        if part.endswith('ms'):
+            seconds += int(part[:-2]) / 1000
+            continue
         period_symbol = part[-1]
         value = int(part[:-1])
         seconds += value * periods[period_symbol]
     return timedelta(seconds=seconds)
 
 
-def get_bool(field: str, default: bool) -> bool:
-    """Parse a boolean in config."""
-    if field not in config:
-        return default
-    value = str(config.get(field)).lower()
+def parse_bool(raw: Any) -> bool:
+    """Parse a boolean, such as "true" or "off"."""
+    value = str(raw).lower()
     if value in ('1', 'true', 't', 'yes', 'y', 'on', 'enabled'):
         return True
     elif value in ('0', 'false', 'f', 'no', 'n', 'off', 'disabled'):
         return False
-    else:
+    raise ValueError('should be true or false')
+
+
+def parse_list(raw: Any) -> list[str]:
+    """Parse a list, or a comma separated string."""
+    if isinstance(raw, list):
+        return raw
+    return raw.split(',')
+
+
+def parse_int_list(raw: Any) -> list[int]:
+    """Parse a list of integers, or a comma separated string of them."""
+    return [int(item) for item in parse_list(raw)]
+
+
+def parse_timedeltas(raw: Any) -> dict[str, timedelta]:
+    """Parse a map of strings to timedeltas.
+
+    This may be an object, or a string like "key=1s,other_key=2s".
+    """
+    if isinstance(raw, str):
+        raw = dict(item.split('=', 1) for item in raw.split(','))
+    return {key: parse_timedelta(value) for key, value in raw.items()}
+
+
+def parse_database_url(url: str) -> tuple[str, str, str, int, str]:
+    """Parse a database URL to a user, password, host, port and name.
+
+    The user and password may be percent-encoded, and the port defaults
+    to 5432.
+    """
+    parts = urllib.parse.urlsplit(url)
+    name = urllib.parse.unquote(parts.path.lstrip('/'))
+    if parts.scheme not in ('postgres', 'postgresql'):
+        raise ValueError(f'unsupported database URL scheme {parts.scheme!r}')
+    if not (parts.username and parts.hostname and name):
+        raise ValueError('database URL needs a user, host and name')
+    return (
+        urllib.parse.unquote(parts.username),
+        urllib.parse.unquote(parts.password or ''),
+        parts.hostname,
+        parts.port or 5432,
+        name
+    )
+
+
+def parse_schema(raw: str) -> str:
+    """Parse the name of a database schema, which is used in SQL."""
+    if not re.fullmatch('[a-z_][a-z0-9_]*', raw):
         raise ValueError(
-            f'Unrecognised value for {field}, should be true or false.'
+            'should be lower case letters, digits and underscores'
         )
+    return raw
+
+
+# How to parse each type of setting, by its annotation.
+PARSERS: dict[str, Callable[[Any], Any]] = {
+    'bool': parse_bool,
+    'int': int,
+    'str': str,
+    'Optional[str]': str,
+    'timedelta': parse_timedelta,
+    'list[str]': parse_list,
+    'list[int]': parse_int_list,
+    'dict[str, timedelta]': parse_timedeltas,
+    'Optional[pathlib.Path]': pathlib.Path
+}
+
+
+def setting(
+        default: Any, restart: bool = False, minimum: Any = None,
+        parse: Optional[Callable[[Any], Any]] = None) -> Any:
+    """Declare a setting.
+
+    If restart is set, the setting can't be changed without restarting
+    the server. If minimum is given, lower values are rejected.
+    """
+    if isinstance(default, (list, dict)):
+        kwargs = {'default_factory': lambda: type(default)(default)}
+    else:
+        kwargs = {'default': default}
+    return dataclasses.field(
+        metadata={'restart': restart, 'minimum': minimum, 'parse': parse},
+        **kwargs
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """The server's settings, validated and parsed to their types.
+
+    Each field is read from the config key of the same name.
+    """
+
+    debug: bool = setting(False, restart=True)
+    max_session_age: timedelta = setting(timedelta(days=30))
+    # Whether to return an account's existing session instead of a new one.
+    reuse_sessions: bool = setting(False)
+    # The oldest sessions past this are deleted, or 0 for no limit.
+    max_sessions_per_account: int = setting(10, minimum=0)
+    # Sessions are extended once their expiry would move by this much, or
+    # 0s to never extend them.
+    session_refresh_interval: timedelta = setting(timedelta())
+    # If set, sessions are signed tokens instead of database rows.
+    session_signing_key: Optional[str] = setting(None, restart=True)
+    token_revocation_refresh_interval: timedelta = setting(
+        timedelta(seconds=10), restart=True, minimum=timedelta(seconds=1)
+    )
+    allowed_origins: list[str] = setting([], restart=True)
+    signups_open: bool = setting(True)
+    max_batch_size: int = setting(250, minimum=1)
+    max_per_page: int = setting(100, restart=True, minimum=1)
+    # Responses smaller than this many bytes are not compressed.
+    compression_min_size: int = setting(1000, restart=True, minimum=0)
+
+    # Where to keep state shared between workers, such as rate limits.
+    shared_state_backend: str = setting('memory', restart=True)
+    # Rate limits, in requests per minute.
+    app_rate_limit: int = setting(600, minimum=1)
+    session_rate_limit: int = setting(120, minimum=1)
+    anonymous_rate_limit: int = setting(60, minimum=1)
+
+    task_workers: int = setting(4, restart=True, minimum=1)
+    task_threads: int = setting(4, restart=True, minimum=1)
+    task_queue_size: int = setting(1000, restart=True, minimum=1)
+    task_drain_timeout: timedelta = setting(
+        timedelta(seconds=15), restart=True
+    )
+    session_prune_interval: timedelta = setting(
+        timedelta(hours=1), restart=True, minimum=timedelta(seconds=1)
+    )
+    # How often each worker reloads settings overridden in the database.
+    settings_reload_interval: timedelta = setting(
+        timedelta(seconds=5), restart=True, minimum=timedelta(seconds=1)
+    )
+    season_refresh_interval: timedelta = setting(
+        timedelta(minutes=1), restart=True, minimum=timedelta(seconds=1)
+    )
+    # Audit log entries are buffered in memory, and written in batches.
+    audit_flush_interval: timedelta = setting(
+        timedelta(seconds=2), restart=True, minimum=timedelta(seconds=1)
+    )
+    audit_batch_size: int = setting(500, minimum=1)
+    audit_max_buffer: int = setting(10_000, minimum=1)
+
+    # How long requests may take, by default and by path prefix.
+    request_timeout: timedelta = setting(
+        timedelta(seconds=10), minimum=timedelta(milliseconds=1)
+    )
+    route_timeouts: dict[str, timedelta] = setting({})
+    # Statement timeout outside of requests (such as background tasks), or
+    # 0s for no timeout.
+    statement_timeout: timedelta = setting(timedelta())
+    outbound_timeout: timedelta = setting(
+        timedelta(seconds=10), minimum=timedelta(milliseconds=1)
+    )
+    # Requests are rejected with a 503 error past these.
+    max_in_flight_requests: int = setting(200, minimum=1)
+    max_loop_lag: timedelta = setting(timedelta(milliseconds=500))
+    # How long the results of health checks which query the database are
+    # kept.
+    health_check_ttl: timedelta = setting(timedelta(seconds=5))
+
+    # Where to cache award images and avatars, or None to not cache them.
+    media_path: Optional[pathlib.Path] = setting(None, restart=True)
+    thumbnail_sizes: list[int] = setting([64, 128, 256])
+    # The largest image that will be fetched, in bytes.
+    max_media_size: int = setting(8_000_000, minimum=1)
+
+    db_name: str = setting('polympics', restart=True)
+    db_user: str = setting('polympics', restart=True)
+    db_host: str = setting('127.0.0.1', restart=True)
+    db_port: int = setting(5432, restart=True)
+    # Required, unless database_url is set.
+    db_password: Optional[str] = setting(None, restart=True)
+    # The schema to keep tables in, which is created if it does not exist,
+    # or None for the database's default search path.
+    db_schema: Optional[str] = setting(
+        None, restart=True, parse=parse_schema
+    )
+    read_replica_urls: list[str] = setting([], restart=True)
+    max_replica_lag: timedelta = setting(timedelta(seconds=10))
+    replica_check_interval: timedelta = setting(timedelta(seconds=5))
+    db_log_level: int = setting(
+        logging.INFO, restart=True, parse=parse_log_level
+    )
+
+    discord_api_url: str = setting('https://discord.com/api/v8')
+    discord_cdn_url: str = setting('https://cdn.discordapp.com')
+    # Used to sync account profiles from Discord, which is disabled
+    # without it.
+    discord_bot_token: Optional[str] = setting(None, restart=True)
+    # How long to remember the user a Discord token is for, or 0s to always
+    # ask Discord.
+    discord_user_cache_ttl: timedelta = setting(timedelta())
+    profile_sync_interval: timedelta = setting(
+        timedelta(minutes=10), restart=True
+    )
+    profile_sync_batch_size: int = setting(100, minimum=1)
+
+    @classmethod
+    def load(cls, raw: dict[str, Any]) -> Settings:
+        """Parse and validate settings from config.
+
+        Missing or empty settings use their defaults.
+        """
+        if raw.get('rate_limit_backend') and not raw.get(
+                'shared_state_backend'):
+            # The old name, from when only rate limits were shared.
+            raw = {**raw, 'shared_state_backend': raw['rate_limit_backend']}
+        values = {}
+        for field in dataclasses.fields(cls):
+            if raw.get(field.name) in (None, ''):
+                continue
+            parse = field.metadata['parse'] or PARSERS[field.type]
+            try:
+                value = parse(raw[field.name])
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                raise ConfigError(
+                    f'Invalid value for {field.name}: {e}'
+                ) from e
+            minimum = field.metadata['minimum']
+            if minimum is not None and value < minimum:
+                raise ConfigError(f'{field.name} must be at least {minimum}.')
+            values[field.name] = value
+        if raw.get('database_url'):
+            try:
+                user, password, host, port, name = parse_database_url(
+                    raw['database_url']
+                )
+            except ValueError as e:
+                raise ConfigError(f'Invalid value for database_url: {e}')
+            values.update(
+                db_user=user, db_password=password, db_host=host,
+                db_port=port, db_name=name
+            )
+        settings = cls(**values)
+        if settings.shared_state_backend not in ('memory', 'database'):
+            raise ConfigError(
+                'shared_state_backend should be "memory" or "database".'
+            )
+        if settings.db_password is None:
+            raise ConfigError('Either db_password or database_url is needed.')
+        try:
+            settings.read_replicas
+        except ValueError as e:
+            raise ConfigError(f'Invalid value for read_replica_urls: {e}')
+        return settings
+
+    @classmethod
+    def can_override(cls, name: str) -> bool:
+        """Check if a setting can be changed without a restart."""
+        fields = {field.name: field for field in dataclasses.fields(cls)}
+        return name in fields and not fields[name].metadata['restart']
+
+    @property
+    def read_replicas(self) -> list[tuple[str, str, str, int, str]]:
+        """Get the connection details of each read replica."""
+        return [parse_database_url(url) for url in self.read_replica_urls]
+
+
+file_config = read_config_file()
+settings = Settings.load(file_config)
+
+
+def reload(overrides: dict[str, str], reread: bool = False) -> list[str]:
+    """Load the config again, with settings overridden in the database.
+
+    If reread is set, the config file is read again too. Settings which
+    need a restart keep their current values. Returns the names of the
+    settings which changed. If the new config is invalid, ConfigError is
+    raised and the current settings are kept.
+    """
+    global file_config, settings
+    raw = read_config_file() if reread else file_config
+    new_settings = Settings.load({**raw, **overrides})
+    kept = {}
+    changed = []
+    for field in dataclasses.fields(Settings):
+        value = getattr(settings, field.name)
+        if getattr(new_settings, field.name) == value:
+            continue
+        if field.metadata['restart']:
+            logger.warning('Restart the server to change %s.', field.name)
+            kept[field.name] = value
+        else:
+            changed.append(field.name)
+    file_config = raw
+    settings = dataclasses.replace(new_settings, **kept)
+    return changed
 
 
-def get_list(field: str, default: None) -> bool:
-    """Parse a list of strings in config."""
-    if field not in config:
-        return default or []
-    if isinstance(config[field], list):
-        return config[field]
-    return config[field].split(',')
-
-
-DEBUG = get_bool('debug', False)
-MAX_SESSION_AGE = get_timedelta('max_session_age', timedelta(days=30))
-ALLOWED_ORIGINS = get_list('allowed_origins', [])
-SIGNUPS_OPEN = get_bool('signups_open', True)
-
-if 'database_url' in config:
-    DB_USER, DB_PASSWORD, DB_HOST, raw_db_port, DB_NAME = re.match(
-        r'postgres://([a-z]+):([a-z0-9]+)@([a-z0-9-.]+):([0-9]+)/([a-z0-9]+)',
-        config['database_url']
-    ).groups()
-    DB_PORT = int(raw_db_port)
-else:
-    DB_NAME = config.get('db_name', 'polympics')
-    DB_USER = config.get('db_user', 'polympics')
-    DB_HOST = config.get('db_host', '127.0.0.1')
-    DB_PORT = config.get('db_port', 5432)
-    DB_PASSWORD = config['db_password']
-
-DB_LOG_LEVEL = get_log_level('db_log_level', logging.INFO)
-
-DISCORD_API_URL = config.get('discord_api_url', 'https://discord.com/api/v8')
-DISCORD_CDN_URL = config.get('discord_cdn_url', 'https://cdn.discordapp.com')
+def __getattr__(name: str) -> Any:
+    """Get the current value of a setting by its name in upper case."""
+    if name.isupper() and hasattr(settings, name.lower()):
+        return getattr(settings, name.lower())
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
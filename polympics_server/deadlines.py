@@ -0,0 +1,89 @@
+"""Limit how long requests can take.
+
+Each request is given a deadline when it starts, from its route's timeout.
+Database queries are given a statement timeout of the same length, and
+fail straight away if the deadline has passed. Outbound HTTP requests are
+given whatever time is left.
+"""
+from __future__ import annotations
+
+import dataclasses
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from . import config
+
+
+class DeadlineExceeded(Exception):
+    """The current request has run for longer than its timeout."""
+
+
+@dataclasses.dataclass
+class Deadline:
+    """When the current request must finish by."""
+
+    timeout: float
+    expires_at: float
+
+    @classmethod
+    def start(cls, timeout: float) -> Deadline:
+        """Create a deadline for a request starting now."""
+        return cls(timeout=timeout, expires_at=time.monotonic() + timeout)
+
+    @property
+    def remaining(self) -> float:
+        """Get the number of seconds until the deadline."""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def statement_timeout(self) -> int:
+        """Get the statement timeout for queries, in milliseconds."""
+        return int(self.timeout * 1000)
+
+    def check(self):
+        """Raise an exception if the deadline has passed."""
+        if self.remaining <= 0:
+            raise DeadlineExceeded(
+                f'Request took longer than {self.timeout}s.'
+            )
+
+
+# The deadline of the current request. This is None outside of a request,
+# in which case the default statement timeout is used.
+request_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    'request_deadline', default=None
+)
+
+
+def get_route_timeout(path: str) -> float:
+    """Get the timeout for a path, in seconds.
+
+    This uses the longest matching prefix in ROUTE_TIMEOUTS, or
+    REQUEST_TIMEOUT if none match.
+    """
+    best_prefix = ''
+    timeout = config.REQUEST_TIMEOUT
+    for prefix, prefix_timeout in config.ROUTE_TIMEOUTS.items():
+        if path.startswith(prefix) and len(prefix) > len(best_prefix):
+            best_prefix = prefix
+            timeout = prefix_timeout
+    return timeout.total_seconds()
+
+
+def get_statement_timeout() -> int:
+    """Get the statement timeout to use for a query, in milliseconds."""
+    deadline = request_deadline.get()
+    if not deadline:
+        return int(config.STATEMENT_TIMEOUT.total_seconds() * 1000)
+    deadline.check()
+    return deadline.statement_timeout
+
+
+def get_outbound_timeout() -> float:
+    """Get the timeout for an outbound HTTP request, in seconds."""
+    timeout = config.OUTBOUND_TIMEOUT.total_seconds()
+    if deadline := request_deadline.get():
+        deadline.check()
+        timeout = min(timeout, deadline.remaining)
+    return timeout
@@ -2,15 +2,15 @@
 
 This is responsible for using a user auth token to get user data.
 """
+import asyncio
 import dataclasses
-from typing import Any
+import time
+from typing import Any, Optional
 
-from .config import DISCORD_API_URL, DISCORD_CDN_URL
-from .requests import get_session
+import aiohttp
 
-
-AVATAR_URL = f'{DISCORD_CDN_URL}/avatars/{{id}}/{{hash}}.png'
-NO_AVATAR_URL = f'{DISCORD_CDN_URL}/embed/avatars/{{discrim}}.png'
+from . import config
+from .requests import get_session, get_timeout
 
 
 @dataclasses.dataclass
@@ -26,28 +26,127 @@ class DiscordUser:
 def get_avatar_url(data: dict[str, Any]) -> str:
     """Form the avatar URL of a user object."""
     if av_hash := data['avatar']:
-        return AVATAR_URL.format(id=data['id'], hash=av_hash)
-    return NO_AVATAR_URL.format(discrim=int(data['discriminator']) % 5)
+        return f'{config.DISCORD_CDN_URL}/avatars/{data["id"]}/{av_hash}.png'
+    discrim = int(data['discriminator']) % 5
+    return f'{config.DISCORD_CDN_URL}/embed/avatars/{discrim}.png'
+
+
+def parse_user(data: dict[str, Any]) -> DiscordUser:
+    """Get a user from a Discord API user object."""
+    try:
+        return DiscordUser(
+            id=int(data['id']),
+            name=data['username'],
+            avatar_url=get_avatar_url(data),
+            discriminator=data['discriminator']
+        )
+    except KeyError as e:
+        raise ValueError('Unexpected Discord API response.') from e
+
+
+def parse_seconds(raw: Optional[str]) -> float:
+    """Parse a number of seconds from a header, defaulting to one."""
+    try:
+        return max(float(raw), 0)
+    except (TypeError, ValueError):
+        return 1
+
+
+class RateLimiter:
+    """Wait for Discord's rate limits before making requests.
+
+    This is shared by all requests made with the bot token. There are no
+    locks, since the state is only changed between awaits.
+    """
+
+    def __init__(self):
+        """Set up the limiter, with no known limit yet."""
+        # None until Discord has told us how many requests are left.
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+
+    async def acquire(self):
+        """Wait until a request can be made."""
+        while self.remaining is not None and self.remaining <= 0:
+            delay = self.reset_at - time.monotonic()
+            if delay <= 0:
+                self.remaining = None
+                break
+            await asyncio.sleep(delay)
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    def update(self, response: aiohttp.ClientResponse):
+        """Update the limit from the headers of a response.
+
+        Headers which can't be parsed are treated as a one second wait.
+        """
+        now = time.monotonic()
+        headers = response.headers
+        if response.status == 429:
+            self.remaining = 0
+            self.reset_at = now + parse_seconds(headers.get('Retry-After'))
+        elif 'X-RateLimit-Remaining' in headers:
+            try:
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+            except ValueError:
+                self.remaining = 0
+            self.reset_at = now + parse_seconds(
+                headers.get('X-RateLimit-Reset-After')
+            )
+
+
+limiter = RateLimiter()
+
+
+async def get_user_by_id(id: int, retries: int = 3) -> Optional[DiscordUser]:
+    """Get data on a user by ID, using the bot token.
+
+    Returns None if there is no such user. Raises ValueError if Discord
+    can't be reached or gives an unexpected response.
+    """
+    if not config.DISCORD_BOT_TOKEN:
+        raise ValueError('No Discord bot token configured.')
+    session = await get_session()
+    headers = {'Authorization': 'Bot ' + config.DISCORD_BOT_TOKEN}
+    endpoint = f'{config.DISCORD_API_URL}/users/{id}'
+    for _attempt in range(retries):
+        await limiter.acquire()
+        try:
+            async with session.get(
+                    endpoint, headers=headers,
+                    timeout=get_timeout()) as response:
+                limiter.update(response)
+                if response.status == 429:
+                    continue
+                if response.status == 404:
+                    return None
+                try:
+                    response.raise_for_status()
+                    data = await response.json()
+                except (aiohttp.ClientError, ValueError) as e:
+                    raise ValueError(
+                        'Unexpected Discord API response.'
+                    ) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ValueError('Could not reach the Discord API.') from e
+        return parse_user(data)
+    raise ValueError('Discord API rate limit exceeded.')
 
 
 async def get_user(token: str) -> DiscordUser:
     """Get data on a user from an user token."""
     session = await get_session()
     headers = {'Authorization': 'Bearer ' + token}
-    endpoint = DISCORD_API_URL + '/oauth2/@me'
-    async with session.get(endpoint, headers=headers) as response:
+    endpoint = config.DISCORD_API_URL + '/oauth2/@me'
+    async with session.get(
+            endpoint, headers=headers, timeout=get_timeout()) as response:
         try:
             data = await response.json()
         except ValueError as e:
             raise ValueError('Unexpected Discord API response.') from e
     try:
         data = data['user']
-        user = DiscordUser(
-            id=int(data['id']),
-            name=data['username'],
-            avatar_url=get_avatar_url(data),
-            discriminator=data['discriminator']
-        )
     except KeyError as e:
         raise ValueError('Unexpected Discord API response.') from e
-    return user
+    return parse_user(data)
@@ -0,0 +1,143 @@
+"""A stand-in for Discord and callback receivers, for local development.
+
+This serves the parts of the Discord API and CDN the server uses, so it
+can be run with no outside services by setting ``discord_api_url`` and
+``discord_cdn_url`` to the address of this server. Any user token of the
+form ``user-<id>`` is accepted, and logs in as a made up user with that
+ID. Profiles can be changed with ``PUT /fake/users/<id>``, to try the
+profile sync.
+
+Callbacks can be pointed at ``/webhooks/<anything>``. The events sent to
+them are logged, and listed by ``GET /webhooks``.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import logging
+from typing import Any, Optional
+
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+# A 1x1 transparent PNG, served for every avatar.
+AVATAR_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAC'
+    'hwGA60e6kgAAAABJRU5ErkJggg=='
+)
+# How many webhook requests to keep.
+MAX_WEBHOOKS = 100
+
+
+def make_user(id: int) -> dict[str, Any]:
+    """Make up a Discord user object for an ID."""
+    return {
+        'id': str(id),
+        'username': f'User {id}',
+        'discriminator': f'{id % 10000:04}',
+        'avatar': None
+    }
+
+
+def get_user(request: web.Request, id: int) -> dict[str, Any]:
+    """Get a user, making them up the first time they are needed."""
+    users = request.app['users']
+    if id not in users:
+        users[id] = make_user(id)
+    return users[id]
+
+
+def parse_user_token(authorization: str) -> Optional[int]:
+    """Get the user ID from a header like "Bearer user-1234"."""
+    kind, _, token = authorization.partition(' ')
+    prefix, _, raw_id = token.partition('-')
+    if kind != 'Bearer' or prefix != 'user' or not raw_id.isdigit():
+        return None
+    return int(raw_id)
+
+
+async def get_current_authorisation(request: web.Request) -> web.Response:
+    """Get the user a token is for, like Discord's /oauth2/@me."""
+    id = parse_user_token(request.headers.get('Authorization', ''))
+    if id is None:
+        return web.json_response(
+            {'message': '401: Unauthorized', 'code': 0}, status=401
+        )
+    return web.json_response({'user': get_user(request, id)})
+
+
+async def get_user_by_id(request: web.Request) -> web.Response:
+    """Get a user by ID, like Discord's /users/{id} with a bot token."""
+    if not request.headers.get('Authorization', '').startswith('Bot '):
+        return web.json_response(
+            {'message': '401: Unauthorized', 'code': 0}, status=401
+        )
+    user = get_user(request, int(request.match_info['id']))
+    return web.json_response(user, headers={
+        'X-RateLimit-Remaining': '50', 'X-RateLimit-Reset-After': '1'
+    })
+
+
+async def update_user(request: web.Request) -> web.Response:
+    """Change a user's profile, as if they had changed it on Discord.
+
+    The body may have a username, discriminator and avatar (any string,
+    which is used to make an avatar hash).
+    """
+    user = get_user(request, int(request.match_info['id']))
+    data = await request.json()
+    for field in ('username', 'discriminator'):
+        if field in data:
+            user[field] = data[field]
+    if 'avatar' in data:
+        user['avatar'] = data['avatar'] and hashlib.md5(
+            data['avatar'].encode()
+        ).hexdigest()
+    return web.json_response(user)
+
+
+async def get_avatar(_request: web.Request) -> web.Response:
+    """Serve an avatar image from the CDN."""
+    return web.Response(body=AVATAR_PNG, content_type='image/png')
+
+
+async def receive_webhook(request: web.Request) -> web.Response:
+    """Record a callback sent by the server."""
+    webhook = {
+        'path': request.path,
+        'authorization': request.headers.get('Authorization'),
+        'body': await request.json()
+    }
+    webhooks = request.app['webhooks']
+    webhooks.append(webhook)
+    del webhooks[:-MAX_WEBHOOKS]
+    logger.info('Webhook to %s: %s', webhook['path'], webhook['body'])
+    return web.Response(status=204)
+
+
+async def list_webhooks(request: web.Request) -> web.Response:
+    """List the most recent callbacks sent by the server."""
+    return web.json_response(request.app['webhooks'])
+
+
+def create_app() -> web.Application:
+    """Create the fake Discord and webhook receiver server."""
+    app = web.Application()
+    app['users'] = {}
+    app['webhooks'] = []
+    app.router.add_get('/oauth2/@me', get_current_authorisation)
+    app.router.add_get('/users/{id:[0-9]+}', get_user_by_id)
+    app.router.add_put('/fake/users/{id:[0-9]+}', update_user)
+    app.router.add_get('/avatars/{id}/{hash}.png', get_avatar)
+    app.router.add_get('/embed/avatars/{discriminator}.png', get_avatar)
+    app.router.add_post('/webhooks/{name:.*}', receive_webhook)
+    app.router.add_get('/webhooks', list_webhooks)
+    return app
+
+
+def run(host: str, port: int):
+    """Run the fake Discord server until interrupted."""
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=host, port=port)
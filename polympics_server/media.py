@@ -0,0 +1,290 @@
+"""Fetch images from other hosts, and cache them and thumbnails on disk.
+
+Each image is fetched once per URL, and stored under the SHA-256 hash of
+its content, along with a PNG thumbnail for each configured size:
+
+    media_path/ab/abcdef.../original
+    media_path/ab/abcdef.../64.png
+
+Since the files for a hash never change, they can be cached by clients
+forever. When an award's image or an account's avatar URL changes, the
+new URL is fetched the next time it is requested.
+
+Thumbnails need Pillow to be installed. Without it, the original image
+is used for every size.
+
+Only PNG, JPEG, GIF and WebP images are stored, recognised by their
+content rather than the type they were sent with. Other types, such as
+SVG, can contain scripts, which would run on the API's origin.
+
+Images are only fetched from public addresses, so that a URL can't be
+used to reach services on the server's network. The Discord CDN is
+trusted, whatever it resolves to, since it is configured by the admin.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import ipaddress
+import os
+import pathlib
+import re
+import socket
+import tempfile
+import urllib.parse
+from typing import Any, Optional
+
+import aiohttp
+import aiohttp.abc
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from . import config
+from .models import MediaFile
+from .requests import get_timeout
+
+
+HASH_RE = re.compile('[0-9a-f]{64}')
+# Modes Pillow can save as PNG. Others, such as CMYK, are converted.
+PNG_MODES = {'1', 'L', 'LA', 'I', 'I;16', 'P', 'RGB', 'RGBA'}
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+# The first bytes of each type of image which is stored.
+IMAGE_SIGNATURES = {
+    'image/png': (b'\x89PNG\r\n\x1a\n',),
+    'image/jpeg': (b'\xff\xd8\xff',),
+    'image/gif': (b'GIF87a', b'GIF89a')
+}
+
+session: aiohttp.ClientSession = None
+
+
+class MediaError(Exception):
+    """An image could not be fetched or stored."""
+
+
+def get_content_type(data: bytes) -> Optional[str]:
+    """Get the type of an image from its content, if it is supported."""
+    for content_type, signatures in IMAGE_SIGNATURES.items():
+        if data.startswith(signatures):
+            return content_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def get_directory(hash: str) -> pathlib.Path:
+    """Get the directory the files for an image are stored in."""
+    if not HASH_RE.fullmatch(hash):
+        # Hashes come from URLs, so make sure they are not paths.
+        raise ValueError('Invalid media hash.')
+    return config.MEDIA_PATH / hash[:2] / hash
+
+
+def write_file(path: pathlib.Path, data: bytes):
+    """Write a file atomically, so it is never read half written.
+
+    The temporary file has a unique name, so threads and processes
+    writing the same file don't write to each other's.
+    """
+    with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp',
+            delete=False) as file:
+        temp_path = pathlib.Path(file.name)
+        try:
+            file.write(data)
+        except BaseException:
+            file.close()
+            temp_path.unlink()
+            raise
+    os.replace(temp_path, path)
+
+
+def make_thumbnail(hash: str, size: int) -> pathlib.Path:
+    """Resize an image to fit in a square, and store it as a PNG."""
+    directory = get_directory(hash)
+    path = directory / f'{size}.png'
+    try:
+        with Image.open(directory / 'original') as image:
+            image.thumbnail((size, size))
+            if image.mode not in PNG_MODES:
+                image = image.convert('RGBA')
+            output = io.BytesIO()
+            image.save(output, 'PNG')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise MediaError('Could not make thumbnail.') from e
+    write_file(path, output.getvalue())
+    return path
+
+
+def store(data: bytes) -> str:
+    """Store an image and its thumbnails, and return its hash."""
+    hash = hashlib.sha256(data).hexdigest()
+    directory = get_directory(hash)
+    if (directory / 'original').exists():
+        return hash
+    if Image:
+        # Check the image can be read before storing anything.
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+        except (OSError, Image.DecompressionBombError) as e:
+            raise MediaError('Could not read image.') from e
+    directory.mkdir(parents=True, exist_ok=True)
+    write_file(directory / 'original', data)
+    if Image:
+        try:
+            for size in config.THUMBNAIL_SIZES:
+                make_thumbnail(hash, size)
+        except MediaError:
+            # Otherwise the image would be served, but never thumbnailed.
+            (directory / 'original').unlink(missing_ok=True)
+            raise
+    return hash
+
+
+def get_path(hash: str, size: Optional[int] = None) -> Optional[pathlib.Path]:
+    """Get the path to an image, or a thumbnail of it.
+
+    Thumbnails for sizes added since the image was stored are made now,
+    and raise MediaError if they can't be. Returns None if the image has
+    not been stored.
+    """
+    directory = get_directory(hash)
+    if not (directory / 'original').exists():
+        return None
+    if not (size and Image):
+        return directory / 'original'
+    path = directory / f'{size}.png'
+    if not path.exists():
+        path = make_thumbnail(hash, size)
+    return path
+
+
+def is_trusted(host: str) -> bool:
+    """Check if a host may be fetched from at any address."""
+    return host == urllib.parse.urlsplit(config.DISCORD_CDN_URL).hostname
+
+
+def is_public(address: str) -> bool:
+    """Check if an IP address is on the public internet."""
+    return ipaddress.ip_address(address).is_global
+
+
+class PublicResolver(aiohttp.abc.AbstractResolver):
+    """Resolve host names, refusing any which have non-public addresses.
+
+    Since this checks the addresses which are connected to, a host can't
+    pass the check and then resolve to somewhere else.
+    """
+
+    def __init__(self):
+        """Wrap the default resolver."""
+        self.resolver = aiohttp.DefaultResolver()
+
+    async def resolve(
+            self, host: str, port: int = 0,
+            family: int = socket.AF_INET) -> list[dict[str, Any]]:
+        """Resolve a host name, raising OSError if it is not public."""
+        addresses = await self.resolver.resolve(host, port, family)
+        if not is_trusted(host):
+            for address in addresses:
+                if not is_public(address['host']):
+                    raise OSError(f'{host} has a non-public address.')
+        return addresses
+
+    async def close(self):
+        """Close the wrapped resolver."""
+        await self.resolver.close()
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Get or create the aiohttp session for fetching images."""
+    global session
+    if (not session) or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(resolver=PublicResolver()),
+            timeout=aiohttp.ClientTimeout(
+                total=config.OUTBOUND_TIMEOUT.total_seconds()
+            )
+        )
+    return session
+
+
+def check_url(url: str):
+    """Check that an image may be fetched from a URL.
+
+    Hosts given by name are checked when they are resolved, but IP
+    addresses are connected to directly, so they are checked here.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise MediaError('Only HTTP URLs can be fetched.')
+    if not parts.hostname:
+        raise MediaError('No host given.')
+    try:
+        public = is_public(parts.hostname)
+    except ValueError:
+        # Not an IP address.
+        return
+    if not (public or is_trusted(parts.hostname)):
+        raise MediaError('Images can only be fetched from public addresses.')
+
+
+async def fetch(url: str) -> tuple[bytes, str]:
+    """Download an image, returning its content and content type.
+
+    Redirects are followed here, so that each URL can be checked.
+    """
+    session = await get_session()
+    try:
+        for _redirect in range(MAX_REDIRECTS + 1):
+            check_url(url)
+            async with session.get(
+                    url, timeout=get_timeout(),
+                    allow_redirects=False) as response:
+                location = response.headers.get('Location')
+                if response.status in REDIRECT_STATUSES and location:
+                    url = urllib.parse.urljoin(str(response.url), location)
+                    continue
+                if response.status != 200:
+                    raise MediaError(f'Got status {response.status}.')
+                if not response.content_type.startswith('image/'):
+                    raise MediaError(
+                        f'Got content type {response.content_type}.'
+                    )
+                data = await response.content.read(
+                    config.MAX_MEDIA_SIZE + 1
+                )
+                break
+        else:
+            raise MediaError('Too many redirects.')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise MediaError('Could not fetch image.') from e
+    if len(data) > config.MAX_MEDIA_SIZE:
+        raise MediaError('Image too large.')
+    if not (content_type := get_content_type(data)):
+        raise MediaError('Only PNG, JPEG, GIF and WebP images are supported.')
+    return data, content_type
+
+
+async def get_media(url: str) -> MediaFile:
+    """Get a stored image by URL, fetching it if needed."""
+    media = MediaFile.get_or_none(MediaFile.url == url)
+    if media:
+        return media
+    data, content_type = await fetch(url)
+    loop = asyncio.get_running_loop()
+    hash = await loop.run_in_executor(None, store, data)
+    # Another request may have fetched the same URL at the same time.
+    media = MediaFile.insert(
+        url=url, hash=hash, content_type=content_type
+    ).on_conflict(
+        conflict_target=[MediaFile.url],
+        preserve=[MediaFile.hash, MediaFile.content_type]
+    ).returning(MediaFile).execute()
+    return next(iter(media))
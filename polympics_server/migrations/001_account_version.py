@@ -0,0 +1,14 @@
+"""Add a version to accounts, used for optimistic concurrency control."""
+import peewee
+
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the account.version column, if it does not already exist."""
+    columns = migrator.database.get_columns('account')
+    if any(column.name == 'version' for column in columns):
+        return
+    migrate(migrator.add_column(
+        'account', 'version', peewee.IntegerField(default=0)
+    ))
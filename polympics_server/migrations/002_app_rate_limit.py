@@ -0,0 +1,14 @@
+"""Add a configurable rate limit to apps."""
+import peewee
+
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the app.rate_limit column, if it does not already exist."""
+    columns = migrator.database.get_columns('app')
+    if any(column.name == 'rate_limit' for column in columns):
+        return
+    migrate(migrator.add_column(
+        'app', 'rate_limit', peewee.IntegerField(null=True)
+    ))
@@ -0,0 +1,10 @@
+"""Add an index for listing the members of a team in order."""
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the account (team_id, id) index, if it does not already exist."""
+    indexes = migrator.database.get_indexes('account')
+    if any(index.columns == ['team_id', 'id'] for index in indexes):
+        return
+    migrate(migrator.add_index('account', ('team_id', 'id'), False))
@@ -0,0 +1,45 @@
+"""Add indexes for award, callback and account queries.
+
+Duplicate awardees and callbacks are removed first, since they can't be
+given unique indexes otherwise. Indexes made redundant by the new ones
+are dropped.
+"""
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+DELETE_DUPLICATES = (
+    # Keep the first time an award was given.
+    'DELETE FROM awardee AS a USING awardee AS b '
+    'WHERE a.award_id = b.award_id AND a.account_id = b.account_id '
+    'AND a.id > b.id',
+    # Keep the most recently set callback, as setting one replaces it.
+    'DELETE FROM callback AS a USING callback AS b '
+    'WHERE a.app_id = b.app_id AND a.event = b.event AND a.id < b.id'
+)
+# Indexes (table, columns, unique) to add.
+INDEXES = (
+    ('awardee', ('award_id', 'account_id'), True),
+    ('callback', ('app_id', 'event'), True),
+    ('callback', ('event',), False),
+    ('account', ('name', 'id'), False),
+)
+# Indexes covered by the first columns of the new ones.
+REDUNDANT_INDEXES = ('awardee_award_id', 'callback_app_id', 'account_team_id')
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the indexes which do not already exist."""
+    database = migrator.database
+    with database.atomic():
+        for sql in DELETE_DUPLICATES:
+            database.execute_sql(sql)
+        operations = []
+        for table, columns, unique in INDEXES:
+            indexes = database.get_indexes(table)
+            if not any(index.columns == list(columns) for index in indexes):
+                operations.append(
+                    migrator.add_index(table, columns, unique)
+                )
+        migrate(*operations)
+        for index in REDUNDANT_INDEXES:
+            database.execute_sql(f'DROP INDEX IF EXISTS {index}')
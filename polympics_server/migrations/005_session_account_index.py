@@ -0,0 +1,17 @@
+"""Index sessions by account and expiry.
+
+This is used to find an account's newest session, and its oldest ones
+past the per-account limit. It replaces the index on just the account.
+"""
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the index if it does not already exist."""
+    database = migrator.database
+    columns = ['account_id', 'expires_at']
+    with database.atomic():
+        indexes = database.get_indexes('session')
+        if not any(index.columns == columns for index in indexes):
+            migrate(migrator.add_index('session', columns, False))
+        database.execute_sql('DROP INDEX IF EXISTS session_account_id')
@@ -0,0 +1,14 @@
+"""Record when accounts last logged in, to find inactive ones to archive."""
+import peewee
+
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the account.last_active_at column, if it does not already exist."""
+    columns = migrator.database.get_columns('account')
+    if any(column.name == 'last_active_at' for column in columns):
+        return
+    migrate(migrator.add_column(
+        'account', 'last_active_at', peewee.DateTimeField(null=True)
+    ))
@@ -0,0 +1,40 @@
+"""Add seasons to teams and awards.
+
+Existing teams and awards are put in the current season, which is
+created if there are no seasons yet. Teams are indexed by season, name
+and ID, for listing a season's teams in order. This is needed on new
+databases too, since the index is not made with the table.
+"""
+import peewee
+
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+from ..models.seasons import Season
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the season columns which do not already exist."""
+    database = migrator.database
+    season_id = Season.get_current().id
+    with database.atomic():
+        for table in ('team', 'award'):
+            columns = database.get_columns(table)
+            if any(column.name == 'season_id' for column in columns):
+                continue
+            field = peewee.ForeignKeyField(
+                Season, null=True, field=Season.id, index=False
+            )
+            migrate(migrator.add_column(table, 'season_id', field))
+            database.execute_sql(
+                f'UPDATE {table} SET season_id = %s', (season_id,)
+            )
+            migrate(migrator.add_not_null(table, 'season_id'))
+        columns = ['season_id', 'name', 'id']
+        indexes = database.get_indexes('team')
+        if not any(index.columns == columns for index in indexes):
+            migrate(migrator.add_index('team', columns, False))
+        columns = database.get_columns('archivedteam')
+        if not any(column.name == 'season_id' for column in columns):
+            migrate(migrator.add_column(
+                'archivedteam', 'season_id', peewee.IntegerField(null=True)
+            ))
@@ -0,0 +1,17 @@
+"""Keep the version of archived accounts, so it carries on when restored.
+
+Accounts archived before this keep a version of 0.
+"""
+import peewee
+
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+
+def apply(migrator: PostgresqlMigrator):
+    """Add the archivedaccount.version column, if it does not exist."""
+    columns = migrator.database.get_columns('archivedaccount')
+    if any(column.name == 'version' for column in columns):
+        return
+    migrate(migrator.add_column(
+        'archivedaccount', 'version', peewee.IntegerField(default=0)
+    ))
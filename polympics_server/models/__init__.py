@@ -1,7 +1,21 @@
 """Interface with the database."""
+from .audit import AuditEntry                                      # noqa:F401
 from .awards import Award, Awardee                                 # noqa:F401
-from .accounts import Account                                      # noqa:F401
-from .authentication import App, Scope, Session                    # noqa:F401
+from .accounts import Account, ProfileSync                         # noqa:F401
+from .authentication import (                                      # noqa:F401
+    App, Scope, Session, SignedSession, TokenRevocation, revocations
+)
+from .archive import (                                             # noqa:F401
+    ArchivedAccount, ArchivedAwardee, ArchivedTeam
+)
 from .callbacks import Callback, Event                             # noqa:F401
-from .database import db, ExplicitNone                             # noqa:F401
+from .database import db, ExplicitNone, ModelList                  # noqa:F401
+from .media import MediaFile                                       # noqa:F401
+from .migrations import Migration, set_up_new_database             # noqa:F401
+from .permissions import Permissions                               # noqa:F401
+from .settings import Setting, reload_settings                     # noqa:F401
+from .seasons import Season, current_season                        # noqa:F401
 from .teams import Team                                            # noqa:F401
+
+# Every table has been created by now.
+set_up_new_database()
@@ -1,12 +1,15 @@
 """A model for a user account."""
 from __future__ import annotations
 
-from typing import Any
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Optional
 
 import peewee
 
 from . import awards
 from .database import BaseModel, db
+from .seasons import current_season
 from .teams import Team
 from ..discord import DiscordUser
 
@@ -17,54 +20,147 @@ class Account(BaseModel):
     id = peewee.BigIntegerField(primary_key=True)
     name = peewee.CharField()
     discriminator = peewee.CharField()
+    # Indexed by the (team, id) index below, which starts with it.
     team = peewee.ForeignKeyField(
-        Team, backref='members', null=True, on_delete='SET NULL'
+        Team, backref='members', null=True, on_delete='SET NULL',
+        index=False
     )
     avatar_url = peewee.CharField(max_length=512, null=True)
     permissions = peewee.BitField(default=0)
+    # Incremented on every update, and used as the account's ETag.
+    version = peewee.IntegerField(default=0)
+    # When the account last logged in, used to find inactive accounts.
+    last_active_at = peewee.DateTimeField(null=True)
 
-    manage_permissions = permissions.flag(1 << 0)
-    manage_account_teams = permissions.flag(1 << 1)
-    manage_account_details = permissions.flag(1 << 2)
-    manage_teams = permissions.flag(1 << 3)
-    # 1 << 4 is used for a different purpose by app permissions.
-    manage_own_team = permissions.flag(1 << 5)
-    manage_awards = permissions.flag(1 << 6)
+    class Meta:
+        """Peewee settings config."""
+
+        indexes = (
+            # For listing team members in order of ID.
+            (('team', 'id'), False),
+            # For listing accounts in order of name.
+            (('name', 'id'), False),
+        )
 
     def as_dict(self) -> dict[str, Any]:
         """Get the account as a dict to be returned as JSON."""
+        return self._as_dict(
+            self.team.as_dict() if self.team else None,
+            [award.as_dict() for award in self.get_awards()]
+        )
+
+    def _as_dict(
+            self, team: dict[str, Any],
+            award_list: list[dict[str, Any]]) -> dict[str, Any]:
+        """Get the account as a dict, given its related data."""
         return {
             'id': str(self.id),
             'name': self.name,
             'discriminator': self.discriminator,
             'avatar_url': self.avatar_url,
-            'team': self.team.as_dict() if self.team else None,
+            'team': team,
             'permissions': self.permissions,
             'created_at': self.created_at.timestamp(),
-            'awards': [award.as_dict() for award in self.awards]
+            'awards': award_list
         }
 
+    @classmethod
+    def as_dicts(cls, accounts: list[Account]) -> list[dict[str, Any]]:
+        """Get many accounts as dicts, batching queries for related data."""
+        if not accounts:
+            return []
+        team_ids = list({
+            account.team_id for account in accounts if account.team_id
+        })
+        teams = Team.select().where(Team.id.in_(team_ids))
+        team_data = {
+            data['id']: data for data in Team.as_dicts(list(teams))
+        }
+        account_awards = defaultdict(list)
+        query = awards.Award.select(
+            awards.Award, awards.Awardee.account.alias('awardee_id')
+        ).join(awards.Awardee).where(
+            awards.Awardee.account.in_([account.id for account in accounts])
+            & (awards.Award.season == current_season.get())
+        ).objects()
+        for award in query:
+            account_awards[award.awardee_id].append(award.as_dict())
+        return [
+            account._as_dict(
+                team_data.get(account.team_id), account_awards[account.id]
+            )
+            for account in accounts
+        ]
+
+    def update_fields(
+            self, changes: dict[peewee.Field, Any],
+            version: Optional[int] = None) -> Optional[Account]:
+        """Update only the given fields, with one query.
+
+        Values may be SQL expressions, to update a field atomically. If a
+        version is given, the account is only updated if it is still at
+        that version.
+
+        Returns the updated account, or None if the version did not match.
+        """
+        cls = type(self)
+        condition = cls.id == self.id
+        if version is not None:
+            condition &= cls.version == version
+        updated = cls.update({
+            **changes, cls.version: cls.version + 1
+        }).where(condition).returning(cls).execute()
+        return next(iter(updated), None)
+
+    def mark_active(self):
+        """Record that the account has just logged in.
+
+        This doesn't change the account's version, since nothing returned
+        by the API has changed.
+        """
+        cls = type(self)
+        cls.update(last_active_at=datetime.now()).where(
+            cls.id == self.id
+        ).execute()
+
     @classmethod
     def get_or_create_by_user(cls, user: DiscordUser) -> Account:
-        """Get an account by ID or create one."""
-        account = cls.get_or_none(cls.id == user.id)
-        if account:
-            return account
-        return cls.create(
+        """Get an account by ID or create one, with one query.
+
+        If the account exists, the conflicting insert becomes an update
+        which changes nothing, so that the existing row is returned.
+        """
+        created = cls.insert(
             id=user.id,
             name=user.name,
             discriminator=user.discriminator,
             avatar_url=user.avatar_url
-        )
+        ).on_conflict(
+            conflict_target=[cls.id], update={cls.id: cls.id}
+        ).returning(cls).execute()
+        return next(iter(created))
+
+    def get_awards(
+            self, season_id: Optional[int] = None) -> list[awards.Award]:
+        """Get the awards this player has won in a season.
 
-    @property
-    def awards(self) -> list[awards.Award]:
-        """Get a list of awards this player has won."""
+        This is the current season if none is given.
+        """
         return list(
-            awards.Award.select().join(
-                awards.Awardee, peewee.JOIN.LEFT_OUTER
-            ).where(awards.Awardee.account_id == self.id)
+            awards.Award.select().join(awards.Awardee).where(
+                (awards.Awardee.account_id == self.id)
+                & (awards.Award.season == (season_id or current_season.get()))
+            )
         )
 
 
-db.create_tables([Account])
+class ProfileSync(BaseModel):
+    """How far the Discord profile sync has got through the accounts.
+
+    There is only one row, which is created when the sync first runs.
+    """
+
+    last_account_id = peewee.BigIntegerField(default=0)
+
+
+db.create_tables([Account, ProfileSync])
@@ -0,0 +1,254 @@
+"""Models for accounts and teams which have been inactive for a long time.
+
+Archived rows are moved out of the main tables, so searches, counts and
+indexes only cover accounts and teams that are still in use. The awards
+an archived account was given are kept with it, and it is moved back
+when it next logs in.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Optional
+
+import peewee
+
+from .accounts import Account
+from .authentication import Session
+from .awards import Award, Awardee
+from .database import BaseModel, db
+from .teams import Team
+
+
+class ArchivedTeam(BaseModel):
+    """A team which had no members or awards for a long time."""
+
+    id = peewee.IntegerField(primary_key=True)
+    name = peewee.CharField()
+    season_id = peewee.IntegerField(null=True)
+    archived_at = peewee.DateTimeField(default=datetime.now)
+
+    @classmethod
+    def archive_inactive(cls, cutoff: datetime, batch_size: int) -> int:
+        """Archive teams with no members or awards, created before a time.
+
+        Teams are moved in batches, each in its own transaction. Returns
+        the number of teams archived.
+        """
+        archived = 0
+        last_id = 0
+        while True:
+            with db.atomic():
+                ids = list(Team.select(Team.id).where(
+                    (Team.id > last_id)
+                    & (Team.created_at < cutoff)
+                    & ~peewee.fn.EXISTS(
+                        Account.select().where(Account.team == Team.id)
+                    )
+                    & ~peewee.fn.EXISTS(
+                        Award.select().where(Award.team == Team.id)
+                    )
+                ).order_by(Team.id).limit(batch_size).for_update(
+                    'FOR UPDATE SKIP LOCKED'
+                ).tuples())
+                if not ids:
+                    return archived
+                ids = [id for id, in ids]
+                cls.insert_from(
+                    Team.select(
+                        Team.id, Team.name, Team.season, Team.created_at,
+                        peewee.Value(datetime.now())
+                    ).where(Team.id.in_(ids)),
+                    [
+                        cls.id, cls.name, cls.season_id, cls.created_at,
+                        cls.archived_at
+                    ]
+                ).execute()
+                Team.delete().where(Team.id.in_(ids)).execute()
+            archived += len(ids)
+            last_id = ids[-1]
+
+    def as_dict(self) -> dict[str, Any]:
+        """Get the team as a dict to be returned as JSON."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'season': self.season_id,
+            'created_at': self.created_at.timestamp(),
+            'archived_at': self.archived_at.timestamp()
+        }
+
+
+class ArchivedAccount(BaseModel):
+    """An account which had not logged in or been given awards for a while.
+
+    Accounts with permissions are never archived.
+    """
+
+    id = peewee.BigIntegerField(primary_key=True)
+    name = peewee.CharField()
+    discriminator = peewee.CharField()
+    # This may be an archived team, so it is not a foreign key.
+    team_id = peewee.IntegerField(null=True)
+    avatar_url = peewee.CharField(max_length=512, null=True)
+    last_active_at = peewee.DateTimeField(null=True)
+    # Kept so that ETags from before the account was archived go stale.
+    version = peewee.IntegerField(default=0)
+    archived_at = peewee.DateTimeField(default=datetime.now)
+
+    # Fields copied to and from the account table, in the same order.
+    copied_fields = (
+        'id', 'name', 'discriminator', 'team_id', 'avatar_url',
+        'last_active_at', 'version', 'created_at'
+    )
+
+    @classmethod
+    def archive_inactive(cls, cutoff: datetime, batch_size: int) -> int:
+        """Archive accounts which have not been used since a time.
+
+        This means they have not logged in or been given an award since,
+        and have no unexpired sessions (which covers accounts that last
+        logged in before logins were recorded). Accounts are moved in
+        batches, each in its own transaction. Returns the number of
+        accounts archived.
+        """
+        now = datetime.now()
+        source = [getattr(Account, name) for name in cls.copied_fields]
+        destination = [getattr(cls, name) for name in cls.copied_fields]
+        archived = 0
+        last_id = 0
+        while True:
+            with db.atomic():
+                ids = list(Account.select(Account.id).where(
+                    (Account.id > last_id)
+                    & (Account.permissions == 0)
+                    & (peewee.fn.COALESCE(
+                        Account.last_active_at, Account.created_at
+                    ) < cutoff)
+                    & ~peewee.fn.EXISTS(Session.select().where(
+                        (Session.account == Account.id)
+                        & (Session.expires_at > now)
+                    ))
+                    & ~peewee.fn.EXISTS(Awardee.select().where(
+                        (Awardee.account == Account.id)
+                        & (Awardee.created_at >= cutoff)
+                    ))
+                ).order_by(Account.id).limit(batch_size).for_update(
+                    'FOR UPDATE SKIP LOCKED'
+                ).tuples())
+                if not ids:
+                    return archived
+                ids = [id for id, in ids]
+                cls.insert_from(
+                    Account.select(*source, peewee.Value(now)).where(
+                        Account.id.in_(ids)
+                    ),
+                    [*destination, cls.archived_at]
+                ).execute()
+                ArchivedAwardee.insert_from(
+                    Awardee.select(
+                        Awardee.award, Awardee.account, Awardee.created_at
+                    ).where(Awardee.account.in_(ids)),
+                    [
+                        ArchivedAwardee.award, ArchivedAwardee.account,
+                        ArchivedAwardee.created_at
+                    ]
+                ).execute()
+                # This deletes their awardees and sessions too.
+                Account.delete().where(Account.id.in_(ids)).execute()
+            archived += len(ids)
+            last_id = ids[-1]
+
+    @classmethod
+    def restore(cls, account_id: int) -> Optional[Account]:
+        """Move an archived account back, with its awards.
+
+        Its team is only restored if the team has not been archived or
+        deleted. Returns None if the account is not archived.
+        """
+        if not cls.select().where(cls.id == account_id).exists():
+            return None
+        with db.atomic():
+            archived = cls.select().where(
+                cls.id == account_id
+            ).for_update().first()
+            if not archived:
+                return None
+            if not Team.select().where(Team.id == archived.team_id).exists():
+                archived.team_id = None
+            # Restoring it is a change, which may have removed its team.
+            archived.version += 1
+            Account.insert({
+                getattr(Account, name): getattr(archived, name)
+                for name in cls.copied_fields
+            }).on_conflict_ignore().execute()
+            Awardee.insert_from(
+                ArchivedAwardee.select(
+                    ArchivedAwardee.award, ArchivedAwardee.account,
+                    ArchivedAwardee.created_at
+                ).where(ArchivedAwardee.account == account_id),
+                [Awardee.award, Awardee.account, Awardee.created_at]
+            ).on_conflict_ignore().execute()
+            # This deletes its archived awardees too.
+            archived.delete_instance()
+        return Account.get_by_id(account_id)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Get the account as a dict to be returned as JSON."""
+        return self._as_dict([
+            award.as_dict() for award in Award.select().join(
+                ArchivedAwardee
+            ).where(ArchivedAwardee.account == self.id)
+        ])
+
+    def _as_dict(self, award_list: list[dict[str, Any]]) -> dict[str, Any]:
+        """Get the account as a dict, given its awards."""
+        return {
+            'id': str(self.id),
+            'name': self.name,
+            'discriminator': self.discriminator,
+            'avatar_url': self.avatar_url,
+            'team_id': self.team_id,
+            'created_at': self.created_at.timestamp(),
+            'archived_at': self.archived_at.timestamp(),
+            'awards': award_list
+        }
+
+    @classmethod
+    def as_dicts(
+            cls, accounts: list[ArchivedAccount]) -> list[dict[str, Any]]:
+        """Get many accounts as dicts, with one query for their awards."""
+        if not accounts:
+            return []
+        account_awards = defaultdict(list)
+        query = Award.select(
+            Award, ArchivedAwardee.account.alias('awardee_id')
+        ).join(ArchivedAwardee).where(
+            ArchivedAwardee.account.in_([account.id for account in accounts])
+        ).objects()
+        for award in query:
+            account_awards[award.awardee_id].append(award.as_dict())
+        return [
+            account._as_dict(account_awards[account.id])
+            for account in accounts
+        ]
+
+
+class ArchivedAwardee(BaseModel):
+    """An award given to an account which has been archived."""
+
+    # Indexed by the unique index below, which starts with it.
+    award = peewee.ForeignKeyField(Award, on_delete='CASCADE', index=False)
+    account = peewee.ForeignKeyField(
+        ArchivedAccount, backref='awards', on_delete='CASCADE'
+    )
+
+    class Meta:
+        """Peewee settings config."""
+
+        indexes = (
+            (('award', 'account'), True),
+        )
+
+
+db.create_tables([ArchivedTeam, ArchivedAccount, ArchivedAwardee])
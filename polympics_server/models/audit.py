@@ -0,0 +1,119 @@
+"""A model for the audit log of changes made through the API.
+
+The table is partitioned by month of creation, so old entries can be
+dropped or archived a month at a time, and queries for recent entries
+only read recent partitions. Partitions are made when they are first
+needed. Entries are never updated or deleted by the server.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Iterable
+
+import peewee
+
+from playhouse.postgres_ext import BinaryJSONField
+
+from .database import BaseModel, db
+
+
+# Peewee can't create partitioned tables, so the table is made here.
+CREATE_TABLE = (
+    'CREATE TABLE IF NOT EXISTS auditentry ('
+    'id BIGSERIAL NOT NULL, '
+    'created_at TIMESTAMP NOT NULL, '
+    'actor_app_id INTEGER, '
+    'actor_account_id BIGINT, '
+    'action VARCHAR(255) NOT NULL, '
+    'target VARCHAR(255) NOT NULL, '
+    'diff JSONB NOT NULL, '
+    # The partition key must be part of the primary key.
+    'PRIMARY KEY (created_at, id)) '
+    'PARTITION BY RANGE (created_at)'
+)
+CREATE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS auditentry_target_created_at '
+    'ON auditentry (target, created_at)',
+    'CREATE INDEX IF NOT EXISTS auditentry_action_created_at '
+    'ON auditentry (action, created_at)'
+)
+
+
+def month_start(time: datetime) -> datetime:
+    """Get the start of the month a time is in."""
+    return datetime(time.year, time.month, 1)
+
+
+def next_month(month: datetime) -> datetime:
+    """Get the start of the month after one."""
+    if month.month == 12:
+        return datetime(month.year + 1, 1, 1)
+    return datetime(month.year, month.month + 1, 1)
+
+
+class AuditEntry(BaseModel):
+    """A change made by an app or account.
+
+    Actors are stored by ID rather than as foreign keys, so entries are
+    kept when the app or account is deleted.
+    """
+
+    id = peewee.BigIntegerField()
+    actor_app_id = peewee.IntegerField(null=True)
+    actor_account_id = peewee.BigIntegerField(null=True)
+    action = peewee.CharField(max_length=255)
+    target = peewee.CharField(max_length=255)
+    diff = BinaryJSONField()
+
+    # Months which are known to have partitions.
+    partitions: set[datetime] = set()
+
+    class Meta:
+        """Peewee settings config."""
+
+        primary_key = peewee.CompositeKey('created_at', 'id')
+
+    @staticmethod
+    def partition_name(month: datetime) -> str:
+        """Get the name of the partition for a month."""
+        return f'auditentry_{month:%Y_%m}'
+
+    @classmethod
+    def create_partitions(cls, times: Iterable[datetime]):
+        """Make sure there are partitions for entries made at some times."""
+        months = {month_start(time) for time in times} - cls.partitions
+        if not months:
+            return
+        with db.atomic():
+            # Stop other processes making the same partition at once.
+            db.execute_sql("SELECT pg_advisory_xact_lock(hashtext('audit'))")
+            for month in sorted(months):
+                db.execute_sql(
+                    f'CREATE TABLE IF NOT EXISTS {cls.partition_name(month)} '
+                    'PARTITION OF auditentry FOR VALUES FROM (%s) TO (%s)',
+                    (month, next_month(month))
+                )
+        cls.partitions |= months
+
+    @classmethod
+    def write_many(cls, entries: list[dict[str, Any]]):
+        """Insert many entries with one query."""
+        cls.create_partitions(entry['created_at'] for entry in entries)
+        cls.insert_many(entries).execute()
+
+    def as_dict(self) -> dict[str, Any]:
+        """Get the entry as a dict to be returned as JSON."""
+        return {
+            'id': self.id,
+            'created_at': self.created_at.timestamp(),
+            'actor_app_id': self.actor_app_id,
+            'actor_account_id': self.actor_account_id,
+            'action': self.action,
+            'target': self.target,
+            'diff': self.diff
+        }
+
+
+db.execute_sql(CREATE_TABLE)
+for sql in CREATE_INDEXES:
+    db.execute_sql(sql)
@@ -3,7 +3,10 @@ from __future__ import annotations
 
 import base64
 import dataclasses
+import hashlib
+import hmac
 import os
+import time
 from datetime import datetime
 from typing import Any, Optional
 
@@ -11,13 +14,21 @@ import peewee
 
 from .accounts import Account
 from .database import BaseModel, db
+from .permissions import (
+    ACCOUNT_PERMISSIONS, ALL_PERMISSIONS, APP_PERMISSIONS, Permissions,
+    has_permission
+)
 from .teams import Team
-from ..config import MAX_SESSION_AGE
+from .. import config
+
+
+AUTHENTICATE_USERS = int(Permissions.AUTHENTICATE_USERS)
+MANAGE_OWN_TEAM = int(Permissions.MANAGE_OWN_TEAM)
 
 
 def get_expires_time() -> datetime:
     """Get the time a session created now should expire."""
-    return datetime.now() + MAX_SESSION_AGE
+    return datetime.now() + config.MAX_SESSION_AGE
 
 
 def generate_token() -> str:
@@ -37,14 +48,8 @@ class App(BaseModel):
     name = peewee.CharField()
     token = peewee.CharField(default=generate_token)
     permissions = peewee.BitField(default=0)
-
-    manage_permissions = permissions.flag(1 << 0)
-    manage_account_teams = permissions.flag(1 << 1)
-    manage_account_details = permissions.flag(1 << 2)
-    manage_teams = permissions.flag(1 << 3)
-    authenticate_users = permissions.flag(1 << 4)
-    # 1 << 5 is used for a different purpose by user permissions.
-    manage_awards = permissions.flag(1 << 6)
+    # Requests per minute, or None to use the default.
+    rate_limit = peewee.IntegerField(null=True)
 
     def as_dict(self, with_token: bool = False) -> dict[str, Any]:
         """Get the app as a dict to return from the API."""
@@ -55,9 +60,15 @@ class App(BaseModel):
             'name': self.name,
             'permissions': self.permissions,
             'username': f'A{self.id}',
+            'rate_limit': self.requests_per_minute,
             **extra
         }
 
+    @property
+    def requests_per_minute(self) -> int:
+        """Get the app's rate limit, falling back to the default."""
+        return self.rate_limit or config.APP_RATE_LIMIT
+
     def reset_token(self):
         """Reset the app's token."""
         self.token = generate_token()
@@ -65,15 +76,7 @@ class App(BaseModel):
     @property
     def scope(self) -> Scope:
         """Get the scope of the app."""
-        return Scope(
-            app=self,
-            manage_permissions=self.manage_permissions,
-            manage_account_teams=self.manage_account_teams,
-            manage_account_details=self.manage_account_details,
-            manage_teams=self.manage_teams,
-            authenticate_users=self.authenticate_users,
-            manage_awards=self.manage_awards
-        )
+        return Scope(app=self, permissions=self.permissions & APP_PERMISSIONS)
 
     @property
     def expired(self) -> bool:
@@ -90,11 +93,19 @@ class Session(BaseModel):
     """
 
     account = peewee.ForeignKeyField(
-        Account, backref='sessions', on_delete='CASCADE'
+        Account, backref='sessions', on_delete='CASCADE', index=False
     )
     expires_at = peewee.DateTimeField(default=get_expires_time)
     token = peewee.CharField(default=generate_token)
 
+    class Meta:
+        """Peewee settings config."""
+
+        indexes = (
+            # For finding an account's newest and oldest sessions.
+            (('account', 'expires_at'), False),
+        )
+
     @property
     def expired(self) -> bool:
         """Return False, because app tokens don't expire."""
@@ -106,13 +117,75 @@ class Session(BaseModel):
         return Scope(
             account=self.account,
             account_session=self,
-            manage_permissions=self.account.manage_permissions,
-            manage_account_teams=self.account.manage_account_teams,
-            manage_account_details=self.account.manage_account_details,
-            manage_teams=self.account.manage_teams,
-            manage_own_team=self.account.manage_own_team,
-            manage_awards=self.account.manage_awards
+            permissions=self.account.permissions & ACCOUNT_PERMISSIONS
+        )
+
+    @classmethod
+    def create_for(cls, account: Account) -> Session:
+        """Get a session for an account, when it authenticates.
+
+        If REUSE_SESSIONS is set, the account's newest session is extended
+        and returned, if it has one. Otherwise a new session is created,
+        and the oldest sessions past MAX_SESSIONS_PER_ACCOUNT are deleted.
+        """
+        if config.REUSE_SESSIONS:
+            session = cls.select().where(
+                (cls.account == account) & (cls.expires_at > datetime.now())
+            ).order_by(cls.expires_at.desc()).bind(db).first()
+            if session:
+                session.expires_at = get_expires_time()
+                session.save(only=[cls.expires_at])
+                return session
+        session = cls.create(account=account)
+        if config.MAX_SESSIONS_PER_ACCOUNT:
+            cls.evict_excess(account)
+        return session
+
+    @classmethod
+    def evict_excess(cls, account: Optional[Account] = None) -> int:
+        """Delete the oldest sessions of accounts with too many.
+
+        This applies to one account, or every account if none is given.
+        Returns the number of sessions deleted.
+        """
+        if not config.MAX_SESSIONS_PER_ACCOUNT:
+            return 0
+        position = peewee.fn.ROW_NUMBER().over(
+            partition_by=[cls.account],
+            order_by=[cls.expires_at.desc(), cls.id.desc()]
         )
+        ranked = cls.select(cls.id, position.alias('position'))
+        if account:
+            ranked = ranked.where(cls.account == account)
+        ranked = ranked.alias('ranked')
+        excess = ranked.select_from(ranked.c.id).where(
+            ranked.c.position > config.MAX_SESSIONS_PER_ACCOUNT
+        )
+        return cls.delete().where(cls.id.in_(excess)).execute()
+
+    @classmethod
+    def prune_expired(cls) -> int:
+        """Delete all expired sessions, returning how many there were."""
+        return cls.delete().where(cls.expires_at < datetime.now()).execute()
+
+    @property
+    def needs_extending(self) -> bool:
+        """Check if the session's expiry should be moved on.
+
+        To avoid a write on every request, this is only the case once the
+        expiry would move by SESSION_REFRESH_INTERVAL.
+        """
+        if not config.SESSION_REFRESH_INTERVAL:
+            return False
+        moved_by = get_expires_time() - self.expires_at
+        return moved_by >= config.SESSION_REFRESH_INTERVAL
+
+    def extend(self):
+        """Move the session's expiry to MAX_SESSION_AGE from now."""
+        self.expires_at = get_expires_time()
+        Session.update(expires_at=self.expires_at).where(
+            Session.id == self.id
+        ).execute()
 
     def as_dict(self) -> dict[str, Any]:
         """Get the account as a dict to be returned as JSON."""
@@ -128,63 +201,252 @@ class Session(BaseModel):
         self.expires_at = get_expires_time()
 
 
+class TokenRevocation(BaseModel):
+    """When an account's signed sessions were last revoked.
+
+    Signed sessions issued before this are rejected. This is not a foreign
+    key, so that it outlives a deleted account.
+    """
+
+    account_id = peewee.BigIntegerField(primary_key=True)
+    revoked_at = peewee.DateTimeField()
+
+    @classmethod
+    def prune_expired(cls) -> int:
+        """Delete revocations older than any unexpired signed session."""
+        cutoff = datetime.now() - config.MAX_SESSION_AGE
+        return cls.delete().where(cls.revoked_at < cutoff).execute()
+
+
+class RevocationList:
+    """A copy of the TokenRevocation table, kept in memory.
+
+    Revocations made by this process apply straight away, and those made
+    by other processes once the list is next refreshed.
+    """
+
+    def __init__(self):
+        """Set up the list, to be loaded once the server starts."""
+        # Times in milliseconds since the epoch, by account ID.
+        self.revoked_at: dict[int, int] = {}
+
+    def refresh(self):
+        """Load the revocations from the database."""
+        self.revoked_at = {
+            revocation.account_id: int(
+                revocation.revoked_at.timestamp() * 1000
+            )
+            for revocation in TokenRevocation.select()
+        }
+
+    def revoke(self, account_ids: list[int]):
+        """Revoke the signed sessions issued so far to some accounts."""
+        if not (config.SESSION_SIGNING_KEY and account_ids):
+            return
+        now = datetime.now()
+        TokenRevocation.insert_many([
+            {'account_id': account_id, 'revoked_at': now}
+            for account_id in account_ids
+        ]).on_conflict(
+            conflict_target=[TokenRevocation.account_id],
+            preserve=[TokenRevocation.revoked_at]
+        ).execute()
+        for account_id in account_ids:
+            self.revoked_at[account_id] = int(now.timestamp() * 1000)
+
+    def is_revoked(self, account_id: int, issued_at: int) -> bool:
+        """Check if a signed session issued at a time has been revoked."""
+        revoked_at = self.revoked_at.get(account_id)
+        return revoked_at is not None and issued_at < revoked_at
+
+
+revocations = RevocationList()
+
+
+def sign(message: str) -> str:
+    """Get the signature of a message, using the session signing key."""
+    key = config.SESSION_SIGNING_KEY.encode()
+    digest = hmac.new(key, message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
 @dataclasses.dataclass
+class SignedSession:
+    """A user authentication session which is not stored in the database.
+
+    The token contains the account ID, the account's permissions when it
+    was issued and when it expires, and is signed with SESSION_SIGNING_KEY,
+    so it can be checked without any queries. Since the permissions may
+    change, an account's signed sessions are revoked when they do.
+    """
+
+    account_id: int
+    permissions: int
+    # Milliseconds since the epoch.
+    issued_at: int
+    expires_at: int
+
+    @classmethod
+    def create(cls, account: Account) -> SignedSession:
+        """Issue a signed session for an account."""
+        now = int(time.time() * 1000)
+        age = int(config.MAX_SESSION_AGE.total_seconds() * 1000)
+        return cls(
+            account_id=account.id,
+            permissions=account.permissions,
+            issued_at=now,
+            expires_at=now + age
+        )
+
+    @classmethod
+    def verify(cls, username: str, password: str) -> Optional[SignedSession]:
+        """Get a signed session from its credentials, if they are valid.
+
+        This does not check whether the session has expired or been
+        revoked.
+        """
+        if not config.SESSION_SIGNING_KEY:
+            return None
+        payload, _, signature = password.rpartition('.')
+        expected = sign(f'{username.upper()}.{payload}')
+        if not hmac.compare_digest(signature, expected):
+            return None
+        try:
+            issued_at, expires_at, permissions = map(int, payload.split('.'))
+            account_id = int(username[1:])
+        except ValueError:
+            return None
+        return cls(
+            account_id=account_id,
+            permissions=permissions,
+            issued_at=issued_at,
+            expires_at=expires_at
+        )
+
+    @property
+    def username(self) -> str:
+        """Get the username used to authenticate with the session."""
+        return f'T{self.account_id}'
+
+    @property
+    def password(self) -> str:
+        """Get the signed password used to authenticate with the session."""
+        payload = f'{self.issued_at}.{self.expires_at}.{self.permissions}'
+        return f'{payload}.{sign(f"{self.username}.{payload}")}'
+
+    @property
+    def expired(self) -> bool:
+        """Check if the session has expired."""
+        return self.expires_at < time.time() * 1000
+
+    @property
+    def revoked(self) -> bool:
+        """Check if the session has been revoked."""
+        return revocations.is_revoked(self.account_id, self.issued_at)
+
+    @property
+    def scope(self) -> Scope:
+        """Get the scope of the session, from the account's permissions."""
+        account = Account(id=self.account_id, permissions=self.permissions)
+        return Scope(
+            account=account,
+            signed_session=self,
+            permissions=self.permissions & ACCOUNT_PERMISSIONS
+        )
+
+    def as_dict(self) -> dict[str, Any]:
+        """Get the session as a dict to be returned as JSON."""
+        return {
+            'username': self.username,
+            'password': self.password,
+            'expires_at': self.expires_at / 1000
+        }
+
+
 class Scope:
     """Authorisation scope for the authenticated user/app."""
 
-    account_session: Optional[Session] = None
-    account: Optional[Account] = None
-    app: Optional[App] = None
-    manage_permissions: bool = False
-    manage_account_teams: bool = False
-    manage_account_details: bool = False
-    manage_teams: bool = False
-    manage_own_team: bool = False
-    authenticate_users: bool = False
-    manage_awards: bool = False
+    __slots__ = (
+        'account_session', 'signed_session', 'account', 'app', 'permissions',
+        '_full_account'
+    )
+
+    def __init__(
+            self, account_session: Optional[Session] = None,
+            signed_session: Optional[SignedSession] = None,
+            account: Optional[Account] = None, app: Optional[App] = None,
+            permissions: int = 0):
+        """Store the scope's owner and permissions."""
+        self.account_session = account_session
+        self.signed_session = signed_session
+        self.account = account
+        self.app = app
+        self.permissions = permissions
+        self._full_account = None
+
+    manage_permissions = has_permission(Permissions.MANAGE_PERMISSIONS)
+    manage_account_teams = has_permission(Permissions.MANAGE_ACCOUNT_TEAMS)
+    manage_account_details = has_permission(
+        Permissions.MANAGE_ACCOUNT_DETAILS
+    )
+    manage_teams = has_permission(Permissions.MANAGE_TEAMS)
+    authenticate_users = has_permission(Permissions.AUTHENTICATE_USERS)
+    manage_own_team = has_permission(Permissions.MANAGE_OWN_TEAM)
+    manage_awards = has_permission(Permissions.MANAGE_AWARDS)
 
     def owns_account(self, account: Account) -> bool:
         """Check if the scope is for a given account."""
         return self.account and self.account.id == account.id
 
+    def get_account(self) -> Optional[Account]:
+        """Get the scope's account, with every field.
+
+        A signed session only includes the account's ID and permissions,
+        so the rest is fetched when first needed. Returns None if the
+        account has been deleted.
+        """
+        if not self.signed_session:
+            return self.account
+        if self._full_account is None:
+            self._full_account = Account.get_or_none(
+                Account.id == self.account.id
+            )
+        return self._full_account
+
     def owns_team(self, team: Team) -> bool:
         """Check if the scope is for an account that owns a given team."""
-        return (
-            self.account
-            and self.account.team
-            and self.account.team.id == team.id
-            and self.account.manage_own_team
+        if not (self.account and self.manage_own_team):
+            return False
+        account = self.get_account()
+        return bool(
+            account
+            and account.team_id
+            and account.team_id == team.id
         )
 
     def can_alter_permissions(
             self, team: Team, permissions: int) -> bool:
         """Check if the owner of the scope can alter given permissions."""
-        if permissions >= 1 << 7:
+        if permissions & ~ALL_PERMISSIONS:
             # Sets a value higher than any permission.
             return False
-        if permissions & 1 << 4:
+        if permissions & AUTHENTICATE_USERS:
             # Sets the authenticate_users permission, which is app-only.
             return False
-        for n, self_has_perm in enumerate((
-                self.manage_permissions, self.manage_account_teams,
-                self.manage_account_details, self.manage_teams,
-                self.authenticate_users, self.manage_own_team,
-                self.manage_awards)):
-            if not self_has_perm:
-                if (permissions & (1 << n)) and n != 5:
-                    # Can't grant permissions you don't have, except
-                    # manage_own_team if you have manage_team.
-                    return False
+        if permissions & ~self.permissions & ~MANAGE_OWN_TEAM:
+            # Can't grant permissions you don't have, except
+            # manage_own_team if you have manage_team.
+            return False
         if not self.manage_permissions:
-            if self.manage_own_team and team == self.account.team:
-                if permissions == (1 << 4):
-                    # Can allow another user to manage a team you can, even
-                    # without manage_permissions permission.
-                    return True
+            owns_team = team and self.owns_team(team)
+            if owns_team and permissions == MANAGE_OWN_TEAM:
+                # Can allow another user to manage a team you can, even
+                # without manage_permissions permission.
+                return True
             # Doesn't have perms to manage permissions.
             return False
         # Has all necessary permissions.
         return True
 
 
-db.create_tables([App, Session])
+db.create_tables([App, Session, TokenRevocation])
@@ -5,6 +5,7 @@ import peewee
 
 from . import accounts
 from .database import BaseModel, db
+from .seasons import Season, current_season
 from .teams import Team
 
 
@@ -14,13 +15,18 @@ class Award(BaseModel):
     title = peewee.CharField(max_length=32)
     image_url = peewee.CharField(max_length=512)
     team = peewee.ForeignKeyField(Team, null=True, backref='awards')
+    # Awards are found by team or awardee, so this is not indexed.
+    season = peewee.ForeignKeyField(
+        Season, backref='awards', default=current_season.get, index=False
+    )
 
     def as_dict(self) -> dict[str, Any]:
         """Get the award as a dict to be returned as JSON."""
         return {
             'id': self.id,
             'title': self.title,
-            'image_url': self.image_url
+            'image_url': self.image_url,
+            'season': self.season_id
         }
 
 
@@ -30,8 +36,17 @@ class Awardee(BaseModel):
     Can be multiple per award.
     """
 
-    award = peewee.ForeignKeyField(Award, on_delete='CASCADE')
+    # Indexed by the unique index below, which starts with it.
+    award = peewee.ForeignKeyField(Award, on_delete='CASCADE', index=False)
     account = peewee.ForeignKeyField(accounts.Account, on_delete='CASCADE')
 
+    class Meta:
+        """Peewee settings config."""
+
+        indexes = (
+            # An account can only be given an award once.
+            (('award', 'account'), True),
+        )
+
 
 db.create_tables([Award, Awardee])
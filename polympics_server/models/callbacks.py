@@ -1,4 +1,6 @@
 """Models relating to event callbacks."""
+from __future__ import annotations
+
 import asyncio
 import enum
 from typing import Any
@@ -19,24 +21,59 @@ class Event(str, enum.Enum):
 class Callback(BaseModel):
     """A callback for an event and app."""
 
-    event = peewee.CharField(max_length=255)
+    event = peewee.CharField(max_length=255, index=True)
     url = peewee.CharField(max_length=2047)
     secret = peewee.CharField(max_length=2047)
-    app = peewee.ForeignKeyField(authentication.App, on_delete='CASCADE')
+    # Indexed by the unique index below, which starts with it.
+    app = peewee.ForeignKeyField(
+        authentication.App, on_delete='CASCADE', index=False
+    )
+
+    class Meta:
+        """Peewee settings config."""
+
+        indexes = (
+            # An app can only have one callback per event.
+            (('app', 'event'), True),
+        )
 
     @classmethod
     async def dispatch_event(cls, event: Event, data: dict[str, Any]):
         """Send an event to all apps subscribed to it."""
+        await cls.dispatch_events(event, [data])
+
+    @classmethod
+    async def dispatch_events(
+            cls, event: Event, events: list[dict[str, Any]]):
+        """Send many events of the same type to all apps subscribed to it.
+
+        The callbacks are fetched once, and all requests are sent at once.
+        """
         session = await requests.get_session()
         tasks = []
         for callback in cls.select().where(cls.event == event.value):
-            tasks.append(session.post(callback.url, json=data, headers={
-                'Authorization': 'Bearer ' + callback.secret
-            }))
+            headers = {'Authorization': 'Bearer ' + callback.secret}
+            for data in events:
+                tasks.append(asyncio.ensure_future(
+                    session.post(callback.url, json=data, headers=headers)
+                ))
         if tasks:
             # We don't care about the responses from the callbacks.
             await asyncio.wait(tasks, timeout=15)
 
+    @classmethod
+    def set_for_app(
+            cls, app: authentication.App, event: Event, url: str,
+            secret: str) -> Callback:
+        """Create or replace an app's callback for an event, with one query."""
+        callbacks = cls.insert(
+            app=app, event=event.value, url=url, secret=secret
+        ).on_conflict(
+            conflict_target=[cls.app, cls.event],
+            preserve=[cls.url, cls.secret]
+        ).returning(cls).execute()
+        return next(iter(callbacks))
+
     def as_dict(self) -> dict[str, Any]:
         """Get the callback as a dict to be returned as JSON."""
         return {
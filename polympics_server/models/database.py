@@ -1,21 +1,220 @@
 """Peewee ORM models."""
 from __future__ import annotations
 
+import dataclasses
+import itertools
+import time
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Any, Callable, Iterable
+from typing import Any, Callable, Iterable, Optional
 
 import peewee
 
 from .. import config
+from ..deadlines import get_statement_timeout
 
 
-db = peewee.PostgresqlDatabase(
+# SQL to get how far behind a replica is, in seconds. This is NULL if the
+# replica is up to date or the database is not a replica at all.
+REPLICA_LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN NULL '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+@dataclasses.dataclass
+class ReadRouting:
+    """Where to send read queries made while handling a request."""
+
+    replica: Optional[ReplicaDatabase] = None
+
+
+# How to route reads for the current request. This is None outside of a
+# request, in which case all queries go to the primary database.
+read_routing: ContextVar[Optional[ReadRouting]] = ContextVar(
+    'read_routing', default=None
+)
+
+
+class TimeoutDatabase(peewee.PostgresqlDatabase):
+    """A database which sets a statement timeout before each query.
+
+    The timeout is only sent to the database when it is different to the
+    one the connection already has. Inside a transaction, it is set with
+    SET LOCAL, once per transaction (and again after rolling back to a
+    savepoint), so the connection's own timeout is left as it was.
+    """
+
+    def _initialize_connection(self, conn: Any):
+        """Mark a new connection as having the server's default timeout."""
+        super()._initialize_connection(conn)
+        self._state.statement_timeout = None
+        self._state.local_statement_timeout = None
+
+    def set_statement_timeout(self, timeout: int):
+        """Set the statement timeout for the connection, in milliseconds."""
+        if self.in_transaction():
+            local = getattr(self._state, 'local_statement_timeout', None)
+            if local == timeout:
+                return
+            super().execute_sql('SET LOCAL statement_timeout = %s', (timeout,))
+            self._state.local_statement_timeout = timeout
+            return
+        if getattr(self._state, 'statement_timeout', None) == timeout:
+            return
+        super().execute_sql('SET statement_timeout = %s', (timeout,))
+        self._state.statement_timeout = timeout
+
+    def commit(self):
+        """Commit the transaction, which ends its local timeout."""
+        self._state.local_statement_timeout = None
+        super().commit()
+
+    def rollback(self):
+        """Roll back the transaction, which ends its local timeout."""
+        self._state.local_statement_timeout = None
+        super().rollback()
+
+    def execute_sql(
+            self, sql: str, params: Optional[list[Any]] = None,
+            commit: Any = peewee.SENTINEL) -> Any:
+        """Execute a query, with the current statement timeout."""
+        self.connect(reuse_if_open=True)
+        if sql.startswith('ROLLBACK TO SAVEPOINT'):
+            # This undoes a timeout set since the savepoint.
+            self._state.local_statement_timeout = None
+        else:
+            self.set_statement_timeout(get_statement_timeout())
+        return super().execute_sql(sql, params, commit)
+
+    # Peewee looks in the public schema by default, rather than the one
+    # the tables were created in.
+
+    def get_tables(self, schema: Optional[str] = None) -> list[str]:
+        """Get the names of the tables in the configured schema."""
+        return super().get_tables(schema or config.DB_SCHEMA)
+
+    def get_columns(
+            self, table: str,
+            schema: Optional[str] = None) -> list[peewee.ColumnMetadata]:
+        """Get the columns of a table in the configured schema."""
+        return super().get_columns(table, schema or config.DB_SCHEMA)
+
+    def get_indexes(
+            self, table: str,
+            schema: Optional[str] = None) -> list[peewee.IndexMetadata]:
+        """Get the indexes of a table in the configured schema."""
+        return super().get_indexes(table, schema or config.DB_SCHEMA)
+
+
+class PrimaryDatabase(TimeoutDatabase):
+    """The primary database, which all writes go to."""
+
+    def execute_sql(
+            self, sql: str, params: Optional[list[Any]] = None,
+            commit: Any = peewee.SENTINEL) -> Any:
+        """Execute a query, sticking to this database after a write."""
+        routing = read_routing.get()
+        if routing and not sql.lstrip()[:6].upper() == 'SELECT':
+            # Make sure later reads in this request see the write.
+            routing.replica = None
+        return super().execute_sql(sql, params, commit)
+
+
+class ReplicaDatabase(TimeoutDatabase):
+    """A read replica, which falls back to the primary database."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        """Set up the database, to be checked before first use."""
+        super().__init__(*args, **kwargs)
+        self.healthy = False
+        self.checked_at = None
+
+    def check(self) -> bool:
+        """Check if the replica is up and not too far behind the primary.
+
+        The result is cached for REPLICA_CHECK_INTERVAL.
+        """
+        now = time.monotonic()
+        interval = config.REPLICA_CHECK_INTERVAL.total_seconds()
+        if self.checked_at is not None and now - self.checked_at < interval:
+            return self.healthy
+        self.checked_at = now
+        try:
+            lag, = super().execute_sql(REPLICA_LAG_SQL).fetchone()
+        except (peewee.OperationalError, peewee.InterfaceError):
+            self.mark_failed()
+            return False
+        max_lag = config.MAX_REPLICA_LAG.total_seconds()
+        self.healthy = lag is None or lag <= max_lag
+        return self.healthy
+
+    def mark_failed(self):
+        """Stop using the replica until it is next checked."""
+        self.healthy = False
+        self.checked_at = time.monotonic()
+        try:
+            self.close()
+        except peewee.PeeweeException:
+            pass
+
+    def execute_sql(
+            self, sql: str, params: Optional[list[Any]] = None,
+            commit: Any = peewee.SENTINEL) -> Any:
+        """Execute a query, using the primary if the replica fails."""
+        try:
+            return super().execute_sql(sql, params, commit)
+        except (peewee.OperationalError, peewee.InterfaceError):
+            # Queries cancelled by the statement timeout aren't caught
+            # here, since Peewee doesn't wrap QueryCanceledError.
+            self.mark_failed()
+            return db.execute_sql(sql, params, commit)
+
+
+# Connect with the configured schema as the only one searched, so that
+# tables are created in it.
+schema_options = (
+    {'options': f'-c search_path={config.DB_SCHEMA}'}
+    if config.DB_SCHEMA else {}
+)
+db = PrimaryDatabase(
     config.DB_NAME,
     user=config.DB_USER,
     password=config.DB_PASSWORD,
     host=config.DB_HOST,
     port=config.DB_PORT,
-    autorollback=True
+    autorollback=True,
+    **schema_options
+)
+if config.DB_SCHEMA:
+    db.execute_sql(f'CREATE SCHEMA IF NOT EXISTS {config.DB_SCHEMA}')
+# Checked before any model creates its table, so that a new database can
+# be brought up to date once they all have.
+new_database = not db.get_tables()
+replicas = [
+    ReplicaDatabase(
+        name, user=user, password=password, host=host, port=port,
+        autorollback=True, **schema_options
+    )
+    for user, password, host, port, name in config.READ_REPLICAS
+]
+_replica_cycle = itertools.cycle(replicas)
+
+
+def get_replica() -> Optional[ReplicaDatabase]:
+    """Get the next healthy read replica, if there is one."""
+    for _ in replicas:
+        replica = next(_replica_cycle)
+        if replica.check():
+            return replica
+    return None
+
+
+# Models fetched by ID during the current request, keyed by model and ID.
+# This is None outside of a request, in which case nothing is cached.
+request_cache: ContextVar[Optional[dict[tuple[type, int], BaseModel]]] = (
+    ContextVar('request_cache', default=None)
 )
 
 
@@ -59,22 +258,65 @@ class BaseModel(peewee.Model):
         use_legacy_table_names = False
         database = db
 
+    @classmethod
+    def select(cls, *fields: peewee.Field) -> peewee.ModelSelect:
+        """Select from the model, using a read replica if allowed."""
+        query = super().select(*fields)
+        routing = read_routing.get()
+        if routing and routing.replica:
+            query = query.bind(routing.replica)
+        return query
+
     @classmethod
     def __get_validators__(cls) -> Iterable[Callable]:
         """Get pydantic validators."""
         yield cls.convert
 
     @classmethod
-    def convert(cls, model_id: str) -> BaseModel:
-        """Get a model from an ID, or raise ValueError."""
+    def as_dicts(cls, records: list[BaseModel]) -> list[dict[str, Any]]:
+        """Get many records as dicts to be returned as JSON.
+
+        Models with related data should override this to fetch it in
+        bulk, rather than with a query per record.
+        """
+        return [record.as_dict() for record in records]
+
+    @classmethod
+    def parse_id(cls, model_id: str) -> int:
+        """Parse a model ID, or raise ValueError."""
         try:
-            model_id = int(model_id)
-        except ValueError:
+            return int(model_id)
+        except (TypeError, ValueError):
             raise ValueError(f'Invalid {cls.__name__} ID: must be int.')
-        try:
-            return cls.get_by_id(model_id)
-        except peewee.DoesNotExist:
-            raise ValueError(f'{cls.__name__} not found.')
+
+    @classmethod
+    def get_many(cls, model_ids: Iterable[str]) -> list[BaseModel]:
+        """Get models from IDs with at most one query, or raise ValueError.
+
+        Models already fetched during this request are reused, and models
+        fetched now are kept for the rest of the request.
+        """
+        ids = [cls.parse_id(model_id) for model_id in model_ids]
+        cache = request_cache.get()
+        if cache is None:
+            cache = {}
+        uncached = {id for id in ids if (cls, id) not in cache}
+        if uncached:
+            for record in cls.select().where(cls.id.in_(list(uncached))):
+                cache[cls, record.id] = record
+        not_found = [
+            str(id) for id in dict.fromkeys(ids) if (cls, id) not in cache
+        ]
+        if not_found:
+            raise ValueError(
+                f'{cls.__name__} not found: {", ".join(not_found)}.'
+            )
+        return [cache[cls, id] for id in ids]
+
+    @classmethod
+    def convert(cls, model_id: str) -> BaseModel:
+        """Get a model from an ID, or raise ValueError."""
+        return cls.get_many([model_id])[0]
 
     @classmethod
     def __modify_schema__(cls, field_schema: dict[str, Any]):
@@ -83,3 +325,38 @@ class BaseModel(peewee.Model):
             pattern='^[0-9]+$',
             examples=[13],
         )
+
+
+class ModelList:
+    """Pydantic type for a list of models, fetched with a single query.
+
+    Use as ``ModelList[Account]`` instead of ``list[Account]``, which would
+    fetch each model separately.
+    """
+
+    model: type[BaseModel]
+
+    def __class_getitem__(cls, model: type[BaseModel]) -> type[ModelList]:
+        """Create a list type for a given model."""
+        return type(f'{model.__name__}List', (cls,), {'model': model})
+
+    @classmethod
+    def __get_validators__(cls) -> Iterable[Callable]:
+        """Get pydantic validators."""
+        yield cls.convert
+
+    @classmethod
+    def convert(cls, model_ids: list[str]) -> list[BaseModel]:
+        """Get a list of models from a list of IDs, or raise ValueError."""
+        if not isinstance(model_ids, list):
+            raise ValueError(f'Invalid {cls.__name__}: must be a list.')
+        return cls.model.get_many(model_ids)
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict[str, Any]):
+        """Modify the pydantic schema for this data type."""
+        field_schema.update(
+            type='array',
+            items={'type': 'string', 'pattern': '^[0-9]+$'},
+            examples=[['13', '14']],
+        )
@@ -0,0 +1,19 @@
+"""A model for images fetched from other hosts and cached on disk."""
+import peewee
+
+from .database import BaseModel, db
+
+
+class MediaFile(BaseModel):
+    """An image that has been fetched from a URL.
+
+    Files are stored by the hash of their content, so different URLs with
+    the same image share files.
+    """
+
+    url = peewee.CharField(max_length=2047, unique=True)
+    hash = peewee.CharField(max_length=64, index=True)
+    content_type = peewee.CharField(max_length=255)
+
+
+db.create_tables([MediaFile])
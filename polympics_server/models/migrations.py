@@ -0,0 +1,64 @@
+"""A model recording which database migrations have been applied."""
+import importlib
+import os
+
+import peewee
+
+from playhouse.migrate import PostgresqlMigrator
+
+from .database import BaseModel, db, new_database
+from ..config import BASE_PATH
+
+
+MIGRATIONS = sorted(
+    file_name[:-3] for file_name in
+    os.listdir(BASE_PATH / 'polympics_server' / 'migrations')
+    if file_name.endswith('.py')
+)
+
+
+class Migration(BaseModel):
+    """A migration which has been applied to the database."""
+
+    name = peewee.CharField(unique=True)
+
+    @classmethod
+    def apply(cls, name: str):
+        """Apply a migration, and record that it has been applied."""
+        module = importlib.import_module(
+            '.migrations.' + name, 'polympics_server'
+        )
+        module.apply(PostgresqlMigrator(db))
+        cls.record(name)
+
+    @classmethod
+    def record(cls, name: str):
+        """Record that a migration has been applied."""
+        cls.insert(name=name).on_conflict_ignore().execute()
+
+    @classmethod
+    def pending(cls) -> list[str]:
+        """Get the migrations which have not been applied."""
+        applied = {
+            name for name, in cls.select(cls.name).bind(db).tuples()
+        }
+        return [name for name in MIGRATIONS if name not in applied]
+
+
+def set_up_new_database():
+    """Apply every migration to a new database, once its tables exist.
+
+    New tables already have most of what migrations add, but some things,
+    such as a few indexes, are only made by migrations. Each migration
+    checks what exists first, so they can all be applied to new tables.
+    """
+    if not new_database:
+        return
+    with db.atomic():
+        # Workers starting at once would otherwise race to apply them.
+        db.execute_sql("SELECT pg_advisory_xact_lock(hashtext('migrations'))")
+        for name in Migration.pending():
+            Migration.apply(name)
+
+
+db.create_tables([Migration])
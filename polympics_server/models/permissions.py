@@ -0,0 +1,36 @@
+"""The permissions which apps and accounts may have, as bit flags."""
+import enum
+import functools
+import operator
+
+
+class Permissions(enum.IntFlag):
+    """A permission, as stored in the database and sent over the API."""
+
+    MANAGE_PERMISSIONS = 1 << 0
+    MANAGE_ACCOUNT_TEAMS = 1 << 1
+    MANAGE_ACCOUNT_DETAILS = 1 << 2
+    MANAGE_TEAMS = 1 << 3
+    AUTHENTICATE_USERS = 1 << 4
+    MANAGE_OWN_TEAM = 1 << 5
+    MANAGE_AWARDS = 1 << 6
+
+
+# These are plain ints, since IntFlag operations are slow.
+ALL_PERMISSIONS = int(functools.reduce(operator.or_, Permissions))
+APP_PERMISSIONS = ALL_PERMISSIONS & ~int(Permissions.MANAGE_OWN_TEAM)
+ACCOUNT_PERMISSIONS = ALL_PERMISSIONS & ~int(Permissions.AUTHENTICATE_USERS)
+
+
+def has_permission(permission: Permissions) -> property:
+    """Create a property to check if an object has a permission.
+
+    The object should have a ``permissions`` attribute.
+    """
+    mask = int(permission)
+
+    def check(self: object) -> bool:
+        return bool(self.permissions & mask)
+
+    check.__doc__ = f'Check for the {permission.name.lower()} permission.'
+    return property(check)
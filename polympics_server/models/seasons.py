@@ -0,0 +1,73 @@
+"""A model for the events that teams and awards belong to."""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Optional
+
+import peewee
+
+from .database import BaseModel, db
+
+
+class Season(BaseModel):
+    """One of the repeated Polympics events.
+
+    The current season is the one which started most recently. New teams
+    and awards are added to it, and lists default to it.
+    """
+
+    name = peewee.CharField(unique=True)
+    starts_at = peewee.DateTimeField(default=datetime.now, index=True)
+
+    @classmethod
+    def get_current(cls) -> Season:
+        """Get the season which started most recently.
+
+        If there are no seasons yet, a first one is created, so that every
+        team and award has a season.
+        """
+        season = cls.select().where(
+            cls.starts_at <= datetime.now()
+        ).order_by(cls.starts_at.desc()).bind(db).first()
+        if season:
+            return season
+        season, _created = cls.get_or_create(
+            name='Season 1', defaults={'starts_at': datetime(1970, 1, 1)}
+        )
+        return season
+
+    def as_dict(self) -> dict[str, Any]:
+        """Get the season as a dict to be returned as JSON."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'starts_at': self.starts_at.timestamp()
+        }
+
+
+class CurrentSeason:
+    """The ID of the current season, kept in memory.
+
+    This is loaded when first needed, and reloaded every
+    SEASON_REFRESH_INTERVAL and when a season is started, so a season
+    scheduled to start later takes over without a restart.
+    """
+
+    def __init__(self):
+        """Set up the holder, without loading the season yet."""
+        self.season_id: Optional[int] = None
+
+    def get(self) -> int:
+        """Get the ID of the current season."""
+        if self.season_id is None:
+            self.refresh()
+        return self.season_id
+
+    def refresh(self):
+        """Reload the current season from the database."""
+        self.season_id = Season.get_current().id
+
+
+current_season = CurrentSeason()
+
+db.create_tables([Season])
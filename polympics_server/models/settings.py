@@ -0,0 +1,60 @@
+"""A model for settings changed while the server is running."""
+import logging
+from datetime import datetime
+
+import peewee
+
+from .database import BaseModel, db
+from .. import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class Setting(BaseModel):
+    """A setting which overrides the value in the config file."""
+
+    name = peewee.CharField(primary_key=True)
+    value = peewee.TextField()
+    updated_at = peewee.DateTimeField(default=datetime.now)
+
+    @classmethod
+    def get_overrides(cls) -> dict[str, str]:
+        """Get the overridden settings, by name."""
+        query = cls.select(cls.name, cls.value).bind(db)
+        return dict(query.tuples())
+
+    @classmethod
+    def override(cls, name: str, value: str):
+        """Override a setting, checking the new value is valid first."""
+        if not config.Settings.can_override(name):
+            raise config.ConfigError(
+                f'{name} is not a setting which can be changed at runtime.'
+            )
+        config.Settings.load({
+            **config.file_config, **cls.get_overrides(), name: value
+        })
+        cls.insert(
+            name=name, value=value, updated_at=datetime.now()
+        ).on_conflict(
+            conflict_target=[cls.name],
+            preserve=[cls.value, cls.updated_at]
+        ).execute()
+
+
+def reload_settings(reread: bool = False):
+    """Reload the settings, with the current overrides.
+
+    If reread is set, the config file is read again too. Invalid settings
+    are logged, and the current ones kept.
+    """
+    try:
+        changed = config.reload(Setting.get_overrides(), reread)
+    except config.ConfigError:
+        logger.exception('Could not reload settings.')
+        return
+    if changed:
+        logger.info('Reloaded settings: %s changed.', ', '.join(changed))
+
+
+db.create_tables([Setting])
@@ -1,25 +1,77 @@
 """A model for a team."""
+from __future__ import annotations
+
+from collections import defaultdict
 from typing import Any
 
 import peewee
 
+from . import accounts, awards
 from .database import BaseModel, db
+from .seasons import Season, current_season
 
 
 class Team(BaseModel):
     """A team for a group of users."""
 
     name = peewee.CharField()
+    # Indexed with the name and ID by migration 007 (not here, since the
+    # index can't be made before that migration adds the column).
+    season = peewee.ForeignKeyField(
+        Season, backref='teams', default=current_season.get, index=False
+    )
 
     def as_dict(self) -> dict[str, Any]:
         """Get the team as a dict to be returned as JSON."""
+        return self._as_dict(
+            self.members.count(),
+            [
+                award.as_dict() for award in self.awards.where(
+                    awards.Award.season == self.season_id
+                )
+            ]
+        )
+
+    def _as_dict(
+            self, member_count: int,
+            award_list: list[dict[str, Any]]) -> dict[str, Any]:
+        """Get the team as a dict, given its related data."""
         return {
             'id': self.id,
             'name': self.name,
+            'season': self.season_id,
             'created_at': self.created_at.timestamp(),
-            'member_count': self.members.count(),
-            'awards': [award.as_dict() for award in self.awards]
+            'member_count': member_count,
+            'awards': award_list
         }
 
+    @classmethod
+    def as_dicts(cls, teams: list[Team]) -> list[dict[str, Any]]:
+        """Get many teams as dicts, with two queries for related data."""
+        if not teams:
+            return []
+        team_ids = [team.id for team in teams]
+        account = accounts.Account
+        member_counts = dict(
+            account.select(account.team, peewee.fn.COUNT(account.id))
+            .where(account.team.in_(team_ids))
+            .group_by(account.team)
+            .tuples()
+        )
+        seasons = {team.id: team.season_id for team in teams}
+        team_awards = defaultdict(list)
+        for award in awards.Award.select().where(
+                awards.Award.team.in_(team_ids)
+                & awards.Award.season.in_(set(seasons.values()))):
+            # Only list awards from the team's own season.
+            if award.season_id == seasons[award.team_id]:
+                team_awards[award.team_id].append(award.as_dict())
+        return [
+            team._as_dict(
+                member_counts.get(team.id, 0), team_awards[team.id]
+            )
+            for team in teams
+        ]
+
 
 db.create_tables([Team])
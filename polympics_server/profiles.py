@@ -0,0 +1,141 @@
+"""Keep account names and avatars in sync with Discord.
+
+Each run fetches the profiles of the next batch of accounts, in order of
+ID, wrapping around to the start once every account has been checked.
+Only accounts whose profile has changed are updated.
+
+Only one server process runs the sync at a time, using an advisory lock.
+That lock belongs to the database connection, which every task on the
+event loop shares, so a process-local lock also stops two syncs in the
+same process.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Optional
+
+import peewee
+
+from . import config, discord
+from .models import Account, ProfileSync, db
+
+
+logger = logging.getLogger(__name__)
+
+# An arbitrary key for the advisory lock, shared by all server processes.
+LOCK_KEY = 0x706f6c79
+# Held by whichever task in this process is syncing.
+process_lock = threading.Lock()
+
+
+def update_profiles(users: list[discord.DiscordUser]) -> list[int]:
+    """Update the profiles of many accounts, with one query.
+
+    Returns the IDs of the accounts which had changed.
+    """
+    if not users:
+        return []
+    values = peewee.ValuesList(
+        [
+            (user.id, user.name, user.discriminator, user.avatar_url)
+            for user in users
+        ],
+        columns=('id', 'name', 'discriminator', 'avatar_url'),
+        alias='profile'
+    )
+    changed = peewee.Expression(
+        peewee.Tuple(Account.name, Account.discriminator, Account.avatar_url),
+        'IS DISTINCT FROM',
+        peewee.Tuple(
+            values.c.name, values.c.discriminator, values.c.avatar_url
+        )
+    )
+    query = Account.update({
+        Account.name: values.c.name,
+        Account.discriminator: values.c.discriminator,
+        Account.avatar_url: values.c.avatar_url,
+        Account.version: Account.version + 1
+    }).from_(values).where(
+        (Account.id == values.c.id) & changed
+    ).returning(Account.id)
+    return [account.id for account in query.execute()]
+
+
+async def sync_batch(batch_size: int) -> tuple[int, int, bool]:
+    """Sync the next batch of accounts.
+
+    Returns the number of accounts checked, the number updated and
+    whether this batch reached the last account.
+    """
+    state = ProfileSync.select().bind(db).first() or ProfileSync.create()
+    account_ids = [
+        account.id for account in Account.select(Account.id).where(
+            Account.id > state.last_account_id
+        ).order_by(Account.id).limit(batch_size).bind(db)
+    ]
+    users = []
+    for account_id in account_ids:
+        try:
+            user = await discord.get_user_by_id(account_id)
+        except ValueError:
+            logger.exception('Could not get Discord user %d.', account_id)
+            continue
+        if user:
+            users.append(user)
+    updated = update_profiles(users)
+    finished = len(account_ids) < batch_size
+    ProfileSync.update(
+        last_account_id=0 if finished else account_ids[-1]
+    ).where(ProfileSync.id == state.id).execute()
+    return len(account_ids), len(updated), finished
+
+
+async def sync_batches(
+        batch_size: int, max_batches: Optional[int]) -> tuple[int, int]:
+    """Sync batches of accounts, until max_batches or the last account.
+
+    Returns the numbers of accounts checked and updated.
+    """
+    checked = updated = batches = 0
+    while max_batches is None or batches < max_batches:
+        batch_checked, batch_updated, finished = await sync_batch(batch_size)
+        checked += batch_checked
+        updated += batch_updated
+        batches += 1
+        if finished:
+            break
+    return checked, updated
+
+
+async def sync_profiles(
+        batch_size: Optional[int] = None,
+        max_batches: Optional[int] = 1) -> Optional[tuple[int, int]]:
+    """Sync batches of accounts, unless another sync is running.
+
+    If max_batches is None, every account (from the current position) is
+    synced. The batch size defaults to PROFILE_SYNC_BATCH_SIZE. Returns
+    the numbers of accounts checked and updated, or None if this or
+    another process was already syncing.
+    """
+    if not process_lock.acquire(blocking=False):
+        return None
+    try:
+        locked, = db.execute_sql(
+            'SELECT pg_try_advisory_lock(%s)', (LOCK_KEY,)
+        ).fetchone()
+        if not locked:
+            return None
+        try:
+            checked, updated = await sync_batches(
+                batch_size or config.PROFILE_SYNC_BATCH_SIZE, max_batches
+            )
+        finally:
+            db.execute_sql('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+    finally:
+        process_lock.release()
+    if updated:
+        logger.info(
+            'Synced %d Discord profiles, %d had changed.', checked, updated
+        )
+    return checked, updated
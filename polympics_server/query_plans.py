@@ -0,0 +1,293 @@
+"""Check the query plans of the SQL each read endpoint runs.
+
+Each endpoint is called in-process against a seeded database, the SQL it
+runs is captured from Peewee's logs, and ``EXPLAIN (FORMAT JSON)`` is run
+on each query. Plans are checked for sequential scans of large tables
+and for going over a cost budget, and compared to the baseline plans
+stored in the repo, so changes show up in review.
+"""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import logging
+import random
+from typing import Any, Iterator, Optional
+
+from .config import BASE_PATH
+from .models import Account, Award, Awardee, Team, current_season, db
+from .routes import server
+
+
+BASELINE_PATH = BASE_PATH / 'query_plans.json'
+
+
+@dataclasses.dataclass
+class Endpoint:
+    """A read endpoint to check the queries of."""
+
+    path: str
+    query_string: str = ''
+    # For queries that can't use an index, such as substring searches.
+    allow_seq_scan: bool = False
+
+    def url(self, **ids: int) -> str:
+        """Get the path to call the endpoint with."""
+        path = self.path.format(**ids)
+        if self.query_string:
+            return f'{path}?{self.query_string.format(**ids)}'
+        return path
+
+    @property
+    def name(self) -> str:
+        """Get a name for the endpoint, used in the baseline file."""
+        if self.query_string:
+            return f'GET {self.path}?{self.query_string}'
+        return f'GET {self.path}'
+
+
+ENDPOINTS = [
+    Endpoint('/accounts/search'),
+    Endpoint('/accounts/search', 'q=ab', allow_seq_scan=True),
+    Endpoint('/accounts/search', 'team={team}'),
+    Endpoint('/accounts', 'ids={account},{other_account}'),
+    Endpoint('/account/{account}'),
+    Endpoint('/account/{account}/awards'),
+    Endpoint('/teams/search'),
+    Endpoint('/teams/search', 'q=ab', allow_seq_scan=True),
+    Endpoint('/teams', 'ids={team}'),
+    Endpoint('/team/{team}'),
+    Endpoint('/team/{team}/members'),
+    Endpoint('/awards', 'ids={award}'),
+    Endpoint('/award/{award}'),
+    Endpoint('/seasons'),
+]
+
+
+class QueryCapture(logging.Handler):
+    """Logging handler to collect the queries Peewee runs."""
+
+    def __init__(self):
+        """Set up the list of queries."""
+        super().__init__(logging.DEBUG)
+        self.queries: list[tuple[str, Optional[list[Any]]]] = []
+        self.seen: set[str] = set()
+
+    def emit(self, record: logging.LogRecord):
+        """Store a query, if it is a select not already seen."""
+        sql, params = record.msg
+        if sql.lstrip()[:6].upper() != 'SELECT':
+            return
+        # Queries run once per result only need to be checked once.
+        if sql not in self.seen:
+            self.seen.add(sql)
+            self.queries.append((sql, params))
+
+
+async def call(path: str, query_string: str) -> int:
+    """Make a GET request to the app in-process, returning the status."""
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query_string.encode(),
+        'headers': [],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    status = None
+    requested = False
+
+    async def receive() -> dict[str, Any]:
+        nonlocal requested
+        if requested:
+            # Only sent once the response has been, so streams finish.
+            await asyncio.sleep(1)
+            return {'type': 'http.disconnect'}
+        requested = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message: dict[str, Any]):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await server(scope, receive, send)
+    return status
+
+
+def capture_queries(
+        path: str, query_string: str) -> list[tuple[str, list[Any]]]:
+    """Get the distinct select queries run by a request to an endpoint."""
+    logger = logging.getLogger('peewee')
+    capture = QueryCapture()
+    old_state = logger.level, logger.handlers, logger.propagate
+    # Replace the usual handlers, so queries aren't also printed.
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [capture]
+    logger.propagate = False
+    try:
+        status = asyncio.run(call(path, query_string))
+    finally:
+        logger.level, logger.handlers, logger.propagate = old_state
+    if status != 200:
+        raise ValueError(f'GET {path}?{query_string} returned {status}.')
+    return capture.queries
+
+
+def explain(sql: str, params: Optional[list[Any]]) -> dict[str, Any]:
+    """Get the plan of a query."""
+    cursor = db.execute_sql('EXPLAIN (FORMAT JSON) ' + sql, params)
+    return cursor.fetchone()[0][0]['Plan']
+
+
+def walk(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    """Get every node in a plan."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from walk(child)
+
+
+def full_table_count(plan: dict[str, Any]) -> bool:
+    """Check if a plan counts every row of a table.
+
+    This has to read the whole table however it is done, so a sequential
+    scan is expected.
+    """
+    children = plan.get('Plans', [])
+    return (
+        plan['Node Type'] == 'Aggregate'
+        and len(children) == 1
+        and children[0]['Node Type'] == 'Seq Scan'
+        and 'Filter' not in children[0]
+    )
+
+
+def summarise(plan: dict[str, Any]) -> dict[str, Any]:
+    """Get the shape of a plan, without costs or row estimates.
+
+    This is what is stored in the baseline, since it only changes when
+    the way a query is run does.
+    """
+    summary = {'node': plan['Node Type']}
+    for key in ('Relation Name', 'Index Name', 'Join Type'):
+        if key in plan:
+            summary[key.lower().replace(' ', '_')] = plan[key]
+    if children := plan.get('Plans'):
+        summary['children'] = [summarise(child) for child in children]
+    return summary
+
+
+def large_tables(min_rows: int) -> set[str]:
+    """Get the names of tables with at least a number of rows."""
+    cursor = db.execute_sql(
+        'SELECT relname FROM pg_class '
+        "WHERE relkind = 'r' AND reltuples >= %s",
+        (min_rows,)
+    )
+    return {name for name, in cursor.fetchall()}
+
+
+def sample_ids() -> dict[str, int]:
+    """Get IDs of seeded objects to call endpoints with."""
+    account, other_account = Account.select().where(
+        Account.team.is_null(False)
+    ).order_by(Account.id).limit(2)
+    award = Award.select().join(Awardee).order_by(Award.id).first()
+    return {
+        'account': account.id,
+        'other_account': other_account.id,
+        'team': account.team_id,
+        'award': award.id
+    }
+
+
+def check(
+        min_rows: int, max_cost: float,
+        update: bool = False) -> tuple[list[str], list[str]]:
+    """Check the plans of every endpoint.
+
+    Returns a list of problems with the plans, and a list of endpoints
+    with plans that differ from the baseline. If update is True, the
+    baseline is replaced with the new plans.
+    """
+    ids = sample_ids()
+    # The server loads this when it starts, rather than during a request.
+    current_season.refresh()
+    tables = large_tables(min_rows)
+    baseline = {}
+    if BASELINE_PATH.exists():
+        baseline = json.loads(BASELINE_PATH.read_text())
+    plans = {}
+    problems = []
+    for endpoint in ENDPOINTS:
+        path, _, query_string = endpoint.url(**ids).partition('?')
+        summaries = []
+        for sql, params in capture_queries(path, query_string):
+            plan = explain(sql, params)
+            summaries.append(summarise(plan))
+            if plan['Total Cost'] > max_cost:
+                problems.append(
+                    f'{endpoint.name}: cost {plan["Total Cost"]} is over '
+                    f'{max_cost}:\n  {sql}'
+                )
+            if endpoint.allow_seq_scan or full_table_count(plan):
+                continue
+            for node in walk(plan):
+                if node['Node Type'] != 'Seq Scan':
+                    continue
+                if node['Relation Name'] in tables:
+                    problems.append(
+                        f'{endpoint.name}: sequential scan on '
+                        f'{node["Relation Name"]}:\n  {sql}'
+                    )
+        plans[endpoint.name] = summaries
+    changed = [
+        name for name, summaries in plans.items()
+        if baseline.get(name) != summaries
+    ]
+    if update:
+        BASELINE_PATH.write_text(json.dumps(plans, indent=2) + '\n')
+    return problems, changed
+
+
+def seed(teams: int, accounts: int, awards: int, batch_size: int = 1000):
+    """Fill the database with random data for checking plans against."""
+    rng = random.Random(0)
+
+    def name() -> str:
+        return ''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=8))
+
+    def insert(model: type, rows: list[dict[str, Any]]) -> list[int]:
+        ids = []
+        for start in range(0, len(rows), batch_size):
+            query = model.insert_many(rows[start:start + batch_size])
+            ids.extend(id for id, in query.execute())
+        return ids
+
+    with db.atomic():
+        team_ids = insert(Team, [{'name': name()} for _ in range(teams)])
+        # Discord IDs are 18 digits long.
+        first_account_id = 10 ** 17 + Account.select().count()
+        account_ids = insert(Account, [{
+            'id': first_account_id + n,
+            'name': name(),
+            'discriminator': f'{rng.randrange(10000):04}',
+            'team': rng.choice(team_ids) if rng.random() < 0.9 else None
+        } for n in range(accounts)])
+        award_ids = insert(Award, [{
+            'title': name(),
+            'image_url': 'https://example.com/award.png',
+            'team': rng.choice(team_ids)
+        } for _ in range(awards)])
+        insert(Awardee, [
+            {'award': award_id, 'account': account_id}
+            for award_id in award_ids
+            for account_id in rng.sample(account_ids, 5)
+        ])
+    db.execute_sql('ANALYZE')
@@ -0,0 +1,125 @@
+"""Token bucket rate limiting for API clients.
+
+Each client has a bucket of tokens, which holds up to the client's limit
+and refills at its limit per minute. Each request takes one token, and
+requests are rejected when the bucket is empty.
+"""
+from __future__ import annotations
+
+import dataclasses
+import math
+import time
+
+from .models import db
+
+
+@dataclasses.dataclass
+class Bucket:
+    """The state of a bucket after a request."""
+
+    limit: int
+    tokens: float
+    allowed: bool
+
+    @property
+    def rate(self) -> float:
+        """Get the number of tokens added to the bucket per second."""
+        return self.limit / 60
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """Get the RateLimit headers to send with a response."""
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(math.floor(self.tokens)),
+            'RateLimit-Reset': str(
+                math.ceil((self.limit - self.tokens) / self.rate)
+            )
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(
+                math.ceil((1 - self.tokens) / self.rate)
+            )
+        return headers
+
+
+class MemoryBackend:
+    """Store buckets in memory, so each worker limits separately."""
+
+    # When there are more buckets than this, drop the full ones.
+    max_buckets = 10_000
+
+    def __init__(self):
+        """Set up the bucket store."""
+        # Map of keys to tokens and time last updated.
+        self.buckets: dict[str, tuple[float, float]] = {}
+
+    def hit(self, key: str, limit: int) -> Bucket:
+        """Take a token from a bucket, if there is one."""
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated_at) * limit / 60)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        if len(self.buckets) >= self.max_buckets:
+            self.prune(now)
+        self.buckets[key] = tokens, now
+        return Bucket(limit=limit, tokens=tokens, allowed=allowed)
+
+    def prune(self, now: float):
+        """Drop buckets which have refilled, which takes at most a minute."""
+        self.buckets = {
+            key: (tokens, updated_at)
+            for key, (tokens, updated_at) in self.buckets.items()
+            if now - updated_at < 60
+        }
+
+
+class DatabaseBackend:
+    """Store buckets in an unlogged table, shared between workers."""
+
+    # The number of tokens in the bucket before this request.
+    REFILLED = (
+        'LEAST(%(limit)s, rate_limit_bucket.tokens + %(limit)s / 60.0 * '
+        'EXTRACT(EPOCH FROM now() - rate_limit_bucket.updated_at))'
+    )
+    HIT_SQL = (
+        'INSERT INTO rate_limit_bucket (key, tokens, updated_at, allowed) '
+        'VALUES (%(key)s, %(limit)s - 1, now(), TRUE) '
+        'ON CONFLICT (key) DO UPDATE SET '
+        f'tokens = CASE WHEN {REFILLED} >= 1 THEN {REFILLED} - 1 '
+        f'ELSE {REFILLED} END, '
+        f'allowed = {REFILLED} >= 1, '
+        'updated_at = now() '
+        'RETURNING tokens, allowed'
+    )
+
+    def __init__(self):
+        """Create the bucket table if it does not already exist."""
+        with db.atomic():
+            # IF NOT EXISTS still fails if another worker is creating it.
+            db.execute_sql(
+                "SELECT pg_advisory_xact_lock(hashtext('shared_state'))"
+            )
+            db.execute_sql(
+                'CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_bucket ('
+                'key VARCHAR(255) PRIMARY KEY, '
+                'tokens DOUBLE PRECISION NOT NULL, '
+                'updated_at TIMESTAMP NOT NULL, '
+                'allowed BOOLEAN NOT NULL)'
+            )
+
+    def hit(self, key: str, limit: int) -> Bucket:
+        """Take a token from a bucket, if there is one."""
+        tokens, allowed = db.execute_sql(
+            self.HIT_SQL, {'key': key, 'limit': limit}
+        ).fetchone()
+        return Bucket(limit=limit, tokens=tokens, allowed=allowed)
+
+    def prune(self):
+        """Delete buckets which have refilled, which takes at most a minute."""
+        db.execute_sql(
+            'DELETE FROM rate_limit_bucket '
+            "WHERE updated_at < now() - INTERVAL '1 minute'"
+        )
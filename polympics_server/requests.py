@@ -1,6 +1,9 @@
 """Utility to keep a persistent aiohttp session."""
 import aiohttp
 
+from . import config
+from .deadlines import get_outbound_timeout
+
 
 session: aiohttp.ClientSession = None
 
@@ -9,5 +12,12 @@ async def get_session() -> session:
     """Get or create the aiohttp session."""
     global session
     if (not session) or session.closed:
-        session = aiohttp.ClientSession()
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(
+            total=config.OUTBOUND_TIMEOUT.total_seconds()
+        ))
     return session
+
+
+def get_timeout() -> aiohttp.ClientTimeout:
+    """Get the timeout for a request, within the current deadline."""
+    return aiohttp.ClientTimeout(total=get_outbound_timeout())
@@ -1,3 +1,6 @@
 """Load the API routes and expose the application."""
-from . import accounts, auth, awards, callbacks, teams    # noqa:F401
+from . import (                                           # noqa:F401
+    accounts, archive, audit, auth, awards, callbacks, health, media,
+    seasons, teams
+)
 from .utils import server                                 # noqa:F401
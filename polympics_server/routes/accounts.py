@@ -1,16 +1,22 @@
 """Account creation, viewing and editing."""
 from typing import Any, Optional, Union
 
-from fastapi import BackgroundTasks, Depends, HTTPException, Response
+from fastapi import Depends, HTTPException, Header, Response
 
 import peewee
 
 from pydantic import BaseModel
 
-from .utils import Paginate, auth_assert, authenticate, server
-from .. import discord
-from ..config import SIGNUPS_OPEN
-from ..models import Account, Callback, Event, ExplicitNone, Scope, Team
+from .utils import (
+    BatchIds, Paginate, auth_assert, authenticate, etag, parse_if_match,
+    revoke_signed_sessions, server
+)
+from .. import config, discord
+from ..audit import audit_log
+from ..models import (
+    Account, Callback, Event, ExplicitNone, ModelList, Scope, Team
+)
+from ..tasks import runner
 
 
 class SignupForm(BaseModel):
@@ -36,10 +42,33 @@ class AccountEditForm(BaseModel):
     discord_token: Optional[str] = None
 
 
+class TeamMoveForm(BaseModel):
+    """A form for moving many accounts to a team at once."""
+
+    accounts: ModelList[Account]
+    team: Union[Team, ExplicitNone]
+
+
+def can_move_account(
+        scope: Scope, account: Account, team: Optional[Team]) -> bool:
+    """Check if a scope may move an account to a team (or None)."""
+    if scope.manage_account_teams:
+        return True
+    if scope.owns_account(account):
+        # Anyone can join a team, or leave their own.
+        return True
+    # Team managers can remove people from their team.
+    return (
+        team is None
+        and account.team_id is not None
+        and scope.owns_team(account.team)
+    )
+
+
 @server.get('/accounts/signups', tags=['accounts'])
 async def signups_open() -> dict[str, Any]:
     """Check if signups are open."""
-    return {'signups_open': SIGNUPS_OPEN}
+    return {'signups_open': config.SIGNUPS_OPEN}
 
 
 @server.post('/accounts/new', status_code=201, tags=['accounts'])
@@ -47,7 +76,7 @@ async def signup(
         data: SignupForm,
         scope: Scope = Depends(authenticate)) -> dict[str, Any]:
     """Create a new account."""
-    if not SIGNUPS_OPEN:
+    if not config.SIGNUPS_OPEN:
         raise HTTPException(403, 'Signups are closed.')
     auth_assert(scope.manage_account_details)
     if data.permissions:
@@ -78,50 +107,56 @@ async def search_for_account(
     return paginate(query)
 
 
+@server.get('/accounts', tags=['accounts'])
+async def get_accounts(
+        batch: BatchIds = Depends(BatchIds)) -> dict[str, Any]:
+    """Get many accounts by ID."""
+    return batch(Account)
+
+
 @server.patch('/account/{account}', tags=['accounts'])
 async def update_account(
-        account: Account, data: AccountEditForm,
-        background_tasks: BackgroundTasks,
-        scope: Scope = Depends(authenticate)) -> Response:
-    """Edit an account."""
+        account: Account, data: AccountEditForm, response: Response,
+        if_match: Optional[str] = Header(None),
+        scope: Scope = Depends(authenticate)) -> dict[str, Any]:
+    """Edit an account.
+
+    Only the fields which change are written, and permissions are granted
+    and revoked atomically. An If-Match header may be given with the
+    account's ETag, so the edit is only made if nobody else has edited the
+    account since.
+    """
+    changes = {}
     if data.name:
         auth_assert(scope.manage_account_details)
-        account.name = data.name
+        changes[Account.name] = data.name
     if data.discriminator:
         auth_assert(scope.manage_account_details)
-        account.discriminator = data.discriminator
+        changes[Account.discriminator] = data.discriminator
     if data.avatar_url:
         auth_assert(scope.manage_account_details)
-        account.avatar_url = data.avatar_url
+        changes[Account.avatar_url] = data.avatar_url
+    team_changed = False
     if data.team:
         if isinstance(data.team, ExplicitNone):
             data.team = None
-        kicking = (
-            account.team
-            and scope.owns_team(account.team)
-            and data.team is None
-        )
-        joining = scope.account and scope.account.id == account.id
-        auth_assert(scope.manage_account_teams or kicking or joining)
-        account.team = data.team
-        background_tasks.add_task(
-            Callback.dispatch_event,
-            Event.ACCOUNT_TEAM_UPDATE,
-            {
-                'account': account.as_dict(),
-                'team': data.team.as_dict() if data.team else None
-            }
-        )
+        auth_assert(can_move_account(scope, account, data.team))
+        changes[Account.team] = data.team
+        team_changed = True
+    permissions = Account.permissions
     if data.grant_permissions:
         auth_assert(scope.can_alter_permissions(
             account.team, data.grant_permissions
         ))
-        account.permissions |= data.grant_permissions
+        permissions = permissions.bin_or(data.grant_permissions)
     if data.revoke_permissions:
         auth_assert(scope.can_alter_permissions(
-            account, data.revoke_permissions
+            account.team, data.revoke_permissions
         ))
-        account.permissions &= ~data.revoke_permissions
+        permissions = permissions.bin_and(~data.revoke_permissions)
+    permissions_changed = permissions is not Account.permissions
+    if permissions_changed:
+        changes[Account.permissions] = permissions
     if data.discord_token:
         try:
             user_data = await discord.get_user(data.discord_token)
@@ -131,16 +166,91 @@ async def update_account(
             raise HTTPException(
                 403, 'Discord token is for a different account.'
             )
-        account.name = user_data.name
-        account.discriminator = user_data.discriminator
-        account.avatar_url = user_data.avatar_url
-    account.save()
+        changes[Account.name] = user_data.name
+        changes[Account.discriminator] = user_data.discriminator
+        changes[Account.avatar_url] = user_data.avatar_url
+    version = parse_if_match(if_match)
+    if version is not None and version != account.version:
+        raise HTTPException(412, 'Account has been edited since.')
+    old_permissions = int(account.permissions)
+    if changes:
+        account = account.update_fields(changes, version)
+        if not account:
+            raise HTTPException(412, 'Account has been edited since.')
+    if permissions_changed:
+        # Signed sessions hold the permissions they were issued with.
+        revoke_signed_sessions([account.id])
+        new_permissions = int(account.permissions)
+        if new_permissions != old_permissions:
+            audit_log.record(
+                scope, 'account.permissions', f'account:{account.id}', {
+                    'permissions': [old_permissions, new_permissions],
+                    'granted': new_permissions & ~old_permissions,
+                    'revoked': old_permissions & ~new_permissions
+                }
+            )
+    if team_changed:
+        await runner.submit(
+            Callback.dispatch_event,
+            Event.ACCOUNT_TEAM_UPDATE,
+            {
+                'account': account.as_dict(),
+                'team': data.team.as_dict() if data.team else None
+            }
+        )
+    response.headers['ETag'] = etag(account.version)
     return account.as_dict()
 
 
+@server.post('/accounts/move_team', tags=['accounts'])
+async def move_accounts_team(
+        data: TeamMoveForm,
+        scope: Scope = Depends(authenticate)) -> dict[str, Any]:
+    """Move many accounts to a team, or remove them from their teams.
+
+    This is done with one query, and the same permissions are needed as
+    for editing each account's team. Accounts edited by another request
+    since they were checked are skipped, rather than moved without being
+    checked again.
+    """
+    team = None if isinstance(data.team, ExplicitNone) else data.team
+    checked = {account.id: account for account in data.accounts}
+    for account in checked.values():
+        auth_assert(can_move_account(scope, account, team))
+    if team:
+        changed = (Account.team != team) | Account.team.is_null()
+    else:
+        changed = Account.team.is_null(False)
+    # The version changes with the team, so this only matches accounts
+    # which are still in the team they were checked in.
+    unchanged = peewee.Tuple(Account.id, Account.version).in_([
+        (account.id, account.version) for account in checked.values()
+    ])
+    moved = Account.update({
+        Account.team: team, Account.version: Account.version + 1
+    }).where(unchanged & changed).returning(Account).execute()
+    accounts = Account.as_dicts(list(moved))
+    moved_ids = {int(account['id']) for account in accounts}
+    team_id = team.id if team else None
+    skipped = [
+        str(id) for id, account in checked.items()
+        if account.team_id != team_id and id not in moved_ids
+    ]
+    if accounts:
+        team_data = team.as_dict() if team else None
+        await runner.submit(
+            Callback.dispatch_events,
+            Event.ACCOUNT_TEAM_UPDATE,
+            [{'account': account, 'team': team_data} for account in accounts]
+        )
+    return {'moved': accounts, 'skipped': skipped}
+
+
 @server.get('/account/{account}', tags=['accounts'])
-async def get_account(account: Account) -> dict[str, Any]:
+async def get_account(
+        account: Account, response: Response) -> dict[str, Any]:
     """Get an account by ID."""
+    response.headers['ETag'] = etag(account.version)
     return account.as_dict()
 
 
@@ -150,4 +260,6 @@ async def delete_account(
     """Delete an account."""
     auth_assert(scope.manage_account_details or scope.owns_account(account))
     account.delete_instance()
+    # Otherwise, its signed sessions would work if it signed up again.
+    revoke_signed_sessions([account.id])
     return Response(status_code=204)
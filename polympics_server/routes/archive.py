@@ -0,0 +1,36 @@
+"""Viewing archived accounts and teams, and their award history."""
+from typing import Any
+
+from fastapi import Depends, HTTPException
+
+from .utils import Paginate, server
+from ..models import ArchivedAccount, ArchivedAwardee, ArchivedTeam, Award
+
+
+@server.get('/archive/account/{account_id}', tags=['archive'])
+async def get_archived_account(account_id: int) -> dict[str, Any]:
+    """Get an archived account, with the awards it was given."""
+    account = ArchivedAccount.get_or_none(ArchivedAccount.id == account_id)
+    if not account:
+        raise HTTPException(404, 'Archived account not found.')
+    return account.as_dict()
+
+
+@server.get('/archive/team/{team_id}', tags=['archive'])
+async def get_archived_team(team_id: int) -> dict[str, Any]:
+    """Get an archived team."""
+    team = ArchivedTeam.get_or_none(ArchivedTeam.id == team_id)
+    if not team:
+        raise HTTPException(404, 'Archived team not found.')
+    return team.as_dict()
+
+
+@server.get('/archive/award/{award}', tags=['archive'])
+async def get_archived_awardees(
+        award: Award,
+        paginate: Paginate = Depends(Paginate)) -> dict[str, Any]:
+    """Get the archived accounts which were given an award."""
+    query = ArchivedAccount.select().join(ArchivedAwardee).where(
+        ArchivedAwardee.award == award.id
+    ).order_by(ArchivedAccount.id)
+    return paginate(query)
@@ -0,0 +1,40 @@
+"""Viewing the audit log."""
+from datetime import datetime
+from typing import Any, Optional
+
+from fastapi import Depends
+
+from .utils import Paginate, auth_assert, authenticate, server
+from ..models import AuditEntry, Scope
+
+
+@server.get('/audit', tags=['audit'])
+async def get_audit_log(
+        action: Optional[str] = None, target: Optional[str] = None,
+        app: Optional[int] = None, account: Optional[int] = None,
+        since: Optional[datetime] = None, until: Optional[datetime] = None,
+        paginate: Paginate = Depends(Paginate),
+        scope: Scope = Depends(authenticate)) -> dict[str, Any]:
+    """Get audit log entries, newest first.
+
+    Entries may be filtered by action, target, the app or account which
+    made the change, and time. Giving a time range means only the months
+    in it are searched.
+    """
+    auth_assert(scope.manage_permissions)
+    query = AuditEntry.select().order_by(
+        AuditEntry.created_at.desc(), AuditEntry.id.desc()
+    )
+    if action:
+        query = query.where(AuditEntry.action == action)
+    if target:
+        query = query.where(AuditEntry.target == target)
+    if app is not None:
+        query = query.where(AuditEntry.actor_app_id == app)
+    if account is not None:
+        query = query.where(AuditEntry.actor_account_id == account)
+    if since:
+        query = query.where(AuditEntry.created_at >= since)
+    if until:
+        query = query.where(AuditEntry.created_at < until)
+    return paginate(query)
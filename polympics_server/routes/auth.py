@@ -1,14 +1,21 @@
 """Endpoints related to user/app authentication."""
+import dataclasses
+import hashlib
+import json
 from typing import Any
 
 from fastapi import Depends, HTTPException
 
 from pydantic import BaseModel
 
-from .utils import auth_assert, authenticate, server
-from .. import discord
-from ..config import SIGNUPS_OPEN
-from ..models import Account, Scope, Session
+from .utils import (
+    auth_assert, authenticate, revoke_signed_sessions, server
+)
+from .. import config, discord
+from ..models import (
+    Account, ArchivedAccount, Scope, Session, SignedSession
+)
+from ..shared import state
 
 
 class DiscordAuthData(BaseModel):
@@ -23,14 +30,46 @@ class SessionData(BaseModel):
     account: Account
 
 
+async def get_discord_user(token: str) -> discord.DiscordUser:
+    """Get the user a Discord token is for.
+
+    The result is cached for DISCORD_USER_CACHE_TTL, by the hash of the
+    token, so clients which log in often don't each wait for Discord.
+    """
+    ttl = config.DISCORD_USER_CACHE_TTL.total_seconds()
+    if not ttl:
+        return await discord.get_user(token)
+    key = 'discord_user:' + hashlib.sha256(token.encode()).hexdigest()
+    if cached := state.get(key):
+        return discord.DiscordUser(**json.loads(cached))
+    user = await discord.get_user(token)
+    state.set(key, json.dumps(dataclasses.asdict(user)), ttl)
+    return user
+
+
+def new_session(account: Account) -> dict[str, Any]:
+    """Create a session for an account, signed if a signing key is set."""
+    account.mark_active()
+    if config.SESSION_SIGNING_KEY:
+        return SignedSession.create(account).as_dict()
+    return Session.create_for(account).as_dict()
+
+
+def get_own_account(scope: Scope) -> Account:
+    """Get the account authenticated as, or raise a 401 error."""
+    account = scope.get_account()
+    if not account:
+        raise HTTPException(401, 'Account no longer exists.')
+    return account
+
+
 @server.post('/auth/create_session', status_code=201, tags=['auth'])
 async def create_session(
         data: SessionData,
         scope: Scope = Depends(authenticate)) -> dict[str, Any]:
     """Create an authentication session for an account."""
     auth_assert(scope.authenticate_users)
-    session = Session.create(account=data.account)
-    return session.as_dict()
+    return new_session(data.account)
 
 
 @server.post('/auth/reset_token', tags=['auth'])
@@ -44,6 +83,12 @@ async def reset_token(scope: Scope = Depends(authenticate)) -> dict[str, Any]:
         scope.account_session.reset_token()
         scope.account_session.save()
         return scope.account.as_dict()
+    if scope.signed_session:
+        # Signed sessions can't be changed, so revoke them and issue a new
+        # one, with the account's current permissions.
+        account = get_own_account(scope)
+        revoke_signed_sessions([account.id])
+        return SignedSession.create(account).as_dict()
     raise HTTPException(401, 'A token was not used to authenticate.')
 
 
@@ -54,6 +99,8 @@ async def get_app(scope: Scope = Depends(authenticate)) -> dict[str, Any]:
         return scope.app.as_dict()
     if scope.account_session:
         return scope.account.as_dict()
+    if scope.signed_session:
+        return get_own_account(scope).as_dict()
     raise HTTPException(401, 'A token was not used to authenticate.')
 
 
@@ -61,14 +108,15 @@ async def get_app(scope: Scope = Depends(authenticate)) -> dict[str, Any]:
 async def discord_authorise(data: DiscordAuthData) -> dict[str, Any]:
     """Create a user session using a Discord user auth token."""
     try:
-        user_data = await discord.get_user(data.token)
+        user_data = await get_discord_user(data.token)
     except ValueError:
         raise HTTPException(401, 'Bad Discord user token.')
-    if SIGNUPS_OPEN:
+    # Archived accounts are moved back when they log in again.
+    account = ArchivedAccount.restore(user_data.id)
+    if not account and config.SIGNUPS_OPEN:
         account = Account.get_or_create_by_user(user_data)
-    else:
+    elif not account:
         account = Account.get_or_none(Account.id == user_data.id)
         if not account:
             raise HTTPException(403, 'Signups are closed.')
-    session = Session.create(account=account)
-    return session.as_dict()
+    return new_session(account)
@@ -5,8 +5,11 @@ from fastapi import Depends, Response
 
 from pydantic import BaseModel
 
-from .utils import auth_assert, authenticate, server
-from ..models import Account, Award, Awardee, Scope, Team
+from .utils import BatchIds, auth_assert, authenticate, server
+from ..audit import audit_log
+from ..models import (
+    Account, Award, Awardee, ModelList, Scope, Team, current_season
+)
 
 
 class AwardCreateForm(BaseModel):
@@ -15,7 +18,7 @@ class AwardCreateForm(BaseModel):
     title: str
     image_url: str
     team: Team
-    accounts: list[Account]
+    accounts: ModelList[Account]
 
 
 class AwardUpdateForm(BaseModel):
@@ -32,17 +35,22 @@ async def create_award(
         scope: Scope = Depends(authenticate)) -> dict[str, Any]:
     """Create a new award."""
     auth_assert(scope.manage_awards)
+    # An award for a team is in the team's season.
     award = Award.create(
         title=data.title,
         image_url=data.image_url,
-        team=data.team
+        team=data.team,
+        season=data.team.season_id if data.team else current_season.get()
     )
-    done = set()
-    for account in data.accounts:
-        if account.id in done:
-            continue
-        done.add(account.id)
-        Awardee.create(account=account, award=award)
+    account_ids = dict.fromkeys(account.id for account in data.accounts)
+    if account_ids:
+        Awardee.insert_many(
+            [{'account': id, 'award': award.id} for id in account_ids]
+        ).execute()
+    audit_log.record(scope, 'award.create', f'award:{award.id}', {
+        'award': award.as_dict(), 'team': award.team_id,
+        'accounts': list(account_ids)
+    })
     return award.as_dict()
 
 
@@ -53,16 +61,32 @@ async def update_award(
         scope: Scope = Depends(authenticate)) -> dict[str, Any]:
     """Update an existing award."""
     auth_assert(scope.manage_awards)
+    diff = {}
     if data.title:
+        diff['title'] = [award.title, data.title]
         award.title = data.title
     if data.image_url:
+        diff['image_url'] = [award.image_url, data.image_url]
         award.image_url = data.image_url
     if data.team:
+        diff['team'] = [award.team_id, data.team.id]
         award.team = data.team
+        # The award moves to the team's season.
+        if award.season_id != data.team.season_id:
+            diff['season'] = [award.season_id, data.team.season_id]
+            award.season = data.team.season_id
     award.save()
+    if diff:
+        audit_log.record(scope, 'award.update', f'award:{award.id}', diff)
     return award.as_dict()
 
 
+@server.get('/awards', tags=['awards'])
+async def get_awards(batch: BatchIds = Depends(BatchIds)) -> dict[str, Any]:
+    """Get many awards by ID."""
+    return batch(Award)
+
+
 @server.get('/award/{award}', tags=['awards'])
 async def get_award(award: Award) -> dict[str, Any]:
     """Get an award."""
@@ -83,6 +107,9 @@ async def delete_award(
         scope: Scope = Depends(authenticate)) -> Response:
     """Delete an award."""
     auth_assert(scope.manage_awards)
+    audit_log.record(scope, 'award.delete', f'award:{award.id}', {
+        'award': award.as_dict(), 'team': award.team_id
+    })
     award.delete_instance()
     return Response(status_code=204)
 
@@ -99,16 +126,27 @@ async def give_award(
     An award may be assigned to multiple users.
     """
     auth_assert(scope.manage_awards)
-    exists = Awardee.select().where(
-        (Awardee.account_id == account.id)
-        & (Awardee.award_id == award.id)
-    ).limit(1).count()
-    if exists:
+    created = Awardee.insert(
+        award=award, account=account
+    ).on_conflict_ignore().execute()
+    if not created:
         return Response(status_code=208)
-    Awardee.create(award=award, account=account)
+    audit_log.record(
+        scope, 'award.give', f'award:{award.id}', {'account': account.id}
+    )
     return Response(status_code=201)
 
 
+@server.get('/account/{account}/awards', tags=['awards'])
+async def get_account_awards(
+        account: Account, season: Optional[int] = None) -> dict[str, Any]:
+    """Get the awards an account was given in a season.
+
+    This is the current season unless another is given.
+    """
+    return {'data': [award.as_dict() for award in account.get_awards(season)]}
+
+
 @server.delete(
     '/account/{account}/award/{award}', status_code=204, tags=['awards']
 )
@@ -128,4 +166,7 @@ async def take_award(
         (Awardee.account_id == account.id)
         & (Awardee.award_id == award.id)
     ).execute()
+    audit_log.record(
+        scope, 'award.take', f'award:{award.id}', {'account': account.id}
+    )
     return Response(status_code=204)
@@ -44,15 +44,7 @@ async def create_callback(
     overwritten.
     """
     app_only(scope)
-    existing = Callback.get_or_none(
-        Callback.app_id == scope.app.id,
-        Callback.event == event.value
-    )
-    if existing:
-        existing.delete_instance()
-    callback = Callback.create(
-        app=scope.app, event=event.value, url=data.url, secret=data.secret
-    )
+    callback = Callback.set_for_app(scope.app, event, data.url, data.secret)
     return callback.as_dict()
 
 
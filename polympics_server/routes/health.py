@@ -0,0 +1,120 @@
+"""Endpoints for load balancers to check the health of the server."""
+from __future__ import annotations
+
+import time
+from typing import Any, Callable
+
+from fastapi.responses import JSONResponse
+
+import peewee
+
+from .utils import server
+from .. import config, requests
+from ..admission import monitor
+from ..models import Migration, db
+from ..models.database import replicas
+from ..tasks import runner
+
+
+class CachedCheck:
+    """A check which only touches the database once per HEALTH_CHECK_TTL.
+
+    This means the ready endpoint can be polled often without adding load.
+    """
+
+    def __init__(self, check: Callable[[], dict[str, Any]]):
+        """Store the check, to be run when first needed."""
+        self.check = check
+        self.result = None
+        self.checked_at = None
+
+    def __call__(self) -> dict[str, Any]:
+        """Get the result of the check, running it if it is out of date."""
+        now = time.monotonic()
+        ttl = config.HEALTH_CHECK_TTL.total_seconds()
+        if self.checked_at is None or now - self.checked_at >= ttl:
+            self.result = self.check()
+            self.checked_at = now
+        return self.result
+
+
+@CachedCheck
+def check_database() -> dict[str, Any]:
+    """Check that the database is up, and how fast it responds."""
+    started_at = time.perf_counter()
+    try:
+        db.execute_sql('SELECT 1')
+    except (peewee.DatabaseError, peewee.InterfaceError) as e:
+        # Reconnect next time, in case the connection was lost.
+        try:
+            db.close()
+        except peewee.PeeweeException:
+            pass
+        return {'ok': False, 'error': type(e).__name__}
+    latency = time.perf_counter() - started_at
+    healthy_replicas = sum(replica.check() for replica in replicas)
+    return {
+        'ok': True,
+        'latency_ms': round(latency * 1000, 2),
+        'replicas': len(replicas),
+        'healthy_replicas': healthy_replicas
+    }
+
+
+@CachedCheck
+def check_migrations() -> dict[str, Any]:
+    """Check that every migration has been applied."""
+    try:
+        pending = Migration.pending()
+    except (peewee.DatabaseError, peewee.InterfaceError) as e:
+        return {'ok': False, 'error': type(e).__name__}
+    return {'ok': not pending, 'pending': pending}
+
+
+def check_tasks() -> dict[str, Any]:
+    """Check that there is room in the background task queue."""
+    return {
+        'ok': runner.queued < runner.queue_size,
+        'queued': runner.queued,
+        'queue_size': runner.queue_size
+    }
+
+
+def check_load() -> dict[str, Any]:
+    """Check that the server is not shedding load."""
+    return {
+        'ok': monitor.retry_after() is None,
+        'in_flight': monitor.in_flight,
+        'loop_lag_ms': round(monitor.lag * 1000, 2)
+    }
+
+
+def check_http() -> dict[str, Any]:
+    """Check that the outbound HTTP session has not been closed."""
+    session = requests.session
+    return {'ok': not (session and session.closed)}
+
+
+@server.get('/health/live', tags=['health'])
+async def live() -> dict[str, Any]:
+    """Check that the server is running."""
+    return {'ok': True}
+
+
+@server.get('/health/ready', tags=['health'])
+async def ready() -> JSONResponse:
+    """Check that the server is able to handle requests.
+
+    Returns a 503 error if any check fails.
+    """
+    checks = {
+        'database': check_database(),
+        'migrations': check_migrations(),
+        'tasks': check_tasks(),
+        'load': check_load(),
+        'http': check_http()
+    }
+    ok = all(check['ok'] for check in checks.values())
+    return JSONResponse(
+        {'ok': ok, 'checks': checks}, status_code=200 if ok else 503
+    )
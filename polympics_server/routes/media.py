@@ -0,0 +1,149 @@
+"""Endpoints for cached award images and avatars."""
+import re
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Query, Request, Response
+from fastapi.responses import RedirectResponse
+
+from starlette.concurrency import run_in_threadpool
+
+from .utils import server
+from .. import config, media
+from ..models import Account, Award
+
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+# Files are content addressed, so they can be cached forever.
+FILE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Files come from other hosts, so never let them run scripts on this one.
+FILE_SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'Content-Security-Policy': "default-src 'none'; sandbox"
+}
+
+
+def media_enabled():
+    """Terminate a request if media caching is not enabled."""
+    if not config.MEDIA_PATH:
+        raise HTTPException(404, 'Media caching is not enabled.')
+
+
+def thumbnail_size(size: Optional[int] = Query(None)) -> Optional[int]:
+    """Check that a requested thumbnail size is one that is stored."""
+    if size is not None and size not in config.THUMBNAIL_SIZES:
+        raise HTTPException(422, 'Size must be one of {}.'.format(
+            ', '.join(map(str, config.THUMBNAIL_SIZES))
+        ))
+    return size
+
+
+async def redirect_to_media(
+        url: Optional[str], size: Optional[int]) -> Response:
+    """Redirect to the cached copy of an image, fetching it if needed."""
+    if not url:
+        raise HTTPException(404, 'No image set.')
+    try:
+        file = await media.get_media(url)
+    except media.MediaError as e:
+        raise HTTPException(502, f'Could not fetch image: {e}')
+    location = f'/media/file/{file.hash}'
+    if size:
+        location += f'?size={size}'
+    # The URL may change, so the redirect should not be cached.
+    return RedirectResponse(
+        location, status_code=307, headers={'Cache-Control': 'no-cache'}
+    )
+
+
+def parse_range(raw: str, length: int) -> Optional[tuple[int, int]]:
+    """Parse a Range header to an inclusive start and end.
+
+    Returns None for ranges which are not supported (such as multiple
+    ranges), in which case the whole file should be sent. Raises an
+    HTTPException for ranges outside of the file.
+    """
+    if not (match := RANGE_RE.fullmatch(raw.strip())):
+        return None
+    raw_start, raw_end = match.groups()
+    if raw_start:
+        start = int(raw_start)
+        end = min(int(raw_end), length - 1) if raw_end else length - 1
+    elif raw_end:
+        # A suffix range, for the last N bytes.
+        start = max(length - int(raw_end), 0)
+        end = length - 1
+    else:
+        return None
+    if start > end or start >= length:
+        raise HTTPException(
+            416, 'Range not satisfiable.',
+            headers={'Content-Range': f'bytes */{length}'}
+        )
+    return start, end
+
+
+@server.get(
+    '/media/award/{award}', status_code=307, tags=['media'],
+    dependencies=[Depends(media_enabled)]
+)
+async def get_award_image(
+        award: Award,
+        size: Optional[int] = Depends(thumbnail_size)) -> Response:
+    """Redirect to the cached image of an award."""
+    return await redirect_to_media(award.image_url, size)
+
+
+@server.get(
+    '/media/avatar/{account}', status_code=307, tags=['media'],
+    dependencies=[Depends(media_enabled)]
+)
+async def get_avatar(
+        account: Account,
+        size: Optional[int] = Depends(thumbnail_size)) -> Response:
+    """Redirect to the cached avatar of an account."""
+    return await redirect_to_media(account.avatar_url, size)
+
+
+@server.get(
+    '/media/file/{hash}', tags=['media'],
+    dependencies=[Depends(media_enabled)]
+)
+async def get_media_file(
+        hash: str, request: Request,
+        size: Optional[int] = Depends(thumbnail_size)) -> Response:
+    """Get a cached image by the hash of its content.
+
+    Supports single byte ranges, and If-None-Match. If a thumbnail can't
+    be made, the original image is sent instead.
+    """
+    try:
+        path = await run_in_threadpool(media.get_path, hash, size)
+    except ValueError:
+        path = None
+    except media.MediaError:
+        path = await run_in_threadpool(media.get_path, hash)
+    if not path:
+        raise HTTPException(404, 'Media file not found.')
+    etag = f'"{path.parent.name}-{path.name}"'
+    headers = {
+        'Cache-Control': FILE_CACHE_CONTROL,
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        **FILE_SECURITY_HEADERS
+    }
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status_code=304, headers=headers)
+    data = await run_in_threadpool(path.read_bytes)
+    # Files stored before only raster images were accepted may be anything.
+    content_type = media.get_content_type(data) or 'application/octet-stream'
+    byte_range = None
+    if raw_range := request.headers.get('Range'):
+        byte_range = parse_range(raw_range, len(data))
+    if not byte_range:
+        return Response(data, media_type=content_type, headers=headers)
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+    return Response(
+        data[start:end + 1], status_code=206, media_type=content_type,
+        headers=headers
+    )
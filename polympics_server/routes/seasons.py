@@ -0,0 +1,15 @@
+"""Viewing seasons."""
+from typing import Any
+
+from .utils import server
+from ..models import Season, current_season
+
+
+@server.get('/seasons', tags=['seasons'])
+async def get_seasons() -> dict[str, Any]:
+    """Get every season, and which is the current one."""
+    seasons = Season.select().order_by(Season.starts_at)
+    return {
+        'data': [season.as_dict() for season in seasons],
+        'current': current_season.get()
+    }
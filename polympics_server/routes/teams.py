@@ -1,12 +1,27 @@
 """Team creation, viewing and editing."""
-from typing import Any
+import json
+from typing import Any, AsyncIterator, Optional, Union
 
-from fastapi import Depends, Response
+from fastapi import Depends, Query, Response
+from fastapi.responses import StreamingResponse
+
+import peewee
 
 from pydantic import BaseModel
 
-from .utils import Paginate, auth_assert, authenticate, server
-from ..models import Scope, Team
+from starlette.concurrency import run_in_threadpool
+
+from .utils import (
+    BatchIds, Paginate, auth_assert, authenticate, server
+)
+from .. import config
+from ..audit import audit_log
+from ..deadlines import Deadline, request_deadline
+from ..models import Account, Scope, Team, current_season
+
+
+# Members are fetched in batches of this size when streaming.
+STREAM_BATCH_SIZE = 1000
 
 
 class TeamData(BaseModel):
@@ -27,21 +42,102 @@ async def create_team(
 
 @server.get('/teams/search', tags=['teams'])
 async def all_teams(
-        q: str = None,
+        q: str = None, season: Optional[int] = None,
         paginate: Paginate = Depends(Paginate)) -> list[dict[str, Any]]:
-    """Get all teams, optionally searching by name."""
-    query = Team.select().order_by(Team.name, Team.id)
+    """Get a season's teams, optionally searching by name.
+
+    This is the current season unless another is given.
+    """
+    query = Team.select().where(
+        Team.season == (season or current_season.get())
+    ).order_by(Team.name, Team.id)
     if q:
         query = query.where(Team.name ** f'%{q}%')
     return paginate(query)
 
 
+@server.get('/teams', tags=['teams'])
+async def get_teams(batch: BatchIds = Depends(BatchIds)) -> dict[str, Any]:
+    """Get many teams by ID."""
+    return batch(Team)
+
+
 @server.get('/team/{team}', tags=['teams'])
 async def get_team(team: Team) -> dict[str, Any]:
     """Get a team by ID."""
     return team.as_dict()
 
 
+def members_query(
+        team_id: int, after: int, limit: int) -> peewee.ModelSelect:
+    """Get a page of team members, using the (team, id) index."""
+    return Account.select(
+        Account.id, Account.name, Account.avatar_url, Account.permissions
+    ).where(
+        (Account.team == team_id) & (Account.id > after)
+    ).order_by(Account.id).limit(limit).dicts()
+
+
+def member_dict(row: dict[str, Any]) -> dict[str, Any]:
+    """Get a member row as a dict to be returned as JSON."""
+    return {**row, 'id': str(row['id'])}
+
+
+def get_members_batch(
+        team_id: int, after: int, timeout: float) -> list[dict[str, Any]]:
+    """Get a batch of team members to stream, with a deadline of its own.
+
+    This runs in a copy of the request's context, so the deadline only
+    applies to this batch.
+    """
+    request_deadline.set(Deadline.start(timeout))
+    return list(members_query(team_id, after, STREAM_BATCH_SIZE))
+
+
+async def stream_members(team_id: int, after: int) -> AsyncIterator[str]:
+    """Get every team member after a given ID, as lines of JSON.
+
+    Each batch gets the request's timeout afresh, so that a large team
+    isn't cut off partway through.
+    """
+    deadline = request_deadline.get()
+    timeout = (
+        deadline.timeout if deadline
+        else config.REQUEST_TIMEOUT.total_seconds()
+    )
+    while True:
+        rows = await run_in_threadpool(
+            get_members_batch, team_id, after, timeout
+        )
+        for row in rows:
+            yield json.dumps(member_dict(row)) + '\n'
+        if len(rows) < STREAM_BATCH_SIZE:
+            return
+        after = rows[-1]['id']
+
+
+@server.get('/team/{team}/members', tags=['teams'])
+async def get_team_members(
+        team: Team, after: int = 0,
+        limit: int = Query(100, ge=1, le=1000),
+        stream: bool = False) -> Union[dict[str, Any], StreamingResponse]:
+    """Get the members of a team, in order of ID.
+
+    Pass the last ID returned as ``after`` to get the next page, or use
+    ``stream`` to get every member as newline delimited JSON.
+    """
+    if stream:
+        return StreamingResponse(
+            stream_members(team.id, after),
+            media_type='application/x-ndjson'
+        )
+    rows = list(members_query(team.id, after, limit))
+    return {
+        'data': [member_dict(row) for row in rows],
+        'next': str(rows[-1]['id']) if len(rows) == limit else None
+    }
+
+
 @server.patch('/team/{team}', tags=['teams'])
 async def edit_team(
         team: Team, data: TeamData,
@@ -58,5 +154,8 @@ async def delete_team(
         team: Team, scope: Scope = Depends(authenticate)) -> Response:
     """Delete a team."""
     auth_assert(scope.manage_teams or scope.owns_team(team))
+    audit_log.record(
+        scope, 'team.delete', f'team:{team.id}', {'team': team.as_dict()}
+    )
     team.delete_instance()
     return Response(status_code=204)
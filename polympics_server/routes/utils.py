@@ -1,17 +1,43 @@
 """Utilities common to all the routes."""
+import asyncio
+import logging
 import math
-from typing import Any
+import signal
+from typing import Any, Awaitable, Callable, Optional
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import (
+    Depends, FastAPI, HTTPException, Query, Request, Response
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 import peewee
 
-from .. import config
-from ..models import App, Scope, Session
+from psycopg2.extensions import QueryCanceledError
+
+from starlette.types import Receive, Scope as ASGIScope, Send
+
+from .. import config, profiles
+from ..admission import monitor
+from ..audit import audit_log
+from ..deadlines import (
+    Deadline, DeadlineExceeded, get_route_timeout, request_deadline
+)
+from ..models import (
+    Account, App, Scope, Session, SignedSession, TokenRevocation,
+    current_season, db, reload_settings, revocations
+)
+from ..models.database import (
+    BaseModel, ReadRouting, get_replica, read_routing, request_cache
+)
+from ..shared import state
+from ..tasks import runner
 
 
+logger = logging.getLogger(__name__)
+
 server = FastAPI(
     debug=config.DEBUG,
     title='Polympics API',
@@ -30,27 +56,288 @@ server = FastAPI(
             'name': 'awards',
             'description': 'Endpoints for managing awards.'
         },
+        {
+            'name': 'seasons',
+            'description': 'Endpoints for the events teams and awards are in.'
+        },
         {
             'name': 'auth',
             'description': 'Endpoints relating to client authentication.'
+        },
+        {
+            'name': 'media',
+            'description': 'Endpoints for cached images.'
+        },
+        {
+            'name': 'archive',
+            'description': 'Endpoints for archived accounts and teams.'
+        },
+        {
+            'name': 'audit',
+            'description': 'Endpoints for viewing the audit log.'
+        },
+        {
+            'name': 'health',
+            'description': 'Endpoints for load balancers to check.'
         }
     ]
 )
 security = HTTPBasic()
+optional_security = HTTPBasic(auto_error=False)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip responses for clients which accept it, except for images."""
+
+    async def __call__(self, scope: ASGIScope, receive: Receive, send: Send):
+        """Handle a request, compressing the response if it is not media."""
+        if scope['type'] == 'http' and scope['path'].startswith('/media/'):
+            # Images are already compressed, and may be sent in ranges.
+            await self.app(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+
+server.add_middleware(
+    CompressionMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE
+)
+
+
+def reread_settings():
+    """Reload the config file and settings, in the background."""
+    runner.submit_nowait(reload_settings, reread=True, blocking=True)
+
+
+def revoke_signed_sessions(account_ids: list[int]):
+    """Revoke the signed sessions of accounts, on every server."""
+    revocations.revoke(account_ids)
+    if config.SESSION_SIGNING_KEY:
+        state.publish('revocations')
+
+
+@server.on_event('startup')
+async def start_tasks():
+    """Start running background tasks."""
+    runner.start()
+    monitor.start()
+    state.start()
+    # Apply settings overridden in the database, then keep them up to date.
+    reload_settings()
+    state.subscribe(
+        'settings',
+        lambda _: runner.submit_nowait(reload_settings, blocking=True)
+    )
+    runner.every(
+        config.SETTINGS_RELOAD_INTERVAL.total_seconds(),
+        reload_settings, blocking=True
+    )
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, reread_settings
+        )
+    except (RuntimeError, ValueError):
+        # Signals can only be handled by the main thread, on Unix.
+        logger.warning('Settings will not be reloaded on SIGHUP.')
+    # Pick up seasons started with the CLI, or scheduled to start.
+    current_season.refresh()
+    state.subscribe(
+        'seasons',
+        lambda _: runner.submit_nowait(current_season.refresh, blocking=True)
+    )
+    runner.every(
+        config.SEASON_REFRESH_INTERVAL.total_seconds(),
+        current_season.refresh, blocking=True
+    )
+    runner.every(
+        config.AUDIT_FLUSH_INTERVAL.total_seconds(),
+        audit_log.flush, blocking=True
+    )
+    runner.every(
+        config.SESSION_PRUNE_INTERVAL.total_seconds(),
+        Session.prune_expired, blocking=True
+    )
+    runner.every(
+        config.SESSION_PRUNE_INTERVAL.total_seconds(),
+        state.prune, blocking=True
+    )
+    if config.SESSION_SIGNING_KEY:
+        revocations.refresh()
+        state.subscribe(
+            'revocations',
+            lambda _: runner.submit_nowait(revocations.refresh, blocking=True)
+        )
+        runner.every(
+            config.TOKEN_REVOCATION_REFRESH_INTERVAL.total_seconds(),
+            revocations.refresh, blocking=True
+        )
+        runner.every(
+            config.SESSION_PRUNE_INTERVAL.total_seconds(),
+            TokenRevocation.prune_expired, blocking=True
+        )
+    if config.DISCORD_BOT_TOKEN and config.PROFILE_SYNC_INTERVAL:
+        runner.every(
+            config.PROFILE_SYNC_INTERVAL.total_seconds(),
+            profiles.sync_profiles
+        )
+
+
+@server.on_event('shutdown')
+async def stop_tasks():
+    """Give background tasks time to finish, then stop them."""
+    monitor.stop()
+    state.stop()
+    await runner.stop(config.TASK_DRAIN_TIMEOUT.total_seconds())
+    # Write whatever is left, now nothing else can add to it.
+    audit_log.flush()
+
+
+@server.middleware('http')
+async def cache_models(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Cache models fetched by ID for the duration of each request."""
+    token = request_cache.set({})
+    try:
+        return await call_next(request)
+    finally:
+        request_cache.reset(token)
 
+
+@server.middleware('http')
+async def route_reads(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Send reads from read-only requests to a replica, if there is one.
+
+    Once a request writes to the primary database, its later reads go to
+    the primary as well.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return await call_next(request)
+    token = read_routing.set(ReadRouting(replica=get_replica()))
+    try:
+        return await call_next(request)
+    finally:
+        read_routing.reset(token)
+
+
+# Middleware added later runs first, so this runs before a request's read
+# routing is set up: taking a token from a database bucket is a write,
+# which would otherwise send the request's reads to the primary.
+@server.middleware('http')
+async def rate_limit(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Limit the rate of requests by app, user account or IP address."""
+    if request.url.path.startswith(('/media/file/', '/health/')):
+        # Cached files are served from disk, and there may be one for every
+        # account on a page. Health checks are polled by load balancers.
+        return await call_next(request)
+    try:
+        credentials = await optional_security(request)
+    except HTTPException:
+        credentials = None
+    try:
+        scope = get_scope(credentials) if credentials else Scope()
+        request.state.scope = scope
+        if scope.app:
+            key = f'app:{scope.app.id}'
+            limit = scope.app.requests_per_minute
+        elif scope.account:
+            key = f'account:{scope.account.id}'
+            limit = config.SESSION_RATE_LIMIT
+        else:
+            host = request.client.host if request.client else ''
+            key = f'ip:{host}'
+            limit = config.ANONYMOUS_RATE_LIMIT
+        bucket = state.hit(key, limit)
+    except (DeadlineExceeded, asyncio.TimeoutError, QueryCanceledError):
+        # The exception handlers only cover the routes, not middleware.
+        return overloaded()
+    if not bucket.allowed:
+        return JSONResponse(
+            {'detail': 'Rate limit exceeded.'},
+            status_code=429, headers=bucket.headers
+        )
+    response = await call_next(request)
+    response.headers.update(bucket.headers)
+    return response
+
+
+@server.middleware('http')
+async def set_deadline(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Limit how long the database and outbound requests can take."""
+    timeout = get_route_timeout(request.url.path)
+    token = request_deadline.set(Deadline.start(timeout))
+    try:
+        return await call_next(request)
+    finally:
+        request_deadline.reset(token)
+
+
+@server.middleware('http')
+async def admit_requests(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """Reject requests while the server is overloaded."""
+    if request.url.path == '/health/live':
+        # Being overloaded doesn't mean the server should be restarted.
+        return await call_next(request)
+    if retry_after := monitor.retry_after():
+        return overloaded(retry_after)
+    monitor.in_flight += 1
+    try:
+        return await call_next(request)
+    finally:
+        monitor.in_flight -= 1
+
+
+# Added last, so that it runs first: responses from the other middleware,
+# such as rate limit and overload errors, need CORS headers too, and
+# preflight requests are answered without being rate limited.
 server.add_middleware(
     CORSMiddleware,
     allow_origins=config.ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['Authorization', 'Content-Type'],
+    expose_headers=[
+        'Retry-After', 'RateLimit-Limit', 'RateLimit-Remaining',
+        'RateLimit-Reset'
+    ]
 )
 
 
+def overloaded(retry_after: int = 1) -> JSONResponse:
+    """Create a response telling the client to try again later."""
+    return JSONResponse(
+        {'detail': 'Server overloaded, try again later.'},
+        status_code=503, headers={'Retry-After': str(retry_after)}
+    )
+
+
+@server.exception_handler(DeadlineExceeded)
+@server.exception_handler(asyncio.TimeoutError)
+async def timed_out(request: Request, error: Exception) -> JSONResponse:
+    """Tell the client to try again if a request took too long."""
+    return overloaded()
+
+
+@server.exception_handler(QueryCanceledError)
+async def query_timed_out(
+        request: Request, error: QueryCanceledError) -> JSONResponse:
+    """Tell the client to try again if a query went over its timeout."""
+    return overloaded()
+
+
 class Paginate:
     """FastAPI dependency for parsing and using pagination options."""
 
-    def __init__(self, page: int = 0, per_page: int = 20):
+    def __init__(
+            self, page: int = Query(0, ge=0),
+            per_page: int = Query(20, ge=1, le=config.MAX_PER_PAGE)):
         """Store the options."""
         self.page = page
         self.per_page = per_page
@@ -59,10 +346,10 @@ class Paginate:
         """Apply the pagination options to a query and return the result."""
         total = query.count()
         total_pages = math.ceil(total / self.per_page)
-        data = [
-            record.as_dict() for record in
+        # Get the related data for the whole page at once.
+        data = query.model.as_dicts(list(
             query.offset(self.page * self.per_page).limit(self.per_page)
-        ]
+        ))
         return {
             'page': self.page,
             'per_page': self.per_page,
@@ -72,30 +359,112 @@ class Paginate:
         }
 
 
-def authenticate(
-        credentials: HTTPBasicCredentials = Depends(security)) -> Scope:
+class BatchIds:
+    """FastAPI dependency for fetching many objects by ID at once."""
+
+    def __init__(self, ids: str):
+        """Parse a comma separated list of IDs."""
+        # Map the parsed IDs to the IDs as given, to report missing ones.
+        self.ids = {}
+        for raw in ids.split(','):
+            if not (raw := raw.strip()):
+                continue
+            try:
+                self.ids.setdefault(int(raw), raw)
+            except ValueError:
+                raise HTTPException(422, 'Invalid ID: must be int.')
+        if len(self.ids) > config.MAX_BATCH_SIZE:
+            raise HTTPException(
+                422,
+                f'Cannot fetch more than {config.MAX_BATCH_SIZE} objects '
+                'at once.'
+            )
+
+    def __call__(self, model: type[BaseModel]) -> dict[str, Any]:
+        """Get the objects in one query, and report any which are missing."""
+        records = {
+            record.id: record
+            for record in model.select().where(model.id.in_(list(self.ids)))
+        }
+        found = [records[id] for id in self.ids if id in records]
+        missing = [raw for id, raw in self.ids.items() if id not in records]
+        return {'data': model.as_dicts(found), 'missing': missing}
+
+
+def get_scope(credentials: HTTPBasicCredentials) -> Scope:
     """Check a username and password (RFC 7617) for authentication."""
+    if credentials.username.upper().startswith('T'):
+        # Signed sessions are checked without the database.
+        signed_session = SignedSession.verify(
+            credentials.username, credentials.password
+        )
+        if (
+                not signed_session
+                or signed_session.expired
+                or signed_session.revoked):
+            return Scope()
+        return signed_session.scope
     if credentials.username.upper().startswith('A'):
         model = App
+        query = App.select()
     elif credentials.username.upper().startswith('S'):
         model = Session
+        # Get the account with the session, since the scope needs it.
+        query = Session.select(Session, Account).join(Account)
     else:
         return Scope()
     try:
         id = int(credentials.username[1:])
     except ValueError:
         return Scope()
-    session = model.get_or_none(
+    # Use the primary database, since a replica might not have a newly
+    # created session yet.
+    session = query.where(
         (model.id == id) & (model.token == credentials.password)
-    )
+    ).bind(db).first()
     if not session:
         return Scope()
     if session.expired:
-        session.delete_instance()
+        runner.submit_nowait(session.delete_instance, blocking=True)
         return Scope()
+    if model is Session and session.needs_extending:
+        runner.submit_nowait(session.extend, blocking=True)
     return session.scope
 
 
+def authenticate(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(security)) -> Scope:
+    """Get the authorisation scope of the request.
+
+    The credentials have usually already been checked by the rate limiting
+    middleware, in which case the result is reused.
+    """
+    scope = getattr(request.state, 'scope', None)
+    if scope is None:
+        scope = get_scope(credentials)
+    return scope
+
+
+def etag(version: int) -> str:
+    """Get the ETag header value for a version of an object."""
+    return f'"{version}"'
+
+
+def parse_if_match(raw: Optional[str]) -> Optional[int]:
+    """Get the version required by an If-Match header, if any.
+
+    Raises a 412 error if the header is not a version ETag.
+    """
+    if raw is None or raw.strip() == '*':
+        return None
+    raw = raw.strip().removeprefix('W/')
+    try:
+        return int(raw.strip('"'))
+    except ValueError:
+        raise HTTPException(412, 'If-Match header does not match.')
+
+
 def auth_assert(value: bool):
     """Make sure that the given value is truthy."""
     if not value:
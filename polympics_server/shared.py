@@ -0,0 +1,244 @@
+"""State shared between worker processes, and between servers.
+
+The backend is chosen with SHARED_STATE_BACKEND:
+
+- ``memory``: each worker process has its own state, so this is only
+  suitable for running a single worker.
+- ``database``: state is kept in unlogged tables in the primary database,
+  and messages are sent with ``LISTEN``/``NOTIFY``, so it is shared by
+  every worker of every server using the database.
+
+Each backend provides a cache of strings with expiry times, rate limit
+buckets and publish/subscribe messages. Messages are received by every
+subscribed worker, including the one which sent them.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+import psycopg2
+
+from . import config
+from .models import db
+from .ratelimits import Bucket, DatabaseBackend, MemoryBackend
+
+
+logger = logging.getLogger(__name__)
+
+Listener = Callable[[str], None]
+
+CHANNEL_RE = re.compile('[a-z_]+')
+# Added to channel names, so they don't clash with other applications
+# using the same database.
+CHANNEL_PREFIX = 'polympics_'
+
+
+def check_channel(channel: str):
+    """Check a channel name, since it is used in SQL."""
+    if not CHANNEL_RE.fullmatch(channel):
+        raise ValueError(f'Invalid channel name {channel!r}.')
+
+
+class MemoryState:
+    """State kept in memory, and not shared with other processes."""
+
+    def __init__(self):
+        """Set up the empty state."""
+        self.limiter = MemoryBackend()
+        # Map of keys to values and monotonic expiry times.
+        self.cache: dict[str, tuple[str, float]] = {}
+        self.listeners: dict[str, list[Listener]] = defaultdict(list)
+
+    def start(self):
+        """Do nothing, since there is nothing to connect to."""
+
+    def stop(self):
+        """Do nothing, since there is nothing to disconnect from."""
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a value from the cache, if it is there and not expired."""
+        value, expires_at = self.cache.get(key, (None, 0))
+        if expires_at <= time.monotonic():
+            return None
+        return value
+
+    def set(self, key: str, value: str, ttl: float):
+        """Store a value in the cache, for ttl seconds."""
+        self.cache[key] = value, time.monotonic() + ttl
+
+    def delete(self, key: str):
+        """Remove a value from the cache."""
+        self.cache.pop(key, None)
+
+    def prune(self):
+        """Drop expired cache entries and full rate limit buckets."""
+        now = time.monotonic()
+        self.cache = {
+            key: (value, expires_at)
+            for key, (value, expires_at) in self.cache.items()
+            if expires_at > now
+        }
+        self.limiter.prune(now)
+
+    def hit(self, key: str, limit: int) -> Bucket:
+        """Take a token from a rate limit bucket, if there is one."""
+        return self.limiter.hit(key, limit)
+
+    def subscribe(self, channel: str, listener: Listener):
+        """Call a function with each message sent to a channel."""
+        check_channel(channel)
+        self.listeners[channel].append(listener)
+
+    def publish(self, channel: str, message: str = ''):
+        """Send a message to the subscribers of a channel."""
+        check_channel(channel)
+        for listener in self.listeners[channel]:
+            listener(message)
+
+
+class DatabaseState:
+    """State kept in the database, shared with every process using it."""
+
+    # How long to wait before reconnecting a lost listening connection.
+    reconnect_delay = 5
+
+    def __init__(self):
+        """Create the cache table if it does not already exist."""
+        self.limiter = DatabaseBackend()
+        with db.atomic():
+            # Workers starting at once would otherwise race to create it.
+            db.execute_sql(
+                "SELECT pg_advisory_xact_lock(hashtext('shared_state'))"
+            )
+            db.execute_sql(
+                'CREATE UNLOGGED TABLE IF NOT EXISTS shared_cache ('
+                'key VARCHAR(255) PRIMARY KEY, '
+                'value TEXT NOT NULL, '
+                'expires_at TIMESTAMP NOT NULL)'
+            )
+        self.listeners: dict[str, list[Listener]] = defaultdict(list)
+        self.connection = None
+        # The file descriptor being watched for messages, if any.
+        self.fd: Optional[int] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        """Start listening for messages, on a connection of its own."""
+        self.loop = asyncio.get_running_loop()
+        self._connect()
+
+    def stop(self):
+        """Stop listening for messages."""
+        self._disconnect()
+        self.loop = None
+
+    def _connect(self):
+        """Open the listening connection, and listen to every channel."""
+        if not self.loop:
+            return
+        try:
+            self.connection = psycopg2.connect(
+                dbname=config.DB_NAME, user=config.DB_USER,
+                password=config.DB_PASSWORD, host=config.DB_HOST,
+                port=config.DB_PORT
+            )
+            self.connection.autocommit = True
+            for channel in self.listeners:
+                self._listen(channel)
+        except psycopg2.Error:
+            logger.exception('Could not listen for shared state messages.')
+            self._disconnect()
+            self.loop.call_later(self.reconnect_delay, self._connect)
+            return
+        self.fd = self.connection.fileno()
+        self.loop.add_reader(self.fd, self._receive)
+
+    def _disconnect(self):
+        """Close the listening connection, if it is open."""
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def _listen(self, channel: str):
+        """Start receiving messages from a channel."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{CHANNEL_PREFIX}{channel}"')
+
+    def _receive(self):
+        """Pass on the messages received by the listening connection."""
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.warning('Lost connection for shared state messages.')
+            self._disconnect()
+            self.loop.call_later(self.reconnect_delay, self._connect)
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            channel = notify.channel[len(CHANNEL_PREFIX):]
+            for listener in self.listeners[channel]:
+                listener(notify.payload)
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a value from the cache, if it is there and not expired."""
+        row = db.execute_sql(
+            'SELECT value FROM shared_cache '
+            'WHERE key = %s AND expires_at > now()', (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float):
+        """Store a value in the cache, for ttl seconds."""
+        db.execute_sql(
+            'INSERT INTO shared_cache (key, value, expires_at) '
+            "VALUES (%s, %s, now() + %s * INTERVAL '1 second') "
+            'ON CONFLICT (key) DO UPDATE SET '
+            'value = EXCLUDED.value, expires_at = EXCLUDED.expires_at',
+            (key, value, ttl)
+        )
+
+    def delete(self, key: str):
+        """Remove a value from the cache."""
+        db.execute_sql('DELETE FROM shared_cache WHERE key = %s', (key,))
+
+    def prune(self):
+        """Delete expired cache entries and full rate limit buckets."""
+        db.execute_sql('DELETE FROM shared_cache WHERE expires_at <= now()')
+        self.limiter.prune()
+
+    def hit(self, key: str, limit: int) -> Bucket:
+        """Take a token from a rate limit bucket, if there is one."""
+        return self.limiter.hit(key, limit)
+
+    def subscribe(self, channel: str, listener: Listener):
+        """Call a function with each message sent to a channel."""
+        check_channel(channel)
+        self.listeners[channel].append(listener)
+        if self.connection:
+            self._listen(channel)
+
+    def publish(self, channel: str, message: str = ''):
+        """Send a message to the subscribers of a channel.
+
+        If this is done in a transaction, it is sent when it commits.
+        """
+        check_channel(channel)
+        db.execute_sql(
+            'SELECT pg_notify(%s, %s)', (CHANNEL_PREFIX + channel, message)
+        )
+
+
+BACKENDS = {
+    'memory': MemoryState,
+    'database': DatabaseState
+}
+
+state = BACKENDS[config.SHARED_STATE_BACKEND]()
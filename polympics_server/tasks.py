@@ -0,0 +1,226 @@
+"""Run background tasks in-process, with bounded concurrency.
+
+Tasks are queued, and run by a fixed number of workers. Blocking tasks
+(such as database queries) are run in a thread pool, so they don't block
+the event loop. On shutdown, queued tasks are given time to finish.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import dataclasses
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class Task:
+    """A task waiting to be run."""
+
+    callback: Callable
+    args: tuple[Any, ...]
+    kwargs: dict[str, Any]
+    blocking: bool
+    queued_at: float = dataclasses.field(default_factory=time.monotonic)
+
+    @property
+    def name(self) -> str:
+        """Get a name for the task, for logs."""
+        return getattr(self.callback, '__qualname__', repr(self.callback))
+
+    async def run(self, executor: ThreadPoolExecutor):
+        """Run the task, in the thread pool if it is blocking."""
+        if self.blocking:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, functools.partial(
+                self.callback, *self.args, **self.kwargs
+            ))
+        else:
+            await self.callback(*self.args, **self.kwargs)
+
+
+@dataclasses.dataclass
+class TaskStats:
+    """Counts and timings of tasks that have been run."""
+
+    completed: int = 0
+    failed: int = 0
+    dropped: int = 0
+    total_wait: float = 0
+    total_run_time: float = 0
+    max_latency: float = 0
+
+    def record(self, wait: float, run_time: float, failed: bool):
+        """Record a task having been run."""
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self.total_wait += wait
+        self.total_run_time += run_time
+        self.max_latency = max(self.max_latency, wait + run_time)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Get the stats as a dict, with averages in seconds."""
+        count = (self.completed + self.failed) or 1
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'average_wait': self.total_wait / count,
+            'average_run_time': self.total_run_time / count,
+            'max_latency': self.max_latency
+        }
+
+
+class TaskRunner:
+    """A queue of background tasks, and the workers to run them."""
+
+    def __init__(self, workers: int, queue_size: int, threads: int):
+        """Set up the runner, to be started once the event loop is."""
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(threads)
+        self.stats = TaskStats()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._schedules: list[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        """Get the number of tasks waiting to be run."""
+        return self.queue.qsize() if self.queue else 0
+
+    def _create_task(self, coro: Awaitable) -> asyncio.Task:
+        """Start a long running task, outside of any request's context."""
+        return contextvars.Context().run(self.loop.create_task, coro)
+
+    def start(self):
+        """Start the workers, if they have not been started."""
+        if self.loop:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self._workers = [
+            self._create_task(self._work()) for _ in range(self.workers)
+        ]
+
+    async def _work(self):
+        """Run tasks from the queue, forever."""
+        while True:
+            task = await self.queue.get()
+            started_at = time.monotonic()
+            failed = False
+            try:
+                await task.run(self.executor)
+            except Exception:
+                logger.exception('Background task %s failed.', task.name)
+                failed = True
+            finally:
+                self.stats.record(
+                    started_at - task.queued_at,
+                    time.monotonic() - started_at,
+                    failed
+                )
+                self.queue.task_done()
+
+    async def submit(
+            self, callback: Callable, *args: Any, blocking: bool = False,
+            **kwargs: Any):
+        """Queue a task, waiting for space in the queue if it is full."""
+        self.start()
+        await self.queue.put(Task(callback, args, kwargs, blocking))
+
+    def submit_nowait(
+            self, callback: Callable, *args: Any, blocking: bool = False,
+            **kwargs: Any):
+        """Queue a task, dropping it if the queue is full.
+
+        This may be called from another thread while the runner is running.
+        If the runner has not been started and there is no event loop to
+        start it on (such as in a CLI command), blocking tasks are run
+        straight away, and others are dropped.
+        """
+        task = Task(callback, args, kwargs, blocking)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop and not self.loop:
+            self.start()
+        if not self.loop:
+            self._run_now(task)
+        elif running_loop is self.loop:
+            self._put_nowait(task)
+        else:
+            self.loop.call_soon_threadsafe(self._put_nowait, task)
+
+    def _run_now(self, task: Task):
+        """Run a blocking task in this thread, since it can't be queued."""
+        if not task.blocking:
+            logger.warning('No event loop to run %s on, dropped.', task.name)
+            self.stats.dropped += 1
+            return
+        started_at = time.monotonic()
+        failed = False
+        try:
+            task.callback(*task.args, **task.kwargs)
+        except Exception:
+            logger.exception('Background task %s failed.', task.name)
+            failed = True
+        finally:
+            self.stats.record(0, time.monotonic() - started_at, failed)
+
+    def _put_nowait(self, task: Task):
+        """Queue a task, dropping it if the queue is full."""
+        try:
+            self.queue.put_nowait(task)
+        except asyncio.QueueFull:
+            logger.warning('Task queue full, dropped %s.', task.name)
+            self.stats.dropped += 1
+
+    def every(
+            self, interval: float, callback: Callable, *args: Any,
+            blocking: bool = False, **kwargs: Any):
+        """Queue a task every interval seconds."""
+        async def schedule():
+            while True:
+                await asyncio.sleep(interval)
+                await self.submit(
+                    callback, *args, blocking=blocking, **kwargs
+                )
+
+        self.start()
+        self._schedules.append(self._create_task(schedule()))
+
+    async def stop(self, timeout: float):
+        """Wait up to timeout seconds for queued tasks, then stop."""
+        if not self.loop:
+            return
+        for task in self._schedules:
+            task.cancel()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                'Stopped with %d background tasks unfinished.', self.queued
+            )
+        for task in self._workers:
+            task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+runner = TaskRunner(
+    workers=config.TASK_WORKERS,
+    queue_size=config.TASK_QUEUE_SIZE,
+    threads=config.TASK_THREADS
+)
@@ -0,0 +1 @@
+"""Tests for the server, run with pytest."""
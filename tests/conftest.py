@@ -0,0 +1,290 @@
+"""Fixtures for testing the server, with no outside services.
+
+The tests use the database configured with environment variables (at
+least ``db_password``), in a schema of their own which is created when
+the session starts and dropped when it ends. Each test runs in a
+transaction which is rolled back afterwards, unless it is marked
+``committed``, in which case its rows are deleted instead.
+
+Discord and callback receivers are replaced by the fake server in
+``polympics_server.fake_discord``, which is run in a thread.
+"""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import itertools
+import os
+import pathlib
+import threading
+import uuid
+from typing import Any, Callable, Iterator, Optional, Union
+
+import pytest
+
+
+if (pathlib.Path(__file__).parent.parent / 'config.json').exists():
+    # The config file would be used instead of the settings below.
+    pytest.exit('Move config.json aside to run the tests.', returncode=4)
+
+SCHEMA = f'test_{uuid.uuid4().hex[:12]}'
+# A website allowed to make requests to the server.
+ORIGIN = 'https://client.example.com'
+os.environ['db_schema'] = SCHEMA
+os.environ['allowed_origins'] = ORIGIN
+os.environ.setdefault('discord_bot_token', 'test-bot-token')
+
+from aiohttp import web    # noqa:E402
+
+from fastapi.testclient import TestClient    # noqa:E402
+
+from polympics_server import (    # noqa:E402
+    config, fake_discord, media, requests
+)
+from polympics_server.models import (    # noqa:E402
+    Account, App, Award, Awardee, Session, Team, current_season, db
+)
+from polympics_server.routes import server    # noqa:E402
+from polympics_server.shared import state    # noqa:E402
+
+
+# Used to make up unique IDs and names.
+counter = itertools.count(1000)
+
+
+def pytest_configure(config: pytest.Config):
+    """Register the markers used by these fixtures."""
+    config.addinivalue_line(
+        'markers',
+        'committed: run the test outside of a transaction, so that other '
+        'connections can see its changes, and delete its rows afterwards.'
+    )
+
+
+def pytest_unconfigure(config: pytest.Config):
+    """Drop the test schema, which was created when the server was imported.
+
+    This is done even if the tests could not be collected.
+    """
+    for session in (requests.session, media.session):
+        if session and not session.closed:
+            asyncio.get_event_loop().run_until_complete(session.close())
+    with db.atomic():
+        db.execute_sql("SET LOCAL lock_timeout = '10s'")
+        db.execute_sql(f'DROP SCHEMA {SCHEMA} CASCADE')
+    db.close()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database() -> str:
+    """Get the name of the test schema.
+
+    The first season is created now, so that no test's transaction owns
+    it.
+    """
+    current_season.refresh()
+    return SCHEMA
+
+
+def delete_rows():
+    """Delete every row added by a committed test.
+
+    Seasons and migrations are kept, since they are set up once.
+    """
+    tables = [
+        table for table in db.get_tables()
+        if table not in ('season', 'migration')
+    ]
+    with db.atomic():
+        # Fail rather than wait forever for a connection left open.
+        db.execute_sql("SET LOCAL lock_timeout = '10s'")
+        db.execute_sql(f'TRUNCATE {", ".join(tables)} CASCADE')
+
+
+@pytest.fixture(autouse=True)
+def transaction(request: pytest.FixtureRequest) -> Iterator[None]:
+    """Roll back the changes made by each test.
+
+    Requests made with the test client are handled on this thread, so
+    they share its connection and transaction. Background tasks run in
+    other threads, and don't see the test's rows.
+    """
+    state.cache.clear()
+    state.limiter.buckets.clear()
+    if request.node.get_closest_marker('committed'):
+        try:
+            yield
+        finally:
+            delete_rows()
+            current_season.refresh()
+        return
+    with db.atomic() as txn:
+        yield
+        txn.rollback()
+    # A season started by the test has gone.
+    current_season.refresh()
+
+
+@pytest.fixture
+def settings() -> Iterator[Callable[..., None]]:
+    """Override settings for a test, as if set with ``config set``.
+
+    Values are given as they would be in the config file. Settings which
+    need a restart can't be changed.
+    """
+    overrides: dict[str, Any] = {}
+
+    def override(**values: Any):
+        overrides.update(values)
+        config.reload(overrides)
+
+    yield override
+    config.reload({})
+
+
+@pytest.fixture
+def client() -> TestClient:
+    """Get a client which makes requests to the server in-process.
+
+    Startup tasks are not run, so there are no background schedules.
+    """
+    return TestClient(server)
+
+
+@dataclasses.dataclass
+class FakeDiscord:
+    """The fake Discord API and callback receiver, running in a thread."""
+
+    app: web.Application
+    url: str
+
+    @property
+    def users(self) -> dict[int, dict[str, Any]]:
+        """Get the made up Discord users, by ID."""
+        return self.app['users']
+
+    @property
+    def webhooks(self) -> list[dict[str, Any]]:
+        """Get the callbacks received, oldest first."""
+        return self.app['webhooks']
+
+    def webhook_url(self, name: str) -> str:
+        """Get a URL to point a callback at."""
+        return f'{self.url}/webhooks/{name}'
+
+
+@pytest.fixture(scope='session')
+def fake_discord_server() -> Iterator[FakeDiscord]:
+    """Run the fake Discord server on a free port, for the whole session."""
+    app = fake_discord.create_app()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    host, port = runner.addresses[0][:2]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield FakeDiscord(app=app, url=f'http://{host}:{port}')
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+@pytest.fixture
+def discord(
+        fake_discord_server: FakeDiscord,
+        settings: Callable[..., None]) -> FakeDiscord:
+    """Point the server at the fake Discord server, with no users yet.
+
+    Any Discord token like ``user-1234`` logs in as a user with that ID.
+    """
+    fake_discord_server.users.clear()
+    fake_discord_server.webhooks.clear()
+    settings(
+        discord_api_url=fake_discord_server.url,
+        discord_cdn_url=fake_discord_server.url
+    )
+    return fake_discord_server
+
+
+@pytest.fixture
+def make_team() -> Callable[..., Team]:
+    """Get a function to create teams, with made up names by default."""
+    def make(**fields: Any) -> Team:
+        fields.setdefault('name', f'Team {next(counter)}')
+        return Team.create(**fields)
+
+    return make
+
+
+@pytest.fixture
+def make_account() -> Callable[..., Account]:
+    """Get a function to create accounts, with made up IDs and names."""
+    def make(**fields: Any) -> Account:
+        id = fields.setdefault('id', next(counter))
+        fields.setdefault('name', f'User {id}')
+        fields.setdefault('discriminator', f'{id % 10000:04}')
+        return Account.create(**fields)
+
+    return make
+
+
+@pytest.fixture
+def make_award(
+        make_team: Callable[..., Team]) -> Callable[..., Award]:
+    """Get a function to create awards, and give them to accounts.
+
+    The award is given to a new team, unless a team is passed.
+    """
+    def make(accounts: tuple[Account, ...] = (), **fields: Any) -> Award:
+        if 'team' not in fields:
+            fields['team'] = make_team()
+        if fields['team']:
+            # Awards are in the same season as their team.
+            fields.setdefault('season', fields['team'].season_id)
+        fields.setdefault('title', f'Award {next(counter)}')
+        fields.setdefault('image_url', 'https://example.com/award.png')
+        award = Award.create(**fields)
+        for account in accounts:
+            Awardee.create(award=award, account=account)
+        return award
+
+    return make
+
+
+@pytest.fixture
+def make_app() -> Callable[..., App]:
+    """Get a function to create apps, with no permissions by default."""
+    def make(**fields: Any) -> App:
+        fields.setdefault('name', f'App {next(counter)}')
+        return App.create(**fields)
+
+    return make
+
+
+@pytest.fixture
+def make_session(
+        make_account: Callable[..., Account]) -> Callable[..., Session]:
+    """Get a function to create sessions, for a new account by default."""
+    def make(account: Optional[Account] = None, **fields: Any) -> Session:
+        return Session.create(account=account or make_account(), **fields)
+
+    return make
+
+
+@pytest.fixture
+def auth() -> Callable[[Union[App, Session]], tuple[str, str]]:
+    """Get a function to make credentials for an app or session.
+
+    These are for the ``auth`` argument of the test client.
+    """
+    def credentials(owner: Union[App, Session]) -> tuple[str, str]:
+        if isinstance(owner, App):
+            data = owner.as_dict(with_token=True)
+        else:
+            data = owner.as_dict()
+        return data['username'], data['password']
+
+    return credentials
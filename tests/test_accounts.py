@@ -0,0 +1,47 @@
+"""Tests for creating, editing and moving accounts."""
+from typing import Callable, Optional, Union
+
+from fastapi.testclient import TestClient
+
+from polympics_server.models import Account, App, Scope, Session, Team
+from polympics_server.models.permissions import Permissions
+from polympics_server.routes import accounts as account_routes
+
+import pytest
+
+
+def test_move_team_moved_since_checked(
+        client: TestClient, monkeypatch: pytest.MonkeyPatch,
+        make_team: Callable[..., Team],
+        make_account: Callable[..., Account],
+        make_session: Callable[..., Session],
+        auth: Callable[[Union[App, Session]], tuple[str, str]]):
+    """Accounts moved by another request after being checked are skipped."""
+    team, other_team = make_team(), make_team()
+    manager = make_account(
+        team=team, permissions=int(Permissions.MANAGE_OWN_TEAM)
+    )
+    moving, staying = make_account(team=team), make_account(team=team)
+    check = account_routes.can_move_account
+
+    def check_then_move(
+            scope: Scope, account: Account, team: Optional[Team]) -> bool:
+        allowed = check(scope, account, team)
+        if account.id == moving.id:
+            # Another request moves the account once it has been checked.
+            Account.update({
+                Account.team: other_team,
+                Account.version: Account.version + 1
+            }).where(Account.id == moving.id).execute()
+        return allowed
+
+    monkeypatch.setattr(account_routes, 'can_move_account', check_then_move)
+    response = client.post('/accounts/move_team', auth=auth(
+        make_session(manager)
+    ), json={'accounts': [str(moving.id), str(staying.id)], 'team': 0})
+    assert response.status_code == 200
+    data = response.json()
+    assert [account['id'] for account in data['moved']] == [str(staying.id)]
+    assert data['skipped'] == [str(moving.id)]
+    assert Account.get_by_id(moving.id).team_id == other_team.id
+    assert Account.get_by_id(staying.id).team_id is None
@@ -0,0 +1,29 @@
+"""Tests for archiving and restoring inactive accounts."""
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+
+from polympics_server.models import Account, App, ArchivedAccount
+from polympics_server.models.permissions import Permissions
+
+
+def test_restore_keeps_version(
+        client: TestClient, make_account: Callable[..., Account],
+        make_app: Callable[..., App],
+        auth: Callable[[Any], tuple[str, str]]):
+    """An ETag from before an account was archived is stale once restored."""
+    app = make_app(permissions=int(Permissions.MANAGE_ACCOUNT_DETAILS))
+    account = make_account(version=3)
+    etag = client.get(f'/account/{account.id}').headers['ETag']
+    ArchivedAccount.archive_inactive(
+        datetime.now() + timedelta(days=1), batch_size=100
+    )
+    assert not Account.select().where(Account.id == account.id).exists()
+    restored = ArchivedAccount.restore(account.id)
+    assert restored.version == 4
+    response = client.patch(
+        f'/account/{account.id}', json={'name': 'Stale edit'},
+        headers={'If-Match': etag}, auth=auth(app)
+    )
+    assert response.status_code == 412
@@ -0,0 +1,30 @@
+"""Tests for creating and editing awards."""
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+
+from polympics_server.models import App, Award, Season, Team
+from polympics_server.models.permissions import Permissions
+
+
+def test_move_award_to_other_season(
+        client: TestClient, make_app: Callable[..., App],
+        make_team: Callable[..., Team], make_award: Callable[..., Award],
+        auth: Callable[[Any], tuple[str, str]]):
+    """An award moved to a team in another season moves to that season."""
+    app = make_app(permissions=int(Permissions.MANAGE_AWARDS))
+    old_team = make_team()
+    award = make_award(team=old_team)
+    season = Season.create(
+        name='Next season', starts_at=datetime.now() - timedelta(seconds=1)
+    )
+    new_team = make_team(season=season)
+    response = client.patch(
+        f'/award/{award.id}', json={'team': new_team.id}, auth=auth(app)
+    )
+    assert response.status_code == 200
+    assert response.json()['season'] == season.id
+    team_awards = client.get(f'/team/{new_team.id}').json()['awards']
+    assert [item['id'] for item in team_awards] == [award.id]
+    assert client.get(f'/team/{old_team.id}').json()['awards'] == []
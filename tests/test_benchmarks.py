@@ -0,0 +1,16 @@
+"""Check that the benchmarks run, so they are there when needed."""
+from polympics_server import benchmarks
+from polympics_server.models import Team
+
+
+def test_auth():
+    """Every case runs, and leaves no rows behind."""
+    teams = Team.select().count()
+    results = list(benchmarks.run(number=1, repeat=1))
+    assert [result.name for result in results] == [
+        'app scope + checks', 'session scope + checks',
+        'can_alter_permissions', 'get_scope (app) + checks',
+        'get_scope (session) + checks'
+    ]
+    assert all(result.seconds > 0 for result in results)
+    assert Team.select().count() == teams
@@ -0,0 +1,69 @@
+"""Tests for the timeouts given to database queries."""
+import logging
+
+from polympics_server.deadlines import Deadline, request_deadline
+from polympics_server.models import db
+
+import pytest
+
+
+def timeout_statements(caplog: pytest.LogCaptureFixture) -> list[str]:
+    """Get the SET statements sent, from Peewee's log."""
+    return [
+        record.msg[0] for record in caplog.records
+        if str(record.msg[0]).startswith('SET')
+    ]
+
+
+def test_timeout_once_per_transaction(caplog: pytest.LogCaptureFixture):
+    """The timeout is set once in a transaction, not before each query."""
+    caplog.set_level(logging.DEBUG, logger='peewee')
+    token = request_deadline.set(Deadline.start(5))
+    try:
+        with db.atomic():
+            for _ in range(3):
+                db.execute_sql('SELECT 1')
+            timeout, = db.execute_sql('SHOW statement_timeout').fetchone()
+        assert timeout == '5s'
+        assert timeout_statements(caplog) == [
+            'SET LOCAL statement_timeout = %s'
+        ]
+    finally:
+        request_deadline.reset(token)
+
+
+def test_timeout_after_savepoint_rollback(caplog: pytest.LogCaptureFixture):
+    """A timeout undone by rolling back a savepoint is set again."""
+    caplog.set_level(logging.DEBUG, logger='peewee')
+    token = request_deadline.set(Deadline.start(5))
+    try:
+        with db.atomic():
+            with db.atomic() as savepoint:
+                db.execute_sql('SELECT 1')
+                savepoint.rollback()
+            timeout, = db.execute_sql('SHOW statement_timeout').fetchone()
+        assert timeout == '5s'
+        assert timeout_statements(caplog) == [
+            'SET LOCAL statement_timeout = %s'
+        ] * 2
+    finally:
+        request_deadline.reset(token)
+
+
+@pytest.mark.committed
+def test_timeout_after_transaction_rollback(
+        caplog: pytest.LogCaptureFixture):
+    """A transaction rolled back and begun again sets its timeout again."""
+    caplog.set_level(logging.DEBUG, logger='peewee')
+    token = request_deadline.set(Deadline.start(5))
+    try:
+        with db.atomic() as transaction:
+            db.execute_sql('SELECT 1')
+            transaction.rollback()
+            timeout, = db.execute_sql('SHOW statement_timeout').fetchone()
+        assert timeout == '5s'
+        assert timeout_statements(caplog) == [
+            'SET LOCAL statement_timeout = %s'
+        ] * 2
+    finally:
+        request_deadline.reset(token)
@@ -0,0 +1,124 @@
+"""Check that the test fixtures work, so other tests can rely on them."""
+import asyncio
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+
+from polympics_server import discord as discord_api
+from polympics_server.models import (
+    Account, App, Award, Callback, Session, Team, db
+)
+from polympics_server.models.callbacks import Event
+
+from .conftest import FakeDiscord
+
+
+# Created by one test, and should be gone by the next.
+ROLLED_BACK_TEAM = 'Rolled back team'
+
+
+def test_schema(database: str):
+    """Tables are created in the session's own schema."""
+    search_path, = db.execute_sql('SHOW search_path').fetchone()
+    assert search_path == database
+    assert 'team' in db.get_tables(database)
+
+
+def test_transaction_creates():
+    """Rows created by a test are seen by the rest of the test."""
+    Team.create(name=ROLLED_BACK_TEAM)
+    assert db.in_transaction()
+    assert Team.select().where(Team.name == ROLLED_BACK_TEAM).exists()
+
+
+def test_transaction_rolled_back():
+    """Rows created by the last test were rolled back."""
+    assert not Team.select().where(Team.name == ROLLED_BACK_TEAM).exists()
+
+
+def test_settings(client: TestClient, settings: Callable[..., None]):
+    """Settings can be overridden for one test."""
+    settings(signups_open='false')
+    assert client.get('/accounts/signups').json() == {'signups_open': False}
+
+
+def test_make_team(client: TestClient, make_team: Callable[..., Team]):
+    """Teams are created in the current season."""
+    team = make_team()
+    response = client.get(f'/team/{team.id}')
+    assert response.status_code == 200
+    assert response.json()['name'] == team.name
+
+
+def test_make_account(
+        client: TestClient, make_account: Callable[..., Account],
+        make_team: Callable[..., Team]):
+    """Accounts can be put in a team."""
+    team = make_team()
+    account = make_account(team=team)
+    data = client.get(f'/account/{account.id}').json()
+    assert data['name'] == account.name
+    assert data['team']['id'] == team.id
+
+
+def test_make_award(
+        client: TestClient, make_account: Callable[..., Account],
+        make_award: Callable[..., Award]):
+    """Awards are given to accounts, in their team's season."""
+    account = make_account()
+    award = make_award(accounts=[account])
+    assert award.season_id == award.team.season_id
+    data = client.get(f'/account/{account.id}/awards').json()
+    assert [item['id'] for item in data['data']] == [award.id]
+
+
+def test_make_app(
+        client: TestClient, make_app: Callable[..., App],
+        auth: Callable[[Any], tuple[str, str]]):
+    """Apps can authenticate with their credentials."""
+    app = make_app(permissions=1)
+    data = client.get('/auth/me', auth=auth(app)).json()
+    assert data['username'] == f'A{app.id}'
+    assert data['permissions'] == 1
+
+
+def test_make_session(
+        client: TestClient, make_session: Callable[..., Session],
+        auth: Callable[[Any], tuple[str, str]]):
+    """Sessions authenticate as their account."""
+    session = make_session()
+    data = client.get('/auth/me', auth=auth(session)).json()
+    assert data['id'] == str(session.account.id)
+
+
+def test_discord_login(client: TestClient, discord: FakeDiscord):
+    """The fake Discord API accepts made up user tokens."""
+    response = client.post('/auth/discord', json={'token': 'user-1234'})
+    assert response.status_code == 200
+    assert client.get('/account/1234').json()['name'] == 'User 1234'
+    response = client.post('/auth/discord', json={'token': 'not-a-user'})
+    assert response.status_code == 401
+
+
+def test_discord_bot(discord: FakeDiscord):
+    """The fake Discord API serves users to the bot token."""
+    loop = asyncio.get_event_loop()
+    user = loop.run_until_complete(discord_api.get_user_by_id(42))
+    assert user.name == 'User 42'
+    assert user.avatar_url.startswith(discord.url)
+
+
+def test_webhooks(discord: FakeDiscord, make_app: Callable[..., App]):
+    """Callbacks sent to the fake webhook receiver are recorded."""
+    app = make_app()
+    url = discord.webhook_url('team')
+    Callback.set_for_app(app, Event.ACCOUNT_TEAM_UPDATE, url, 'secret')
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(Callback.dispatch_event(
+        Event.ACCOUNT_TEAM_UPDATE, {'account': 1}
+    ))
+    assert discord.webhooks == [{
+        'path': '/webhooks/team',
+        'authorization': 'Bearer secret',
+        'body': {'account': 1}
+    }]
@@ -0,0 +1,18 @@
+"""Tests for the health check endpoints."""
+from fastapi.testclient import TestClient
+
+from polympics_server.models import Migration, db
+from polympics_server.models.migrations import MIGRATIONS
+
+
+def test_new_database_migrated(client: TestClient, database: str):
+    """A new database has every migration applied when it is set up."""
+    assert Migration.pending() == []
+    # Made by a migration, rather than with the table.
+    indexes = db.get_indexes('team', database)
+    assert ['season_id', 'name', 'id'] in [
+        index.columns for index in indexes
+    ]
+    check = client.get('/health/ready').json()['checks']['migrations']
+    assert check == {'ok': True, 'pending': []}
+    assert len(MIGRATIONS) == Migration.select().count()
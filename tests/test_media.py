@@ -0,0 +1,131 @@
+"""Tests for fetching, storing and serving cached images."""
+import dataclasses
+import hashlib
+import io
+import pathlib
+import threading
+from typing import Callable
+
+from fastapi.testclient import TestClient
+
+from polympics_server import config, media
+from polympics_server.models import Account
+
+import pytest
+
+from .conftest import FakeDiscord
+
+
+@pytest.fixture
+def media_path(
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch) -> pathlib.Path:
+    """Cache images in a temporary directory.
+
+    The setting needs a restart, so it is patched rather than overridden.
+    """
+    monkeypatch.setattr(config, 'settings', dataclasses.replace(
+        config.settings, media_path=tmp_path
+    ))
+    return tmp_path
+
+
+def test_cmyk_thumbnail(media_path: pathlib.Path):
+    """Thumbnails are made of images in modes PNG doesn't support."""
+    image_module = pytest.importorskip('PIL.Image')
+    output = io.BytesIO()
+    image_module.new('CMYK', (300, 200), (0, 255, 255, 0)).save(
+        output, 'JPEG'
+    )
+    hash = media.store(output.getvalue())
+    for size in config.THUMBNAIL_SIZES:
+        with image_module.open(media.get_path(hash, size)) as thumbnail:
+            assert thumbnail.format == 'PNG'
+            assert max(thumbnail.size) == min(size, 300)
+
+
+def test_write_file_threads(media_path: pathlib.Path):
+    """Threads writing the same file don't share a temporary file."""
+    path = media_path / 'file'
+    contents = [bytes([n]) * 100_000 for n in range(16)]
+    barrier = threading.Barrier(len(contents), timeout=30)
+    errors = []
+
+    def write(data: bytes):
+        barrier.wait()
+        try:
+            for _ in range(20):
+                media.write_file(path, data)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=write, args=(data,)) for data in contents
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert path.read_bytes() in contents
+    assert [file.name for file in media_path.iterdir()] == ['file']
+
+
+@pytest.mark.parametrize('host', ['127.0.0.1', 'localhost'])
+def test_private_address(
+        client: TestClient, media_path: pathlib.Path,
+        fake_discord_server: FakeDiscord,
+        make_account: Callable[..., Account], host: str):
+    """Images are not fetched from private addresses, by IP or by name."""
+    port = fake_discord_server.url.rsplit(':', 1)[1]
+    account = make_account(
+        avatar_url=f'http://{host}:{port}/embed/avatars/1.png'
+    )
+    response = client.get(
+        f'/media/avatar/{account.id}', allow_redirects=False
+    )
+    assert response.status_code == 502
+    assert not list(media_path.iterdir())
+
+
+def test_discord_cdn(
+        client: TestClient, media_path: pathlib.Path,
+        discord: FakeDiscord, make_account: Callable[..., Account]):
+    """The configured Discord CDN is trusted, even on a private address."""
+    account = make_account(avatar_url=f'{discord.url}/embed/avatars/1.png')
+    response = client.get(
+        f'/media/avatar/{account.id}', allow_redirects=False
+    )
+    assert response.status_code == 307
+    response = client.get(response.headers['Location'])
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/png'
+
+
+@pytest.mark.parametrize('data,content_type', [
+    (b'\x89PNG\r\n\x1a\n...', 'image/png'),
+    (b'\xff\xd8\xff\xe0...', 'image/jpeg'),
+    (b'GIF89a...', 'image/gif'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ...', 'image/webp'),
+    (b'<svg xmlns="http://www.w3.org/2000/svg"><script/></svg>', None),
+    (b'<html><script>alert(1)</script></html>', None)
+])
+def test_content_type(data: bytes, content_type: str):
+    """Only raster images are recognised, whatever they were sent as."""
+    assert media.get_content_type(data) == content_type
+
+
+def test_file_headers(client: TestClient, media_path: pathlib.Path):
+    """Files are never served in a way which could run scripts."""
+    data = b'<svg xmlns="http://www.w3.org/2000/svg"><script/></svg>'
+    hash = hashlib.sha256(data).hexdigest()
+    directory = media.get_directory(hash)
+    directory.mkdir(parents=True)
+    (directory / 'original').write_bytes(data)
+    response = client.get(f'/media/file/{hash}')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/octet-stream'
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+    assert response.headers['Content-Security-Policy'] == (
+        "default-src 'none'; sandbox"
+    )
@@ -0,0 +1,53 @@
+"""Tests for the middleware every request goes through."""
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+
+from polympics_server.models.database import read_routing
+from polympics_server.ratelimits import Bucket
+from polympics_server.shared import state
+
+import pytest
+
+from .conftest import ORIGIN
+
+
+def test_rate_limit_before_read_routing(
+        client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    """Rate limiting doesn't stop reads going to a replica."""
+    hit = state.hit
+    routings = []
+
+    def record_hit(*args: Any) -> Bucket:
+        routings.append(read_routing.get())
+        return hit(*args)
+
+    monkeypatch.setattr(state, 'hit', record_hit)
+    assert client.get('/accounts/signups').status_code == 200
+    assert routings == [None]
+
+
+def test_cors_rate_limited(
+        client: TestClient, settings: Callable[..., None]):
+    """Browsers can read rate limit errors, and when to try again."""
+    settings(anonymous_rate_limit='1')
+    headers = {'Origin': ORIGIN}
+    assert client.get('/accounts/signups', headers=headers).ok
+    response = client.get('/accounts/signups', headers=headers)
+    assert response.status_code == 429
+    assert response.headers['Access-Control-Allow-Origin'] == ORIGIN
+    exposed = response.headers['Access-Control-Expose-Headers'].split(',')
+    assert 'Retry-After' in [header.strip() for header in exposed]
+
+
+def test_cors_preflight(client: TestClient, settings: Callable[..., None]):
+    """Preflight requests don't use up the rate limit."""
+    settings(anonymous_rate_limit='1')
+    for _ in range(3):
+        response = client.options('/accounts/signups', headers={
+            'Origin': ORIGIN,
+            'Access-Control-Request-Method': 'GET',
+            'Access-Control-Request-Headers': 'Authorization'
+        })
+        assert response.status_code == 200
+    assert client.get('/accounts/signups').status_code == 200
@@ -0,0 +1,39 @@
+"""Check that timeouts give 503 responses, wherever they happen."""
+from typing import Any
+
+from fastapi.testclient import TestClient
+
+from polympics_server.deadlines import DeadlineExceeded
+from polympics_server.routes import utils
+from polympics_server.shared import state
+
+from psycopg2.extensions import QueryCanceledError
+
+import pytest
+
+
+def raise_error(error: Exception) -> Any:
+    """Make a function which raises an error when called."""
+    def fail(*args: Any, **kwargs: Any):
+        raise error
+
+    return fail
+
+
+def test_rate_limit_deadline(
+        client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    """A deadline passing while rate limiting is not a server error."""
+    monkeypatch.setattr(
+        utils, 'get_scope', raise_error(DeadlineExceeded('Too slow.'))
+    )
+    response = client.get('/accounts/signups', auth=('A1', 'token'))
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_rate_limit_query_canceled(
+        client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    """A rate limit query timing out is not a server error."""
+    monkeypatch.setattr(state, 'hit', raise_error(QueryCanceledError()))
+    response = client.get('/accounts/signups')
+    assert response.status_code == 503
@@ -0,0 +1,44 @@
+"""Tests for syncing account profiles with Discord."""
+import asyncio
+import socket
+from typing import Callable
+
+from polympics_server import discord as discord_api, profiles
+from polympics_server.models import Account, ProfileSync
+
+from .conftest import FakeDiscord
+
+
+def test_one_sync_per_process(
+        discord: FakeDiscord, make_account: Callable[..., Account]):
+    """Syncs started together in one process don't both run."""
+    account = make_account(name='Old name')
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(asyncio.gather(
+        profiles.sync_profiles(), profiles.sync_profiles()
+    ))
+    assert results.count(None) == 1
+    assert Account.get_by_id(account.id).name == f'User {account.id}'
+
+
+def test_sync_past_unreachable_discord(
+        discord: FakeDiscord, settings: Callable[..., None],
+        make_account: Callable[..., Account]):
+    """A batch which can't reach Discord still moves the sync on."""
+    first = make_account()
+    make_account()
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        # Nothing is listening, so connections are refused.
+        settings(discord_api_url=f'http://127.0.0.1:{sock.getsockname()[1]}')
+        loop = asyncio.get_event_loop()
+        result = loop.run_until_complete(profiles.sync_profiles(batch_size=1))
+    assert result == (1, 0)
+    assert ProfileSync.get().last_account_id == first.id
+
+
+def test_unparseable_retry_after():
+    """A rate limit with a Retry-After which isn't a number waits a second."""
+    assert discord_api.parse_seconds('soon') == 1
+    assert discord_api.parse_seconds(None) == 1
+    assert discord_api.parse_seconds('2.5') == 2.5
@@ -0,0 +1,178 @@
+"""Check that the database backend shares state between processes.
+
+Each test runs two servers in processes of their own, using the test
+schema, as if they were workers behind a load balancer.
+"""
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Iterator
+
+from polympics_server import config
+from polympics_server.models import App, db
+from polympics_server.models.permissions import ALL_PERMISSIONS
+
+import pytest
+
+import requests
+
+from .conftest import FakeDiscord
+
+
+# How long Discord users are cached for, in seconds.
+CACHE_TTL = 1
+# Long enough that only a message could explain a change.
+SETTINGS = {
+    'shared_state_backend': 'database',
+    'anonymous_rate_limit': '5',
+    'settings_reload_interval': '1h',
+    'session_signing_key': 'test-signing-key',
+    'token_revocation_refresh_interval': '1h',
+    'discord_user_cache_ttl': f'{CACHE_TTL}s'
+}
+# How long to wait for a server to start, or a message to arrive.
+TIMEOUT = 15
+
+pytestmark = pytest.mark.committed
+
+
+def free_port() -> int:
+    """Find a port nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(check: Callable[[], bool]) -> bool:
+    """Wait until a check passes, returning False if it never does."""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def is_live(url: str) -> bool:
+    """Check if a server has started."""
+    try:
+        return requests.get(url + '/health/live').status_code == 200
+    except requests.ConnectionError:
+        return False
+
+
+@pytest.fixture
+def server_env(fake_discord_server: FakeDiscord) -> dict[str, str]:
+    """Get the environment to run servers and the CLI with."""
+    return {
+        **os.environ,
+        **SETTINGS,
+        'discord_api_url': fake_discord_server.url,
+        'discord_cdn_url': fake_discord_server.url
+    }
+
+
+@pytest.fixture
+def servers(server_env: dict[str, str]) -> Iterator[tuple[str, str]]:
+    """Run two servers, and get their URLs."""
+    ports = free_port(), free_port()
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable, '-m', 'uvicorn',
+                'polympics_server:application', '--port', str(port),
+                '--log-level', 'warning'
+            ],
+            cwd=config.BASE_PATH, env=server_env
+        )
+        for port in ports
+    ]
+    urls = tuple(f'http://127.0.0.1:{port}' for port in ports)
+    try:
+        assert wait_for(lambda: all(map(is_live, urls))), (
+            'The servers did not start.'
+        )
+        yield urls
+    finally:
+        # Stop them before their rows are deleted.
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(TIMEOUT)
+
+
+def cli(env: dict[str, str], *args: str):
+    """Run a management command, as an administrator would."""
+    subprocess.run(
+        [sys.executable, '-m', 'polympics_server', *args],
+        cwd=config.BASE_PATH, env=env, check=True, capture_output=True
+    )
+
+
+def test_rate_limit(servers: tuple[str, str]):
+    """Requests to either server take from the same rate limit bucket."""
+    statuses = [
+        requests.get(servers[n % 2] + '/accounts/signups').status_code
+        for n in range(6)
+    ]
+    assert statuses == [200] * 5 + [429]
+
+
+def test_settings_message(
+        servers: tuple[str, str], server_env: dict[str, str]):
+    """Settings changed with the CLI apply to both servers straight away."""
+    app = App.create(name='Test', permissions=ALL_PERMISSIONS)
+    credentials = f'A{app.id}', app.token
+
+    def signups_open(url: str) -> bool:
+        response = requests.get(url + '/accounts/signups', auth=credentials)
+        return response.json()['signups_open']
+
+    cli(server_env, 'config', 'set', 'signups_open', 'false')
+    assert wait_for(lambda: not any(map(signups_open, servers)))
+    cli(server_env, 'config', 'unset', 'signups_open')
+    assert wait_for(lambda: all(map(signups_open, servers)))
+
+
+def test_revocations_message(servers: tuple[str, str]):
+    """A signed session revoked on one server is rejected by the other."""
+    first, second = servers
+    data = requests.post(
+        first + '/auth/discord', json={'token': 'user-1234'}
+    ).json()
+    old = data['username'], data['password']
+    assert requests.get(second + '/auth/me', auth=old).status_code == 200
+    data = requests.post(first + '/auth/reset_token', auth=old).json()
+    new = data['username'], data['password']
+    assert wait_for(lambda: requests.get(
+        second + '/auth/me', auth=old
+    ).status_code == 401)
+    assert requests.get(second + '/auth/me', auth=new).status_code == 200
+
+
+def test_cache_expiry(
+        servers: tuple[str, str], fake_discord_server: FakeDiscord):
+    """Cached Discord users are shared, until they expire."""
+    first, second = servers
+    users = fake_discord_server.users
+    token = 'user-4321'
+    key = 'discord_user:' + hashlib.sha256(token.encode()).hexdigest()
+    response = requests.post(first + '/auth/discord', json={'token': token})
+    assert response.status_code == 200
+    cached, = db.execute_sql(
+        'SELECT count(*) FROM shared_cache WHERE key = %s', (key,)
+    ).fetchone()
+    assert cached == 1
+    # The fake server makes users up when they are first asked for, so
+    # this shows whether it was asked again.
+    users.clear()
+    response = requests.post(second + '/auth/discord', json={'token': token})
+    assert response.status_code == 200
+    assert 4321 not in users
+    time.sleep(CACHE_TTL)
+    response = requests.post(second + '/auth/discord', json={'token': token})
+    assert response.status_code == 200
+    assert 4321 in users
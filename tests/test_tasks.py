@@ -0,0 +1,24 @@
+"""Tests for the background task runner."""
+from concurrent.futures import ThreadPoolExecutor
+
+from polympics_server.tasks import TaskRunner
+
+
+def test_submit_without_loop():
+    """With no event loop, blocking tasks run straight away in any thread."""
+    runner = TaskRunner(workers=1, queue_size=10, threads=1)
+    ran = []
+
+    async def not_blocking():
+        ran.append('not blocking')
+
+    def submit():
+        runner.submit_nowait(ran.append, 'blocking', blocking=True)
+        runner.submit_nowait(not_blocking)
+
+    with ThreadPoolExecutor(1) as executor:
+        executor.submit(submit).result()
+    assert ran == ['blocking']
+    assert runner.loop is None
+    assert runner.stats.completed == 1
+    assert runner.stats.dropped == 1
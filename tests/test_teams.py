@@ -0,0 +1,42 @@
+"""Tests for viewing teams and their members."""
+import json
+import time
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+
+import peewee
+
+from polympics_server.models import Account, Team
+from polympics_server.routes import teams
+
+import pytest
+
+
+@pytest.mark.committed
+def test_stream_members(
+        client: TestClient, settings: Callable[..., None],
+        monkeypatch: pytest.MonkeyPatch,
+        make_team: Callable[..., Team],
+        make_account: Callable[..., Account]):
+    """Streams longer than the request timeout are sent in full.
+
+    Batches are read in other threads, so the rows are committed.
+    """
+    team = make_team()
+    accounts = [make_account(team=team) for _ in range(5)]
+    members_query = teams.members_query
+
+    def slow_members_query(*args: Any) -> peewee.ModelSelect:
+        time.sleep(0.2)
+        return members_query(*args)
+
+    monkeypatch.setattr(teams, 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setattr(teams, 'members_query', slow_members_query)
+    settings(route_timeouts='/team/=300ms')
+    response = client.get(f'/team/{team.id}/members?stream=true')
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [
+        str(account.id) for account in accounts
+    ]
@@ -0,0 +1,124 @@
+"""Check that upserts stay correct when run at the same time.
+
+Each thread has its own database connection, and the threads race to
+create the same rows, so these tests commit their changes.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi.testclient import TestClient
+
+from polympics_server.discord import DiscordUser
+from polympics_server.models import (
+    Account, App, Award, Awardee, Callback, db
+)
+from polympics_server.models.callbacks import Event
+from polympics_server.models.permissions import Permissions
+from polympics_server.routes import server
+
+import pytest
+
+
+THREADS = 16
+ROUNDS = 20
+# Above the IDs the factories make up.
+FIRST_USER_ID = 10 ** 17
+
+pytestmark = pytest.mark.committed
+
+
+def race(work: Callable[[int, int], Any]) -> list[list[Any]]:
+    """Call work(thread, round) from every thread at once, for each round.
+
+    Returns the results of each round, from every thread. Each thread
+    closes its connection when it is done.
+    """
+    barrier = threading.Barrier(THREADS, timeout=30)
+
+    def run(thread: int) -> list[Any]:
+        try:
+            results = []
+            for round in range(ROUNDS):
+                barrier.wait()
+                results.append(work(thread, round))
+            return results
+        except BaseException:
+            # Stop the other threads, rather than leave them waiting.
+            barrier.abort()
+            raise
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        by_thread = list(executor.map(run, range(THREADS)))
+    return [list(results) for results in zip(*by_thread)]
+
+
+def test_get_or_create_by_user():
+    """Logging in as a new user at once creates one account."""
+    def work(thread: int, round: int) -> int:
+        user = DiscordUser(
+            id=FIRST_USER_ID + round, name=f'User {round}',
+            avatar_url='https://example.com/avatar.png',
+            discriminator='0001'
+        )
+        return Account.get_or_create_by_user(user).id
+
+    rounds = race(work)
+    for round, ids in enumerate(rounds):
+        assert set(ids) == {FIRST_USER_ID + round}
+    assert Account.select().where(
+        Account.id >= FIRST_USER_ID
+    ).count() == ROUNDS
+
+
+def test_set_for_app(make_app: Callable[..., App]):
+    """Setting an app's callback at once leaves one callback."""
+    app = make_app()
+
+    def work(thread: int, round: int) -> int:
+        url = f'https://example.com/{thread}/{round}'
+        callback = Callback.set_for_app(
+            app, Event.ACCOUNT_TEAM_UPDATE, url, 'secret'
+        )
+        assert callback.url == url
+        return callback.id
+
+    rounds = race(work)
+    assert len({id for ids in rounds for id in ids}) == 1
+    callback, = Callback.select().where(Callback.app == app)
+    assert callback.url in {
+        f'https://example.com/{thread}/{ROUNDS - 1}'
+        for thread in range(THREADS)
+    }
+
+
+def test_give_award(
+        make_app: Callable[..., App], make_account: Callable[..., Account],
+        make_award: Callable[..., Award],
+        auth: Callable[[Any], tuple[str, str]]):
+    """Giving an award at once gives it once, and reports it once."""
+    app = make_app(
+        permissions=int(Permissions.MANAGE_AWARDS), rate_limit=100_000
+    )
+    credentials = auth(app)
+    award = make_award()
+    accounts = [make_account() for _ in range(ROUNDS)]
+    clients = threading.local()
+
+    def work(thread: int, round: int) -> int:
+        if not hasattr(clients, 'client'):
+            clients.client = TestClient(server)
+        response = clients.client.put(
+            f'/account/{accounts[round].id}/award/{award.id}',
+            auth=credentials
+        )
+        return response.status_code
+
+    rounds = race(work)
+    for statuses in rounds:
+        assert sorted(statuses) == [201] + [208] * (THREADS - 1)
+    assert Awardee.select().where(
+        Awardee.award == award
+    ).count() == ROUNDS